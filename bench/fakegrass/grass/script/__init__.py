@@ -0,0 +1,979 @@
+"""
+A local stand-in for grass.script, for benchmarking the modules without a GRASS installation.
+The GRASS commands the modules run are emulated in python on a small on-disk "mapset"
+in the directory given by the HECRAS_BENCH_DB environment variable:
+vector maps are pickled feature lists, attribute tables live in a real sqlite database,
+and rasters are raw float64 files with a JSON header.
+Every command is appended to calls.log in that directory, one JSON record per line.
+Only the commands and options used by the modules are emulated
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import math
+import shutil
+import fnmatch
+import pickle
+import sqlite3
+import atexit
+import tempfile as _tempfile
+import subprocess
+from collections import OrderedDict
+import numpy as np
+
+try:
+	import builtins
+except ImportError:
+	import __builtin__ as builtins
+
+PIPE = subprocess.PIPE
+
+LOCATION = 'bench'
+MAPSET = 'PERMANENT'
+DATABASE = '$GISDBASE/$LOCATION_NAME/$MAPSET/sqlite/sqlite.db'
+
+
+class CommandError(Exception):
+	pass
+
+
+def _root():
+	root = os.environ.get('HECRAS_BENCH_DB')
+	if not root:
+		sys.stderr.write("ERROR: HECRAS_BENCH_DB is not set\n")
+		sys.exit(1)
+	if not os.path.isdir(root):
+		os.makedirs(root)
+	return root
+
+
+def _mapset_dir(*parts):
+	return os.path.join(_root(), LOCATION, MAPSET, *parts)
+
+
+def _database():
+	return _mapset_dir('sqlite', 'sqlite.db')
+
+
+def _connect():
+	if not os.path.isdir(_mapset_dir('sqlite')):
+		os.makedirs(_mapset_dir('sqlite'))
+	return sqlite3.connect(_database())
+
+
+def _log(prog, flags, options):
+	with open(os.path.join(_root(), 'calls.log'), 'a') as f:
+		f.write(json.dumps({'time': time.time(), 'command': prog, 'flags': flags,
+			'args': dict((k, str(v)) for k, v in options.items())}, sort_keys=True) + "\n")
+
+
+# Messages
+# As in grass.script, each message is a g.message command, logged and timed like the others
+
+def message(msg, flag=None):
+	run_command("g.message", flags=flag, message=msg)
+
+
+def verbose(msg):
+	message(msg, flag='v')
+
+
+def important(msg):
+	message(msg, flag='i')
+
+
+def info(msg):
+	message(msg, flag='i')
+
+
+def debug(msg, debug=1):
+	run_command("g.message", flags='d', message=msg, debug=debug)
+
+
+def warning(msg):
+	message(msg, flag='w')
+
+
+def error(msg):
+	message(msg, flag='e')
+
+
+def fatal(msg):
+	error(msg)
+	sys.exit(1)
+
+
+def percent(i, n, s):
+	message("%d %d %d\n" % (i, n, s), flag='p')
+
+
+# Environment
+
+def gisenv():
+	return {'GISDBASE': _root(), 'LOCATION_NAME': LOCATION, 'MAPSET': MAPSET}
+
+
+def overwrite():
+	return os.environ.get('GRASS_OVERWRITE') == '1'
+
+
+def tempfile(create=True):
+	tmp_dir = _mapset_dir('.tmp')
+	if not os.path.isdir(tmp_dir):
+		os.makedirs(tmp_dir)
+	fd, path = _tempfile.mkstemp(dir=tmp_dir)
+	os.close(fd)
+	if not create:
+		os.remove(path)
+	return path
+
+
+def parse_key_val(s, sep='=', dflt=None, val_type=None, vsep=None):
+	result = OrderedDict()
+	if not s:
+		return result
+	for line in s.splitlines():
+		line = line.strip()
+		if not line:
+			continue
+		kv = line.split(sep, 1)
+		k = kv[0].strip()
+		v = kv[1].strip() if len(kv) > 1 else dflt
+		if val_type is not None and v is not None:
+			v = val_type(v)
+		result[k] = v
+	return result
+
+
+def _script_definitions(script):
+	"""
+	The options (with their default answers), required options and flags declared
+	in the #% header of a module
+	"""
+	options = OrderedDict()
+	required = []
+	flags = OrderedDict()
+	kind = None
+	entry = {}
+	with open(script) as f:
+		for line in f:
+			if not line.startswith("#%"):
+				continue
+			text = line[2:].strip()
+			if text.split()[:1] in (['option'], ['flag']):
+				kind = text.split()[0]
+				entry = {}
+			elif text == "end" and kind is not None:
+				if kind == 'flag':
+					flags[entry['key']] = False
+				else:
+					options[entry['key']] = entry.get('answer', '')
+					if entry.get('required') == 'yes':
+						required.append(entry['key'])
+				kind = None
+			elif kind is not None and ":" in text:
+				k, v = text.split(":", 1)
+				entry[k.strip()] = v.strip()
+	return options, required, flags
+
+
+def parser():
+	"""
+	Parse the command line (key=value options and -flags) against the header of the running script
+	"""
+	builtins.__dict__.setdefault('_', lambda s: s)
+	options, required, flags = _script_definitions(os.path.abspath(sys.argv[0]))
+	for arg in sys.argv[1:]:
+		if arg in ('--o', '--overwrite'):
+			os.environ['GRASS_OVERWRITE'] = '1'
+		elif arg in ('--q', '--quiet'):
+			os.environ['GRASS_VERBOSE'] = '0'
+		elif arg in ('--v', '--verbose'):
+			os.environ['GRASS_VERBOSE'] = '3'
+		elif arg.startswith("-") and "=" not in arg:
+			for key in arg[1:]:
+				if key not in flags:
+					fatal("Sorry, <%s> is not a valid flag" % key)
+				flags[key] = True
+		elif "=" in arg:
+			key, value = arg.split("=", 1)
+			if key not in options:
+				fatal("Sorry, <%s> is not a valid parameter" % key)
+			options[key] = value
+		else:
+			fatal("Sorry, <%s> is not a valid argument" % arg)
+	for key in required:
+		if not options[key]:
+			fatal("Required parameter <%s> not set" % key)
+	return options, flags
+
+
+# Vector maps
+
+def _vector_dir(name):
+	return _mapset_dir('vector', name.split("@")[0])
+
+
+def _load_vector(name):
+	path = os.path.join(_vector_dir(name), 'features.pkl')
+	if not os.path.exists(path):
+		raise CommandError("Vector map <%s> not found" % name)
+	with open(path, 'rb') as f:
+		return pickle.load(f)
+
+
+def _save_vector(name, vect):
+	vdir = _vector_dir(name)
+	if not os.path.isdir(vdir):
+		os.makedirs(vdir)
+	with open(os.path.join(vdir, 'features.pkl'), 'wb') as f:
+		pickle.dump(vect, f, 2)
+
+
+def _delete_vector(name):
+	"""
+	Remove a vector map with its attribute tables, as Vect_delete does (g.remove, or
+	an output map replaced with --overwrite). Only the tables named after the map are
+	dropped: the v.clean and v.centroids stand-ins share the tables of their input
+	"""
+	if not os.path.isdir(_vector_dir(name)):
+		return
+	base = name.split("@")[0]
+	own = [table for layer, table in _load_vector(name)['dblinks'].items()
+			if table == (base if layer == 1 else "%s_%d" % (base, layer))]
+	if own:
+		conn = _connect()
+		try:
+			for table in own:
+				conn.execute("DROP TABLE IF EXISTS %s" % table)
+			conn.commit()
+		finally:
+			conn.close()
+	shutil.rmtree(_vector_dir(name))
+
+
+def _new_vector():
+	return {'features': [], 'dblinks': {}}
+
+
+def _read_standard(path, header=True):
+	"""
+	The features of a file in the GRASS standard ASCII vector format: a list of
+	(type letter, [(x, y)...], [(layer, cat)...])
+	"""
+	with open(path) as f:
+		lines = f.read().splitlines()
+	start = 0
+	if header:
+		for i, line in enumerate(lines):
+			if line.startswith("VERTI:"):
+				start = i + 1
+				break
+	features = []
+	i = start
+	while i < len(lines):
+		hdr = lines[i].split()
+		i += 1
+		if not hdr or hdr[0].endswith(":"):
+			continue
+		num_verts = int(hdr[1])
+		num_cats = int(hdr[2]) if len(hdr) > 2 else 0
+		coords = [tuple(float(v) for v in lines[i+k].split()[:2]) for k in range(num_verts)]
+		i += num_verts
+		cats = [tuple(int(v) for v in lines[i+k].split()[:2]) for k in range(num_cats)]
+		i += num_cats
+		features.append((hdr[0].upper(), coords, cats))
+	return features
+
+
+_TYPES = {'point': 'P', 'line': 'L', 'boundary': 'B', 'centroid': 'C'}
+
+
+def _format_coord(value):
+	s = "%.8f" % value
+	return s.rstrip("0").rstrip(".") if "." in s else s
+
+
+def _separator(sep):
+	return {'pipe': '|', 'comma': ',', 'space': ' ', 'tab': '\t', 'newline': '\n'}.get(sep, sep)
+
+
+def _cat_ranges(cats):
+	result = set()
+	for part in str(cats).split(","):
+		if "-" in part:
+			a, b = part.split("-")
+			result.update(range(int(a), int(b) + 1))
+		elif part:
+			result.add(int(part))
+	return result
+
+
+def _create_table(table, columns, rows):
+	conn = _connect()
+	try:
+		conn.execute("DROP TABLE IF EXISTS %s" % table)
+		conn.execute("CREATE TABLE %s (cat INTEGER, %s)" % (table, columns))
+		conn.executemany("INSERT INTO %s VALUES (%s)" % (table, ",".join(["?"]*(len(rows[0]) if rows else 1))), rows)
+		conn.commit()
+	finally:
+		conn.close()
+
+
+def _v_in_ascii(options, flags, env, stdin):
+	output = options['output']
+	vect = _new_vector()
+	if options.get('format', 'point') == 'standard':
+		vect['features'] = _read_standard(options['input'], header='n' not in flags)
+	else:
+		sep = _separator(options.get('separator', 'pipe'))
+		xcol = int(options.get('x', 1)) - 1
+		ycol = int(options.get('y', 2)) - 1
+		rows = []
+		with open(options['input']) as f:
+			for line in f:
+				if not line.strip():
+					continue
+				fields = line.rstrip("\n").split(sep)
+				cat = len(rows) + 1
+				vect['features'].append(('P', [(float(fields[xcol]), float(fields[ycol]))], [(1, cat)]))
+				rows.append([cat] + fields)
+		if options.get('columns'):
+			_delete_vector(output)
+			_create_table(output, options['columns'], rows)
+			vect['dblinks'][1] = output
+	_delete_vector(output)
+	_save_vector(output, vect)
+	return ""
+
+
+def _v_out_ascii(options, flags, env, stdin):
+	vect = _load_vector(options['input'])
+	types = set(_TYPES[t] for t in options.get('type', 'point,line,boundary,centroid').split(","))
+	out = ["ORGANIZATION: \nDIGIT DATE:   \nDIGIT NAME:   \nMAP NAME:     \nMAP DATE:     \n"
+		"MAP SCALE:    1\nOTHER INFO:   \nZONE:         0\nMAP THRESH:   0.000000\nVERTI:\n"]
+	for t, coords, cats in vect['features']:
+		if t not in types:
+			continue
+		out.append("%s  %d %d\n" % (t, len(coords), len(cats)))
+		out.extend([" %s %s\n" % (_format_coord(x), _format_coord(y)) for x, y in coords])
+		out.extend([" %d %d\n" % lc for lc in cats])
+	return "".join(out)
+
+
+def _v_clean(options, flags, env, stdin):
+	# No noding: the features are copied as they are
+	_save_vector(options['output'], _load_vector(options['input']))
+	return ""
+
+
+def _in_ring(x, y, ring):
+	inside = False
+	for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+		if (y0 > y) != (y1 > y) and x < x0 + (y - y0)*(x1 - x0)/(y1 - y0):
+			inside = not inside
+	return inside
+
+
+def _v_centroids(options, flags, env, stdin):
+	# The areas are taken to be the closed boundaries less the closed boundaries
+	# inside them, each gets a centroid on a chord between opposite vertices
+	vect = _load_vector(options['input'])
+	rings = [c for t, c, cats in vect['features'] if t == 'B' and len(c) > 3 and c[0] == c[-1]]
+	layer = int(options.get('layer', 1))
+	cat = int(options.get('cat', 1))
+	step = int(options.get('step', 1))
+	boxes = [(min(x for x, y in r), min(y for x, y in r), max(x for x, y in r), max(y for x, y in r))
+			for r in rings]
+	for ring, box in zip(rings, boxes):
+		inner = [r for r, b in zip(rings, boxes) if r is not ring and
+			b[0] >= box[0] and b[1] >= box[1] and b[2] <= box[2] and b[3] <= box[3] and
+			_in_ring(r[len(r)//4][0], r[len(r)//4][1], ring)]
+		n = len(ring) - 1
+		point = None
+		for i in [n//4] + list(range(n//2)):
+			a, b = ring[i], ring[n-1-i]
+			for t in (0.5, 0.25, 0.1, 0.05, 0.01):
+				x, y = a[0] + (b[0] - a[0])*t, a[1] + (b[1] - a[1])*t
+				if _in_ring(x, y, ring) and not any(_in_ring(x, y, r) for r in inner):
+					point = (x, y)
+					break
+			if point is not None:
+				break
+		if point is None:
+			continue
+		vect['features'].append(('C', [point], [(layer, cat)]))
+		cat += step
+	_save_vector(options['output'], vect)
+	return ""
+
+
+def _v_edit(options, flags, env, stdin):
+	name = options['map']
+	tool = options['tool']
+	if tool == 'create':
+		_save_vector(name, _new_vector())
+		return ""
+	vect = _load_vector(name)
+	if tool == 'add':
+		vect['features'].extend(_read_standard(options['input'], header='n' not in flags))
+	elif tool == 'delete':
+		layer = int(options.get('layer', 1))
+		cats = _cat_ranges(options['cats'])
+		vect['features'] = [f for f in vect['features']
+				if not any(l == layer and c in cats for l, c in f[2])]
+	else:
+		raise CommandError("v.edit tool=%s is not emulated" % tool)
+	_save_vector(name, vect)
+	return ""
+
+
+def _v_db_connect(options, flags, env, stdin):
+	name = options['map']
+	vect = _load_vector(name)
+	vect['dblinks'][int(options.get('layer', 1))] = options['table']
+	_save_vector(name, vect)
+	return ""
+
+
+def _v_db_select(options, flags, env, stdin):
+	vect = _load_vector(options['map'])
+	layer = int(options.get('layer', 1))
+	if layer not in vect['dblinks']:
+		raise CommandError("Database connection not defined for layer %d" % layer)
+	sql = "SELECT %s FROM %s" % (options.get('columns', '*'), vect['dblinks'][layer])
+	if options.get('where'):
+		sql += " WHERE %s" % options['where']
+	sep = _separator(options.get('separator', 'pipe'))
+	conn = _connect()
+	try:
+		cur = conn.execute(sql)
+		out = []
+		if 'c' not in flags:
+			out.append(sep.join([d[0] for d in cur.description]))
+		for row in cur:
+			out.append(sep.join(["" if v is None else ("%.15g" % v if isinstance(v, float) else str(v))
+					for v in row]))
+	finally:
+		conn.close()
+	return "".join([line + "\n" for line in out])
+
+
+def _db_execute(options, flags, env, stdin):
+	with open(options['input']) as f:
+		sql = f.read()
+	conn = _connect()
+	try:
+		conn.isolation_level = None
+		conn.executescript(sql)
+	finally:
+		conn.close()
+	return ""
+
+
+def _db_tables(options, flags, env, stdin):
+	conn = _connect()
+	try:
+		names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")]
+	finally:
+		conn.close()
+	return "".join([name + "\n" for name in names])
+
+
+def _v_info(options, flags, env, stdin):
+	vect = _load_vector(options['map'])
+	if 'g' in flags:
+		coords = [xy for f in vect['features'] for xy in f[1]]
+		if coords:
+			x = [c[0] for c in coords]
+			y = [c[1] for c in coords]
+		else:
+			x = y = [0.0]
+		return "north=%r\nsouth=%r\neast=%r\nwest=%r\ntop=0.000000\nbottom=0.000000\n" % (
+			max(y), min(y), max(x), min(x))
+	if 't' in flags:
+		count = dict((t, 0) for t in 'PLBC')
+		for f in vect['features']:
+			count[f[0]] += 1
+		return ("nodes=0\npoints=%d\nlines=%d\nboundaries=%d\ncentroids=%d\nareas=%d\nislands=0\n"
+			"primitives=%d\nmap3d=0\n" % (count['P'], count['L'], count['B'], count['C'], count['C'],
+			len(vect['features'])))
+	raise CommandError("v.info without -g or -t is not emulated")
+
+
+def _v_category(options, flags, env, stdin):
+	if options.get('option') != 'print':
+		raise CommandError("v.category option=%s is not emulated" % options.get('option'))
+	vect = _load_vector(options['input'])
+	types = set(_TYPES[t] for t in options.get('type', 'point,line,boundary,centroid').split(","))
+	layer = int(options.get('layer', 1))
+	out = []
+	for t, coords, cats in vect['features']:
+		if t in types:
+			c = [str(cat) for l, cat in cats if l == layer]
+			if c:
+				out.append("/".join(c) + "\n")
+	return "".join(out)
+
+
+def _g_copy(options, flags, env, stdin):
+	pair = options.get('vector') or options.get('vect')
+	if not pair:
+		raise CommandError("g.copy of rasters is not emulated")
+	src, dst = pair.split(",")
+	vect = _load_vector(src)
+	if src.split("@")[0] != dst:
+		_delete_vector(dst)
+	conn = _connect()
+	try:
+		for layer, table in list(vect['dblinks'].items()):
+			new = dst if layer == 1 else "%s_%d" % (dst, layer)
+			conn.execute("DROP TABLE IF EXISTS %s" % new)
+			conn.execute("CREATE TABLE %s AS SELECT * FROM %s" % (new, table))
+			vect['dblinks'][layer] = new
+		conn.commit()
+	finally:
+		conn.close()
+	_save_vector(dst, vect)
+	return ""
+
+
+def _g_remove(options, flags, env, stdin):
+	for name in options['name'].split(","):
+		for element in options.get('type', '').split(","):
+			if element == 'vector':
+				_delete_vector(name)
+			elif element == 'raster':
+				for d in ('cell', 'cellhd'):
+					if os.path.exists(_mapset_dir(d, name)):
+						os.remove(_mapset_dir(d, name))
+	return ""
+
+
+def _g_list(options, flags, env, stdin):
+	names = []
+	for element in options['type'].split(","):
+		if element == 'vector':
+			folder = _mapset_dir('vector')
+		else:
+			folder = _mapset_dir('cellhd')
+		if os.path.isdir(folder):
+			names.extend(os.listdir(folder))
+	pattern = options.get('pattern', '*')
+	return "".join(["%s\n" % name for name in sorted(names) if fnmatch.fnmatchcase(name, pattern)])
+
+
+def _g_version(options, flags, env, stdin):
+	return "GRASS 7.0.0 (benchmark stand-in)\n"
+
+
+def _g_proj(options, flags, env, stdin):
+	return "name=x,y\nproj=xy\nunits=metres\n"
+
+
+# Rasters and the region
+
+def _raster_header(name):
+	path = _mapset_dir('cellhd', name.split("@")[0])
+	if not os.path.exists(path):
+		raise CommandError("Raster map <%s> not found" % name)
+	with open(path) as f:
+		return json.load(f)
+
+
+def _raster_data(name):
+	hdr = _raster_header(name)
+	return hdr, np.memmap(_mapset_dir('cell', name.split("@")[0]), dtype=np.float64, mode='r',
+			shape=(hdr['rows'], hdr['cols']))
+
+
+def _write_raster(name, hdr, data_file):
+	for d in ('cell', 'cellhd'):
+		if not os.path.isdir(_mapset_dir(d)):
+			os.makedirs(_mapset_dir(d))
+	shutil.move(data_file, _mapset_dir('cell', name))
+	with open(_mapset_dir('cellhd', name), 'w') as f:
+		json.dump(hdr, f)
+
+
+def _wind_file():
+	return os.environ.get('WIND_OVERRIDE') or _mapset_dir('WIND')
+
+
+def _read_region():
+	if not os.path.exists(_wind_file()):
+		return {'n': 1.0, 's': 0.0, 'e': 1.0, 'w': 0.0, 'nsres': 1.0, 'ewres': 1.0, 'rows': 1, 'cols': 1}
+	with open(_wind_file()) as f:
+		return json.load(f)
+
+
+def _parse_region_env(text):
+	d = dict(kv.split(":", 1) for kv in text.split(";") if ":" in kv)
+	return {'n': float(d['north']), 's': float(d['south']), 'e': float(d['east']), 'w': float(d['west']),
+		'rows': int(d['rows']), 'cols': int(d['cols']),
+		'nsres': float(d['n-s resol']), 'ewres': float(d['e-w resol'])}
+
+
+def _region_text(reg, sep):
+	keys = (('north', 'n'), ('south', 's'), ('east', 'e'), ('west', 'w'), ('nsres', 'nsres'),
+		('ewres', 'ewres'), ('rows', 'rows'), ('cols', 'cols'))
+	return "".join(["%s%s%s\n" % (k, sep, reg[r]) for k, r in keys])
+
+
+def _g_region(options, flags, env, stdin):
+	reg = _read_region()
+	changed = False
+	if options.get('raster') or options.get('rast'):
+		hdr = _raster_header(options.get('raster') or options.get('rast'))
+		reg = dict((k, hdr[k]) for k in ('n', 's', 'e', 'w', 'nsres', 'ewres', 'rows', 'cols'))
+		changed = True
+	for k in ('n', 's', 'e', 'w'):
+		if k in options:
+			reg[k] = float(options[k])
+			changed = True
+	if 'res' in options:
+		reg['nsres'] = reg['ewres'] = float(options['res'])
+		changed = True
+	if changed:
+		if 'a' in flags:
+			reg['n'] = math.ceil(reg['n']/reg['nsres'])*reg['nsres']
+			reg['s'] = math.floor(reg['s']/reg['nsres'])*reg['nsres']
+			reg['e'] = math.ceil(reg['e']/reg['ewres'])*reg['ewres']
+			reg['w'] = math.floor(reg['w']/reg['ewres'])*reg['ewres']
+		reg['rows'] = int(round((reg['n'] - reg['s'])/reg['nsres']))
+		reg['cols'] = int(round((reg['e'] - reg['w'])/reg['ewres']))
+		with open(_wind_file(), 'w') as f:
+			json.dump(reg, f)
+	if 'p' in flags:
+		return "projection: 99 (XY)\nzone:       0\n" + _region_text(reg, ": ")
+	if 'g' in flags:
+		return "projection=99\nzone=0\n" + _region_text(reg, "=")
+	return ""
+
+
+def _r_info(options, flags, env, stdin):
+	hdr = _raster_header(options['map'])
+	return ("north=%r\nsouth=%r\neast=%r\nwest=%r\nnsres=%r\newres=%r\nrows=%d\ncols=%d\ncells=%d\n"
+		"datatype=%s\nncats=0\n" % (hdr['n'], hdr['s'], hdr['e'], hdr['w'], hdr['nsres'], hdr['ewres'],
+		hdr['rows'], hdr['cols'], hdr['rows']*hdr['cols'], hdr['datatype']))
+
+
+def _cells(hdr, x, y):
+	"""
+	Row and column of the raster cells under the points x, y (arrays), and which of them are inside
+	"""
+	r = np.floor((hdr['n'] - y)/hdr['nsres']).astype(int)
+	c = np.floor((x - hdr['w'])/hdr['ewres']).astype(int)
+	inside = (r >= 0) & (r < hdr['rows']) & (c >= 0) & (c < hdr['cols'])
+	return np.where(inside, r, 0), np.where(inside, c, 0), inside
+
+
+def _r_what(options, flags, env, stdin):
+	hdr, data = _raster_data(options['map'])
+	sep = _separator(options.get('separator', 'pipe'))
+	pts = [line.split()[:2] for line in (stdin or "").splitlines() if line.strip()]
+	if not pts:
+		return ""
+	xy = np.array([[float(x), float(y)] for x, y in pts])
+	r, c, inside = _cells(hdr, xy[:,0], xy[:,1])
+	values = np.where(inside, data[r, c], np.nan)
+	out = []
+	for (x, y), v in zip(pts, values):
+		if np.isnan(v):
+			out.append("%s%s%s%s%s*\n" % (x, sep, y, sep, sep))
+		elif hdr['datatype'] == 'CELL':
+			out.append("%s%s%s%s%s%d\n" % (x, sep, y, sep, sep, int(v)))
+		else:
+			out.append("%s%s%s%s%s%.6f\n" % (x, sep, y, sep, sep, v))
+	return "".join(out)
+
+
+def _r_out_bin(options, flags, env, stdin):
+	hdr, data = _raster_data(options['input'])
+	if env is not None and env.get('GRASS_REGION'):
+		reg = _parse_region_env(env['GRASS_REGION'])
+	else:
+		reg = _read_region()
+	null = float(options.get('null', 0))
+	dtype = np.float64 if int(options.get('bytes', 8)) == 8 else np.float32
+	x = reg['w'] + (np.arange(reg['cols']) + 0.5)*reg['ewres']
+	with open(options['output'], 'wb') as out:
+		for row in range(reg['rows']):
+			y = np.repeat(reg['n'] - (row + 0.5)*reg['nsres'], reg['cols'])
+			r, c, inside = _cells(hdr, x, y)
+			values = np.where(inside, data[r, c], np.nan)
+			values[np.isnan(values)] = null
+			values.astype(dtype).tofile(out)
+	return ""
+
+
+def _r_in_bin(options, flags, env, stdin):
+	rows, cols = int(options['rows']), int(options['cols'])
+	if 'd' in flags:
+		dtype, datatype = np.float64, 'DCELL'
+	elif 'f' in flags:
+		dtype, datatype = np.float32, 'FCELL'
+	else:
+		dtype, datatype = {1: np.int8, 2: np.int16, 4: np.int32}[int(options.get('bytes', 4))], 'CELL'
+	data = np.fromfile(options['input'], dtype=dtype).astype(np.float64).reshape(rows, cols)
+	if options.get('anull') is not None:
+		data[data == float(options['anull'])] = np.nan
+	n, s, e, w = [float(options[k]) for k in ('north', 'south', 'east', 'west')]
+	hdr = {'n': n, 's': s, 'e': e, 'w': w, 'rows': rows, 'cols': cols,
+		'nsres': (n - s)/rows, 'ewres': (e - w)/cols, 'datatype': datatype}
+	tmp = tempfile()
+	data.tofile(tmp)
+	_write_raster(options['output'], hdr, tmp)
+	return ""
+
+
+def _g_message(options, flags, env, stdin):
+	msg = options.get('message', '')
+	if 'w' in flags:
+		sys.stderr.write("WARNING: %s\n" % msg)
+	elif 'e' in flags:
+		sys.stderr.write("ERROR: %s\n" % msg)
+	elif 'p' in flags or 'd' in flags:
+		pass
+	elif int(os.environ.get('GRASS_VERBOSE', 2)) > (2 if 'v' in flags else 0):
+		sys.stderr.write("%s\n" % msg)
+	return ""
+
+
+def _no_op(options, flags, env, stdin):
+	return ""
+
+
+_COMMANDS = {
+	'v.in.ascii': _v_in_ascii,
+	'v.out.ascii': _v_out_ascii,
+	'v.edit': _v_edit,
+	'v.clean': _v_clean,
+	'v.centroids': _v_centroids,
+	'v.db.connect': _v_db_connect,
+	'v.db.select': _v_db_select,
+	'db.execute': _db_execute,
+	'db.tables': _db_tables,
+	'v.info': _v_info,
+	'v.category': _v_category,
+	'g.copy': _g_copy,
+	'g.remove': _g_remove,
+	'g.list': _g_list,
+	'g.version': _g_version,
+	'g.proj': _g_proj,
+	'g.message': _g_message,
+	'g.region': _g_region,
+	'r.info': _r_info,
+	'r.what': _r_what,
+	'r.out.bin': _r_out_bin,
+	'r.in.bin': _r_in_bin,
+	'r.colors': _no_op,
+	'r.support': _no_op,
+}
+
+
+def _run(prog, kwargs, stdin=None):
+	"""
+	Emulate one GRASS command, returning its output and return code
+	"""
+	flags = kwargs.pop('flags', '') or ''
+	env = kwargs.pop('env', None)
+	for k in ('overwrite', 'quiet', 'verbose', 'superquiet', 'stdin', 'stdout', 'stderr'):
+		kwargs.pop(k, None)
+	options = dict((k.strip("_"), v) for k, v in kwargs.items() if v is not None)
+	_log(prog, flags, options)
+	handler = _COMMANDS.get(prog)
+	try:
+		if handler is None:
+			raise CommandError("%s is not emulated by the benchmark stand-in" % prog)
+		return handler(options, flags, env, stdin), 0
+	except CommandError as e:
+		error("%s: %s" % (prog, e))
+		return "", 1
+
+
+def decode(bytes_, encoding=None):
+	"""
+	As grass.script.utils.decode: bytes to str, anything else unchanged
+	"""
+	if isinstance(bytes_, bytes) and not isinstance(bytes_, str):
+		return bytes_.decode(encoding or 'utf-8')
+	return bytes_
+
+
+def encode(string, encoding=None):
+	"""
+	As grass.script.utils.encode: str to bytes, bytes unchanged
+	"""
+	if isinstance(string, bytes):
+		return string
+	return string.encode(encoding or 'utf-8')
+
+
+class Process(object):
+	"""
+	A finished (or, when its input is piped, a waiting) emulated command,
+	with the part of the subprocess.Popen interface the modules use
+	"""
+
+	def __init__(self, prog, kwargs):
+		self.prog = prog
+		self.kwargs = kwargs
+		self.piped_out = kwargs.get('stdout') == PIPE
+		self.stdin = None
+		self.stdout = None
+		self.returncode = None
+		self._output = None
+		if kwargs.get('stdin') != PIPE:
+			self._finish(None)
+
+	def _finish(self, data):
+		# As with a real pipe, the input and the output are bytes
+		if data is not None and not isinstance(data, bytes):
+			raise TypeError("%s: the input of a command must be bytes, not %s" % (self.prog, type(data).__name__))
+		out, self.returncode = _run(self.prog, dict(self.kwargs), decode(data))
+		if self.piped_out:
+			self._output = encode(out)
+			self.stdout = io.BytesIO(self._output)
+		elif out:
+			sys.stdout.write(out)
+
+	def communicate(self, input=None):
+		if self.returncode is None:
+			self._finish(input)
+		out = self._output if self.piped_out else None
+		self._output = None
+		return out, None
+
+	def wait(self):
+		if self.returncode is None:
+			self._finish(None)
+		return self.returncode
+
+	def poll(self):
+		return self.returncode
+
+
+def make_command(prog, flags="", overwrite=False, quiet=False, verbose=False, **options):
+	args = [prog]
+	if overwrite:
+		args.append("--o")
+	if quiet:
+		args.append("--q")
+	if flags:
+		args.append("-%s" % flags)
+	args.extend(["%s=%s" % (k.strip("_"), v) for k, v in options.items() if v is not None])
+	return args
+
+
+def start_command(prog, flags="", overwrite=False, quiet=False, verbose=False, **kwargs):
+	kwargs['flags'] = flags
+	return Process(prog, kwargs)
+
+
+def run_command(*args, **kwargs):
+	return start_command(*args, **kwargs).wait()
+
+
+def pipe_command(*args, **kwargs):
+	kwargs['stdout'] = PIPE
+	return start_command(*args, **kwargs)
+
+
+def feed_command(*args, **kwargs):
+	kwargs['stdin'] = PIPE
+	return start_command(*args, **kwargs)
+
+
+def read_command(*args, **kwargs):
+	kwargs['stdout'] = PIPE
+	return decode(start_command(*args, **kwargs).communicate()[0])
+
+
+def write_command(*args, **kwargs):
+	stdin = kwargs.pop('stdin')
+	kwargs['stdin'] = PIPE
+	p = start_command(*args, **kwargs)
+	p.communicate(encode(stdin))
+	return p.returncode
+
+
+def parse_command(*args, **kwargs):
+	parse = kwargs.pop('parse', None) or {}
+	if 'delimiter' in kwargs:
+		parse['sep'] = kwargs.pop('delimiter')
+	return parse_key_val(read_command(*args, **kwargs), **parse)
+
+
+# Map and database information
+
+def find_file(name, element='cell', mapset=None):
+	base = name.split("@")[0]
+	if element == 'vector':
+		path = _vector_dir(base)
+		found = os.path.exists(os.path.join(path, 'features.pkl'))
+	else:
+		path = _mapset_dir('cell', base)
+		found = os.path.exists(path)
+	if not found or (mapset and mapset != MAPSET):
+		return {'name': '', 'mapset': '', 'fullname': '', 'file': ''}
+	return {'name': base, 'mapset': MAPSET, 'fullname': "%s@%s" % (base, MAPSET), 'file': path}
+
+
+def db_connection(force=False):
+	if not os.path.isdir(_mapset_dir('sqlite')):
+		os.makedirs(_mapset_dir('sqlite'))
+	return {'driver': 'sqlite', 'database': DATABASE, 'schema': '', 'group': ''}
+
+
+def vector_db(map, **args):
+	vect = _load_vector(map)
+	return dict((layer, {'layer': layer, 'name': table, 'table': table, 'key': 'cat',
+			'database': DATABASE, 'driver': 'sqlite'}) for layer, table in vect['dblinks'].items())
+
+
+def vector_columns(map, layer=None, getDict=True, **args):
+	table = vector_db(map)[int(layer or 1)]['table']
+	conn = _connect()
+	try:
+		info = conn.execute("PRAGMA table_info(%s)" % table).fetchall()
+	finally:
+		conn.close()
+	if not getDict:
+		return [c[1] for c in info]
+	return OrderedDict((c[1], {'type': c[2], 'index': c[0]}) for c in info)
+
+
+def region(region3d=False, complete=False):
+	reg = dict(_read_region())
+	reg['cells'] = reg['rows']*reg['cols']
+	reg['projection'] = 99
+	reg['zone'] = 0
+	return reg
+
+
+def raster_info(map):
+	hdr = _raster_header(map)
+	result = dict((k, hdr[k]) for k in ('n', 's', 'e', 'w', 'nsres', 'ewres', 'rows', 'cols', 'datatype'))
+	result['north'], result['south'], result['east'], result['west'] = hdr['n'], hdr['s'], hdr['e'], hdr['w']
+	return result
+
+
+def _remove_temp_region():
+	name = os.environ.pop('WIND_OVERRIDE', None)
+	if name and os.path.exists(name):
+		os.remove(name)
+
+
+def use_temp_region():
+	"""
+	Copy the current region to a temporary one, used until the script ends
+	"""
+	name = _mapset_dir("tmp.hecras.%d" % os.getpid())
+	if os.path.exists(_wind_file()):
+		shutil.copyfile(_wind_file(), name)
+	os.environ['WIND_OVERRIDE'] = name
+	atexit.register(_remove_temp_region)
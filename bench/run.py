@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the grass-hecras modules on synthetic data.
+
+For each size (the number of cross sections), a river network, an elevation raster
+and a HEC-RAS results sdf file are generated, and each module is run on them in a child process:
+  v.xsections, v.out.hecras (on the v.xsections output), v.to.hecras (both in one pass),
+  v.in.hecras, v.in.hecras_banks and r.hecras.depth (on the results sdf).
+The wall time of each run is measured, and each module writes a profile (its profile= option)
+with its peak RSS, and the wall time, GRASS command count and peak RSS of each phase.
+With the stand-in no GRASS commands are started, but each one counted is a subprocess in a real session.
+
+By default the modules run against the local stand-in for grass.script in bench/fakegrass,
+which emulates the GRASS commands on a scratch directory, so no GRASS installation is needed.
+With --real they run in the current GRASS session (use a scratch mapset: maps named
+bench_*_<size> are created and removed, and the region is set to the elevation raster).
+
+Results are compared with the baselines saved with --save-baseline (bench/baselines.json by default),
+and the exit status is 1 when a module is slower or uses more memory than its baseline by more
+than the tolerance, or runs more GRASS commands than it did.
+
+  python bench/run.py --sizes 10,100,1000
+  python bench/run.py --sizes 100,10000 --save-baseline
+  python bench/run.py --real --sizes 1000 --modules v.xsections,v.out.hecras
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKE_DIR = os.path.join(BENCH_DIR, 'fakegrass')
+
+MODULES = ('v.xsections', 'v.out.hecras', 'v.to.hecras', 'v.in.hecras', 'v.in.hecras_banks', 'r.hecras.depth')
+
+SPACING = 100.0
+WIDTH = 200.0
+
+
+def module_args(module, maps, nprocs):
+	"""
+	The options and flags of a module run on the maps and files of one size
+	"""
+	if module == 'v.xsections':
+		return ["input=%s" % maps['river'], "xsections=%s" % maps['xsections'],
+			"stations=%s" % maps['stations'], "intersects=%s" % maps['intersects'],
+			"spacing=%g" % SPACING, "width=%g" % WIDTH, "nprocs=%d" % nprocs]
+	if module == 'v.out.hecras':
+		# Without the profile cache, so every run samples all cross sections
+		return ["river=%s_out" % maps['river'], "xsections=%s" % maps['xsections'],
+			"stations=%s" % maps['stations'], "elevation=%s" % maps['dem'],
+			"output=%s" % maps['geometry'], "nprocs=%d" % nprocs, "-n"]
+	if module == 'v.to.hecras':
+		return ["input=%s" % maps['river'], "elevation=%s" % maps['dem'], "output=%s" % maps['pipeline'],
+			"spacing=%g" % SPACING, "width=%g" % WIDTH, "nprocs=%d" % nprocs, "-n"]
+	if module == 'v.in.hecras':
+		return ["input=%s" % maps['results'], "output=%s" % maps['water']]
+	if module == 'v.in.hecras_banks':
+		return ["input=%s" % maps['results'], "output=%s" % maps['banks']]
+	if module == 'r.hecras.depth':
+		return ["input=%s" % maps['results'], "elevation=%s" % maps['dem'], "output=%s" % maps['depth']]
+	raise ValueError(module)
+
+
+def prepare(grass, synthetic, size, work):
+	"""
+	Generate the data of one size and import it. Returns the map and file names
+	"""
+	maps = dict((name, "bench_%s_%d" % (name, size)) for name in
+			('river', 'dem', 'xsections', 'stations', 'intersects', 'water', 'banks', 'depth'))
+	maps['results'] = os.path.join(work, "results_%d.sdf" % size)
+	maps['geometry'] = os.path.join(work, "geometry_%d.sdf" % size)
+	maps['pipeline'] = os.path.join(work, "pipeline_%d.sdf" % size)
+
+	net = synthetic.Network(size, SPACING, WIDTH)
+	river_file = os.path.join(work, "river_%d.txt" % size)
+	net.write_ascii(river_file)
+	grass.run_command('v.in.ascii', input=river_file, output=maps['river'], format="standard",
+			flags="n", overwrite=True, quiet=True)
+	dem_file = os.path.join(work, "dem_%d.bin" % size)
+	hdr = net.write_dem(dem_file)
+	grass.run_command('r.in.bin', input=dem_file, output=maps['dem'], flags="d", bytes=8,
+			north=hdr['n'], south=hdr['s'], east=hdr['e'], west=hdr['w'], rows=hdr['rows'], cols=hdr['cols'],
+			overwrite=True, quiet=True)
+	grass.run_command('g.region', raster=maps['dem'], quiet=True)
+	os.unlink(river_file)
+	os.unlink(dem_file)
+	count = net.write_results(maps['results'])
+	return maps, count, hdr['rows']*hdr['cols']
+
+
+def remove_maps(grass, maps):
+	grass.run_command('g.remove', type="vector", flags="f", quiet=True, name=",".join(
+		[maps[k] for k in ('river', 'xsections', 'stations', 'intersects', 'water', 'banks')] +
+		[maps['river'] + "_out"]))
+	grass.run_command('g.remove', type="raster", flags="f", quiet=True, name="%s,%s" % (maps['dem'], maps['depth']))
+
+
+def run_module(python, module, args, env, work, tag):
+	"""
+	Run one module in a child process, with profiling.
+	Returns its wall time, exit status, profile and log file
+	"""
+	profile = os.path.join(work, "%s.profile.json" % tag)
+	if os.path.exists(profile):
+		os.unlink(profile)
+	log = os.path.join(work, "%s.log" % tag)
+	cmd = [python, os.path.join(REPO_DIR, module + ".py")] + args + ["profile=%s" % profile, "--o"]
+	begin = time.time()
+	with open(log, 'w') as out:
+		status = subprocess.call(cmd, env=env, stdout=out, stderr=subprocess.STDOUT)
+	wall = time.time() - begin
+	result = None
+	if os.path.exists(profile):
+		with open(profile) as f:
+			result = json.load(f)
+	return wall, status, result, log
+
+
+def measure(module, size, wall, prof):
+	"""
+	The record of one run: totals, and the wall time, commands and peak RSS of each phase.
+	The peak RSS is that of the module process, as recorded in its profile
+	"""
+	phases = OrderedDict()
+	# A phase run more than once is reported once, with its total wall time and commands
+	for p in prof['phases']:
+		ph = phases.setdefault(p['phase'], OrderedDict([('phase', p['phase']), ('wall', 0.0),
+			('commands', 0), ('max_rss_kb', None)]))
+		ph['wall'] = round(ph['wall'] + p['wall'], 4)
+		ph['commands'] += p['commands']
+		rss = [v for v in (ph['max_rss_kb'], p.get('max_rss_kb')) if v is not None]
+		ph['max_rss_kb'] = max(rss) if rss else None
+	return OrderedDict([('module', module), ('size', size), ('wall', round(wall, 4)),
+		('max_rss_kb', prof.get('max_rss_kb')), ('commands', len(prof['commands'])), ('phases', list(phases.values()))])
+
+
+def compare(record, base, tolerance, min_wall, min_rss_kb):
+	"""
+	The regressions of a run against its baseline, as a list of messages
+	"""
+	problems = []
+	key = "%s %d" % (record['module'], record['size'])
+	if record['commands'] > base['commands']:
+		problems.append("%s: %d GRASS commands, baseline %d" % (key, record['commands'], base['commands']))
+	if record['wall'] > base['wall']*(1 + tolerance) and record['wall'] - base['wall'] > min_wall:
+		problems.append("%s: wall %.3f s, baseline %.3f s" % (key, record['wall'], base['wall']))
+	if record['max_rss_kb'] and base.get('max_rss_kb') and \
+			record['max_rss_kb'] > base['max_rss_kb']*(1 + tolerance) and \
+			record['max_rss_kb'] - base['max_rss_kb'] > min_rss_kb:
+		problems.append("%s: peak RSS %d kB, baseline %d kB" % (key, record['max_rss_kb'], base['max_rss_kb']))
+	base_phases = dict((p['phase'], p) for p in base.get('phases', []))
+	for p in record['phases']:
+		b = base_phases.get(p['phase'])
+		if b is None:
+			continue
+		if p['commands'] > b['commands']:
+			problems.append("%s %s: %d GRASS commands, baseline %d" % (key, p['phase'], p['commands'], b['commands']))
+		if p['wall'] > b['wall']*(1 + tolerance) and p['wall'] - b['wall'] > min_wall:
+			problems.append("%s %s: wall %.3f s, baseline %.3f s" % (key, p['phase'], p['wall'], b['wall']))
+	return problems
+
+
+def report(records):
+	lines = ["%-28s %8s %10s %12s %9s" % ("module", "size", "wall (s)", "peak RSS MB", "commands")]
+	for r in records:
+		rss = "%12.1f" % (r['max_rss_kb']/1024.0) if r['max_rss_kb'] else "%12s" % "-"
+		lines.append("%-28s %8d %10.3f %s %9d" % (r['module'], r['size'], r['wall'], rss, r['commands']))
+		for p in r['phases']:
+			rss = "%12.1f" % (p['max_rss_kb']/1024.0) if p.get('max_rss_kb') else "%12s" % "-"
+			lines.append("  %-26s %8s %10.3f %s %9d" % (p['phase'], "", p['wall'], rss, p['commands']))
+	print("\n".join(lines))
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the grass-hecras modules on synthetic data")
+	parser.add_argument('--sizes', default="10,100,1000",
+			help="Comma separated numbers of cross sections (default: %(default)s)")
+	parser.add_argument('--modules', default=",".join(MODULES),
+			help="Comma separated modules to run (default: all)")
+	parser.add_argument('--real', action='store_true',
+			help="Run in the current GRASS session instead of the local stand-in")
+	parser.add_argument('--nprocs', type=int, default=1, help="nprocs= of v.xsections and v.out.hecras")
+	parser.add_argument('--repeat', type=int, default=3,
+			help="Runs of each module, the fastest is reported (default: %(default)s)")
+	parser.add_argument('--python', default=sys.executable, help="Python to run the modules with")
+	parser.add_argument('--workdir', help="Directory for the data and logs (default: a temporary one)")
+	parser.add_argument('--keep', action='store_true', help="Keep the data, maps and logs")
+	parser.add_argument('--output', help="Write the results to this JSON file")
+	parser.add_argument('--baseline', default=os.path.join(BENCH_DIR, 'baselines.json'),
+			help="Baselines file (default: %(default)s)")
+	parser.add_argument('--save-baseline', action='store_true',
+			help="Save the results as the baselines of the runs, instead of comparing with them")
+	parser.add_argument('--tolerance', type=float, default=0.5,
+			help="Relative increase of wall time or peak RSS over the baseline that is a regression "
+			"(default: %(default)s)")
+	parser.add_argument('--min-wall', type=float, default=0.25,
+			help="Smallest increase of wall time (s) that is a regression (default: %(default)s)")
+	parser.add_argument('--min-rss', type=float, default=16,
+			help="Smallest increase of peak RSS (MB) that is a regression (default: %(default)s)")
+	args = parser.parse_args()
+
+	sizes = [int(s) for s in args.sizes.split(",") if s]
+	modules = [m for m in args.modules.split(",") if m]
+	for m in modules:
+		if m not in MODULES:
+			parser.error("Unknown module: %s" % m)
+	if 'v.out.hecras' in modules and 'v.xsections' not in modules:
+		parser.error("v.out.hecras runs on the output of v.xsections, run both")
+	modules = [m for m in MODULES if m in modules]
+	mode = 'real' if args.real else 'fake'
+
+	work = args.workdir or tempfile.mkdtemp(prefix="hecras_bench_")
+	if not os.path.isdir(work):
+		os.makedirs(work)
+	env = os.environ.copy()
+	path = [REPO_DIR]
+	if args.real:
+		if 'GISBASE' not in os.environ:
+			sys.exit("--real must be run inside a GRASS session")
+	else:
+		path.insert(0, FAKE_DIR)
+		env['HECRAS_BENCH_DB'] = os.environ['HECRAS_BENCH_DB'] = os.path.join(work, 'db')
+	env['PYTHONPATH'] = os.pathsep.join(path + [p for p in [os.environ.get('PYTHONPATH')] if p])
+	sys.path[0:0] = path
+	import grass.script as grass
+	import synthetic
+
+	records = []
+	failed = []
+	try:
+		for size in sizes:
+			begin = time.time()
+			maps, count, cells = prepare(grass, synthetic, size, work)
+			print("Size %d: %d cross sections, %d raster cells, generated in %.1f s" %
+					(size, count, cells, time.time() - begin))
+			for module in modules:
+				tag = "%s_%d" % (module, size)
+				best = None
+				# The fastest of the repeated runs is kept, the others are slowed by other work
+				for i in range(args.repeat):
+					wall, status, prof, log = run_module(args.python, module,
+							module_args(module, maps, args.nprocs), env, work, tag)
+					if status != 0 or prof is None:
+						failed.append("%s %d: exit status %d, see %s" % (module, size, status, log))
+						best = None
+						break
+					if best is None or wall < best['wall']:
+						best = measure(module, size, wall, prof)
+				if best is not None:
+					records.append(best)
+			if args.real and not args.keep:
+				remove_maps(grass, maps)
+	finally:
+		if not args.keep and not args.workdir and not failed:
+			shutil.rmtree(work)
+
+	report(records)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({'mode': mode, 'results': records}, f, indent=1)
+
+	baselines = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			baselines = json.load(f)
+	runs = baselines.setdefault(mode, {})
+	problems = []
+	if args.save_baseline:
+		for r in records:
+			runs["%s %d" % (r['module'], r['size'])] = r
+		with open(args.baseline, 'w') as f:
+			json.dump(baselines, f, indent=1, sort_keys=True)
+		print("Baselines saved to %s" % args.baseline)
+	else:
+		for r in records:
+			base = runs.get("%s %d" % (r['module'], r['size']))
+			if base is not None:
+				problems += compare(r, base, args.tolerance, args.min_wall, args.min_rss*1024)
+	for msg in failed:
+		print("FAILED: %s" % msg)
+	for msg in problems:
+		print("REGRESSION: %s" % msg)
+	if failed:
+		return 2
+	return 1 if problems else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
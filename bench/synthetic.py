@@ -0,0 +1,156 @@
+"""
+Synthetic input data for the benchmarks: a river network of meandering reaches laid out
+on a grid of valleys, an elevation raster of those valleys, and a HEC-RAS results sdf file
+with cross sections, bank positions, water elevations and water surface extents.
+Sizes are given as the number of cross sections the network yields at the chosen spacing
+"""
+
+import math
+from collections import OrderedDict
+import numpy as np
+from libhecras import geometry
+
+# Lower left corner of the data, with coordinates of UTM magnitude
+X0 = 500000.0
+Y0 = 3500000.0
+
+
+class Network(object):
+	"""
+	A river network of "reaches" meandering reaches, with "n_xsections" cross sections in all
+	at "spacing" apart, each "width" wide.
+	Each reach is a sine wave (amplitude one spacing, wavelength ten spacings) along
+	the floor of its own valley, and the valleys are laid out in rows and columns
+	far enough apart that no cross sections of different reaches cross
+	"""
+
+	def __init__(self, n_xsections, spacing=100.0, width=200.0, per_reach=50):
+		self.spacing = float(spacing)
+		self.width = float(width)
+		self.amplitude = self.spacing
+		self.wavelength = 10*self.spacing
+		num_reaches = max(1, int(math.ceil(n_xsections/float(per_reach))))
+		counts = [n_xsections//num_reaches + (1 if i < n_xsections % num_reaches else 0)
+				for i in range(num_reaches)]
+		# Long enough for "count" stations by the rules of geometry.station_offsets
+		lengths = [max(c, 1)*self.spacing + self.spacing/4.0 for c in counts]
+		self.row_gap = self.width + 4*self.amplitude
+		longest = max(lengths)
+		self.col_gap = longest + self.width
+		cols = max(1, int(round(math.sqrt(num_reaches*self.row_gap/self.col_gap))))
+		self.reaches = OrderedDict()
+		for i, length in enumerate(lengths):
+			row, col = divmod(i, cols)
+			self.reaches[i+1] = self._meander(X0 + col*self.col_gap, Y0 + row*self.row_gap, length)
+		self.rows = int(math.ceil(num_reaches/float(cols)))
+		self.cols = cols
+
+	def _meander(self, x0, y0, length):
+		"""
+		The vertices of a sine wave from x0,y0 in the x direction, cut at "length" along the curve
+		"""
+		t = np.arange(0.0, length + self.spacing, self.spacing/5.0)
+		x = x0 + t
+		y = y0 + self.amplitude*np.sin(2*math.pi*t/self.wavelength)
+		arc = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+		keep = arc < length
+		end_x = np.interp(length, arc, x)
+		end_y = np.interp(length, arc, y)
+		return np.column_stack((np.append(x[keep], end_x), np.append(y[keep], end_y)))
+
+	def bounds(self):
+		"""
+		North, south, east and west of the network, with room for the cross sections
+		"""
+		allxy = np.concatenate(list(self.reaches.values()))
+		margin = self.width
+		return (float(allxy[:,1].max()) + margin, float(allxy[:,1].min()) - margin,
+			float(allxy[:,0].max()) + margin, float(allxy[:,0].min()) - margin)
+
+	def floor_elevation(self, x):
+		"""
+		Elevation of the valley floor, rising upstream along each valley
+		"""
+		x_local = (x - X0) % self.col_gap
+		return 100.0 + 0.001*x_local
+
+	def elevation(self, x, y):
+		"""
+		Elevation at the points x, y: the valley floor, rising to 2 m above it at the ends
+		of the cross sections
+		"""
+		x_local = (x - X0) % self.col_gap
+		row = np.clip(np.round((y - Y0)/self.row_gap), 0, self.rows - 1)
+		centre = Y0 + row*self.row_gap + self.amplitude*np.sin(2*math.pi*x_local/self.wavelength)
+		d = (y - centre)/(self.width/2.0)
+		return self.floor_elevation(x) + 2.0*d*d
+
+	def write_ascii(self, path):
+		"""
+		The reaches, as lines in the GRASS standard ASCII vector format (no header)
+		"""
+		with open(path, 'w') as f:
+			for cat, coords in self.reaches.items():
+				f.write("L %d 1\n" % len(coords))
+				for x, y in coords:
+					f.write(" %.3f %.3f\n" % (x, y))
+				f.write(" 1 %d\n" % cat)
+
+	def write_dem(self, path, max_cells=4000000):
+		"""
+		Write the elevation raster as float64 rows, north to south, at a resolution fine
+		enough to resolve the valleys but with at most about max_cells cells.
+		Returns the header of the raster: north, south, east, west, rows and cols
+		"""
+		n, s, e, w = self.bounds()
+		res = max(self.spacing/10.0, math.sqrt((n - s)*(e - w)/float(max_cells)))
+		res = math.ceil(res)
+		rows = int(math.ceil((n - s)/res))
+		cols = int(math.ceil((e - w)/res))
+		n = s + rows*res
+		e = w + cols*res
+		x = w + (np.arange(cols) + 0.5)*res
+		strip = max(1, 1000000//cols)
+		with open(path, 'wb') as f:
+			for r0 in range(0, rows, strip):
+				r1 = min(rows, r0 + strip)
+				y = n - (np.arange(r0, r1) + 0.5)*res
+				xx, yy = np.meshgrid(x, y)
+				self.elevation(xx, yy).astype(np.float64).tofile(f)
+		return {'n': n, 's': s, 'e': e, 'w': w, 'rows': rows, 'cols': cols}
+
+	def write_results(self, path, depths=(1.0, 1.5), banks=(0.35, 0.65)):
+		"""
+		Write a HEC-RAS results sdf file with a cross section at each station of each reach:
+		its cutline, bank positions, and for each profile a water elevation "depth" above the
+		valley floor and the water surface extents where that level meets the valley sides.
+		Returns the number of cross sections
+		"""
+		half = self.width/2.0
+		count = 0
+		with open(path, 'w') as f:
+			f.write("BEGIN HEADER:\n UNITS: METRIC\n NUMBER OF PROFILES: %d\n PROFILE NAMES: %s\n"
+				"END HEADER:\n\nBEGIN CROSS-SECTIONS:\n" %
+				(len(depths), ", ".join(["PF %d" % (p+1) for p in range(len(depths))])))
+			for cat, coords in self.reaches.items():
+				offsets = geometry.station_offsets(geometry.polyline_length(coords), self.spacing)
+				for off, cut in zip(offsets, geometry.cross_sections(coords, offsets, half)):
+					left, mid, right = cut
+					floor = float(self.floor_elevation(mid[0]))
+					f.write("\n CROSS-SECTION:\n  STREAM ID: bench\n  REACH ID: %d\n  STATION: %.0f\n"
+						"  CUT LINE:\n" % (cat, off))
+					for x, y in cut:
+						f.write("   %.3f, %.3f\n" % (x, y))
+					f.write("  BANK POSITIONS: %g, %g\n" % banks)
+					f.write("  WATER ELEVATION: %s\n" % ", ".join(["%.3f" % (floor + d) for d in depths]))
+					f.write("  WATER SURFACE EXTENTS:\n")
+					for d in depths:
+						# The valley sides reach the water level at this fraction of the half width
+						t = math.sqrt(d/2.0)
+						l = mid + (left - mid)*t
+						r = mid + (right - mid)*t
+						f.write("   %.3f, %.3f, %.3f, %.3f\n" % (l[0], l[1], r[0], r[1]))
+					f.write(" END:\n")
+					count += 1
+			f.write("\nEND CROSS-SECTIONS:\n")
+		return count
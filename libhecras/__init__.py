@@ -0,0 +1,4 @@
+"""
+Shared helpers for the GRASS HEC-RAS modules
+(v.xsections, v.out.hecras, v.to.hecras, v.hecras.batch, v.in.hecras, v.in.hecras_banks, r.hecras.depth)
+"""
@@ -0,0 +1,155 @@
+"""
+Persistent on-disk cache of cross section profiles.
+A profile is keyed by the identity and modification stamp of the elevation raster,
+the sampling resolution and method, and the cutline coordinates,
+so any change to one of these simply misses the cache.
+Entries are evicted least recently used first when the cache grows beyond its size cap
+"""
+
+import os
+import hashlib
+import shutil
+import threading
+import grass.script as grass
+
+
+def raster_stamp(elev):
+	"""
+	Identity of a raster map: its full name, and the size and
+	modification time of its header and data files, and of its null file
+	(r.null changes only that one)
+	"""
+	f = grass.find_file(elev, element='cell')
+	mapset_dir = os.path.dirname(os.path.dirname(f['file']))
+	stamp = [f['fullname']]
+	files = [(element, os.path.join(mapset_dir, element, f['name'])) for element in ('cellhd', 'cell', 'fcell')]
+	files += [(name, os.path.join(mapset_dir, 'cell_misc', f['name'], name)) for name in ('null', 'nullcmpr')]
+	for label, path in files:
+		if os.path.exists(path):
+			st = os.stat(path)
+			stamp.append("%s:%d:%r" % (label, st.st_size, st.st_mtime))
+	return "|".join(stamp)
+
+
+def vector_stamp(vect):
+	"""
+	Identity of a vector map: its full name, and the size and
+	modification time of each file of the map
+	"""
+	f = grass.find_file(vect, element='vector')
+	stamp = [f['fullname']]
+	for name in sorted(os.listdir(f['file'])):
+		st = os.stat(os.path.join(f['file'], name))
+		stamp.append("%s:%d:%r" % (name, st.st_size, st.st_mtime))
+	return "|".join(stamp)
+
+
+def default_path():
+	"""
+	The cache lives in the current mapset
+	"""
+	env = grass.gisenv()
+	return os.path.join(env['GISDBASE'], env['LOCATION_NAME'], env['MAPSET'], 'hecras', 'profile_cache')
+
+
+class ProfileCache(object):
+	"""
+	Profiles are stored one per file, in 256 subdirectories by key prefix.
+	The modification time of a file is its last use.
+	The hit and miss counts are kept under a lock, as threads may share the cache
+	"""
+
+	def __init__(self, path, elev, res, method, max_size):
+		self.path = path
+		self.max_size = max_size
+		self.stamp = "|".join([raster_stamp(elev), str(res), method])
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+
+	def _file(self, cutline):
+		h = hashlib.sha1(self.stamp.encode('utf-8'))
+		for x, y in cutline:
+			h.update(("%s,%s;" % (x, y)).encode('utf-8'))
+		key = h.hexdigest()
+		return os.path.join(self.path, key[:2], key)
+
+	def get(self, cutline):
+		"""
+		The cached profile for a cutline, as a list of (x, y, elevation) strings,
+		or None if it is not in the cache
+		"""
+		path = self._file(cutline)
+		try:
+			with open(path, 'r') as f:
+				surface = [tuple(line.rstrip('\n').split(',')) for line in f]
+		except (IOError, OSError):
+			with self._lock:
+				self.misses += 1
+			return None
+		# Mark as recently used
+		try:
+			os.utime(path, None)
+		except OSError:
+			pass
+		with self._lock:
+			self.hits += 1
+		return surface
+
+	def put(self, cutline, surface):
+		path = self._file(cutline)
+		folder = os.path.dirname(path)
+		if not os.path.isdir(folder):
+			try:
+				os.makedirs(folder)
+			except OSError:
+				# Created meanwhile by another worker
+				if not os.path.isdir(folder):
+					raise
+		# Write to a temp file and rename, so readers never see a partial entry
+		tmp = "%s.%d.%d" % (path, os.getpid(), id(surface))
+		with open(tmp, 'w') as f:
+			for x, y, z in surface:
+				f.write("%s,%s,%s\n" % (x, y, z))
+		if os.name == 'nt' and os.path.exists(path):
+			os.remove(path)
+		os.rename(tmp, path)
+
+	def trim(self):
+		"""
+		Evict the least recently used entries until the cache is within max_size bytes.
+		Returns the number of entries removed
+		"""
+		entries = []
+		total = 0
+		for folder, dirs, files in os.walk(self.path):
+			for name in files:
+				path = os.path.join(folder, name)
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				entries.append((st.st_mtime, st.st_size, path))
+				total += st.st_size
+		removed = 0
+		if total <= self.max_size:
+			return removed
+		entries.sort()
+		for mtime, size, path in entries:
+			if total <= self.max_size:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				continue
+			total -= size
+			removed += 1
+		return removed
+
+
+def clear(path):
+	"""
+	Remove all cached profiles
+	"""
+	if os.path.isdir(path):
+		shutil.rmtree(path)
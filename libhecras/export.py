@@ -0,0 +1,181 @@
+"""
+Export of cross sections to the CROSS-SECTIONS section of a geometry sdf file:
+sampling of the elevation profiles along the cutlines, and writing of the blocks.
+Shared by v.out.hecras (cutlines read from the cross sections vector)
+and v.to.hecras (cutlines from the geometry in memory).
+The output_* functions write a whole geometry sdf file from the geometry in memory,
+for v.to.hecras and v.hecras.batch
+"""
+
+import grass.script as grass
+from libhecras import parallel, profiling, raster, simplify, vector
+from libhecras.sdf import UNITS, write_header, write_stream_network, write_cross_section
+
+# Lines of the list of thinned cross sections in each message (each message is one
+# g.message command, with the text as its argument, which must stay well below 128 kB)
+THINNED_PER_MESSAGE = 1000
+
+
+def location_info():
+	"""
+	The GRASS version and the HEC-RAS units of the location, for the sdf header
+	"""
+	ver = grass.read_command('g.version')
+	d = grass.parse_key_val(grass.read_command('g.proj', flags="g"))
+	return ver, UNITS.get(d['units'], "")
+
+
+@profiling.timed
+def output_headers(river, xsections, reaches, xsects, outfile, version, units):
+	"""
+	Add the header section, with the extent and the number of reaches
+	and cross sections taken from the geometry in memory
+	"""
+	xmin = min([coords[:,0].min() for coords in reaches.values()])
+	xmax = max([coords[:,0].max() for coords in reaches.values()])
+	ymin = min([coords[:,1].min() for coords in reaches.values()])
+	ymax = max([coords[:,1].max() for coords in reaches.values()])
+	extent = [vector.format_coord(v) for v in (xmin, xmax, ymin, ymax)]
+	write_header(outfile, version, units, river, xsections, extent, str(len(reaches)), str(len(xsects)))
+
+
+@profiling.timed
+def output_centerline(river, reaches, features, layout, elev, outfile):
+	"""
+	Output the river network: the endpoints of each reach, with their elevations
+	from one r.what call, and the stations along each reach
+	"""
+	endpoints = []
+	for c in reaches:
+		coords = reaches[c]
+		endpoints.append([vector.format_coord(coords[0,0]), vector.format_coord(coords[0,1])])
+		endpoints.append([vector.format_coord(coords[-1,0]), vector.format_coord(coords[-1,1])])
+	elevs = raster.what(elev, endpoints)
+
+	# The station rows of each reach, in the order of layout
+	reach_stations = {}
+	for c, (text, station_rows, xsects) in zip(layout, features):
+		reach_stations[c] = [(str(pt_id), vector.format_coord(x), vector.format_coord(y))
+				for pt_id, x, y, reach, seq in station_rows]
+
+	network = []
+	for i, c in enumerate(reaches):
+		start, end = endpoints[2*i], endpoints[2*i+1]
+		network.append((str(c), (start[0], start[1], elevs[2*i]), (end[0], end[1], elevs[2*i+1]),
+				reach_stations.get(c, [])))
+	write_stream_network(outfile, river, network)
+
+
+@profiling.timed
+def output_xsections(xsects, outfile, elev, res, river, sampler, nprocs=1, prof_cache=None,
+		max_points=None, tolerance=None):
+	"""
+	Sample the elevation raster along the cross sections in memory,
+	and write the CROSS-SECTIONS section
+	"""
+	outfile.write("\n")
+	cutlines = [[str(reach), str(station_id), [[vector.format_coord(x), vector.format_coord(y)] for x, y in line]]
+			for reach, station_id, line in xsects]
+	write_cross_sections(outfile, river, cutlines, elev, res, sampler, nprocs, prof_cache,
+			max_points, tolerance)
+
+
+def write_cross_sections(outfile, river, cutlines, elev, res, sampler=None, nprocs=1, prof_cache=None,
+		max_points=None, tolerance=None, checkpoint=None):
+	"""
+	Sample the elevation raster along the cutlines (with the in memory sampler, or r.profile
+	when no sampler is given) to get lists of the coords and elevation at each spot along the xsection,
+	and output these to the CROSS-SECTION paragraph.
+	cutlines is a list of [reach, station_id, [[x,y], ...]], all strings.
+	Batches of cross sections are sampled on nprocs workers, and written in their original order.
+	Profiles found in prof_cache are not sampled again.
+	With max_points or tolerance, the profiles are thinned before they are written.
+	With a checkpoint (libhecras.sdf.Checkpoint), each batch written is recorded in it,
+	and the sections it holds from an earlier export are not written again
+	"""
+	if checkpoint is None or checkpoint.start is None:
+		outfile.write("BEGIN CROSS-SECTIONS:\n")
+	if checkpoint is not None:
+		done = len(checkpoint.sections)
+		for (reach, station_id, end), cut in zip(checkpoint.sections, cutlines):
+			if reach != cut[0] or station_id != cut[1]:
+				grass.fatal("Cross section of reach %s at station %s does not match the checkpoint, "
+					"export again without resuming" % (cut[0], cut[1]))
+		if done:
+			grass.message("Resuming after %d cross sections" % done)
+		cutlines = cutlines[done:]
+		checkpoint.open(outfile)
+
+	# Get the elevations along the points of all cross sections in a batch
+	def sample(chunk):
+		surfaces = [None]*len(chunk)
+		if prof_cache is not None:
+			for i in range(len(chunk)):
+				surfaces[i] = prof_cache.get(chunk[i][2])
+		missing = [i for i in range(len(chunk)) if surfaces[i] is None]
+		if sampler is None:
+			for i in missing:
+				surfaces[i] = raster.rprofile(elev, chunk[i][2], res)
+		else:
+			sampled = sampler.profiles([chunk[i][2] for i in missing])
+			for i, surface in zip(missing, sampled):
+				surfaces[i] = surface
+		if prof_cache is not None:
+			for i in missing:
+				prof_cache.put(chunk[i][2], surfaces[i])
+		# Thin the full profiles (as cached) down to the requested size.
+		# This runs on a worker thread: an error is returned with the batch,
+		# and reported from the thread that writes the output
+		dropped = [0]*len(chunk)
+		for i in range(len(chunk)):
+			try:
+				surfaces[i], dropped[i] = simplify.thin_profile(surfaces[i], max_points, tolerance)
+			except ValueError as e:
+				return chunk, surfaces, dropped, "Cross section of reach %s at station %s: %s" % (
+					chunk[i][0], chunk[i][1], e)
+		return chunk, surfaces, dropped, None
+
+	# Each r.profile call is one batch, so that they run side by side,
+	# the in memory sampler takes larger batches
+	if sampler is None:
+		batch = 1
+	else:
+		batch = 1000
+	chunks = (cutlines[b:b+batch] for b in range(0, len(cutlines), batch))
+
+	# Now loop thru those stations, a batch at a time, to create the CUTLINE and SURFACE section
+	# Only a few batches beyond the one being written are extracted ahead
+	# Each message is a GRASS command, so progress is reported every 5% only,
+	# and the thinned sections are listed at the end, many to a message
+	total_dropped = 0
+	thinned = []
+	finished = []
+	written = 0
+	next_pct = 0
+	for chunk, surfaces, dropped, error in parallel.ordered_map(sample, chunks, nprocs, window=4*nprocs):
+		if error is not None:
+			grass.fatal(error)
+		for i in range(len(chunk)):
+			reach, station_id, station_pts = chunk[i]
+			if dropped[i]:
+				thinned.append("reach %s station %s: %d" % (reach, station_id, dropped[i]))
+				total_dropped += dropped[i]
+			write_cross_section(outfile, river, reach, station_id, station_pts, surfaces[i])
+			if checkpoint is not None:
+				finished.append((reach, station_id, outfile.offset))
+		if checkpoint is not None:
+			checkpoint.record(outfile, finished)
+			finished = []
+		written += len(chunk)
+		pct = 100*written//len(cutlines)
+		if pct >= next_pct:
+			grass.percent(written, len(cutlines), 5)
+			next_pct = pct - pct % 5 + 5
+
+	outfile.write("END CROSS-SECTIONS:\n\n")
+	if max_points is not None or tolerance is not None:
+		grass.message("Thinning dropped %d elevation points in total" % total_dropped)
+		if thinned:
+			grass.verbose("Elevation points dropped in %d cross sections:" % len(thinned))
+			for b in range(0, len(thinned), THINNED_PER_MESSAGE):
+				grass.verbose("\n".join(thinned[b:b+THINNED_PER_MESSAGE]))
@@ -0,0 +1,336 @@
+"""
+Geometry of river reaches and cross sections, computed in memory with numpy.
+All polylines are (n,2) arrays of x,y vertices in the order they were digitized.
+"""
+
+import math
+import numpy as np
+
+
+def clean_polyline(coords):
+	"""
+	Remove repeated (zero length) vertices from a polyline
+	so that every remaining segment has a direction
+	"""
+	coords = np.asarray(coords, dtype=float)
+	if len(coords) < 2:
+		return coords
+	seg = np.diff(coords, axis=0)
+	keep = np.concatenate(([True], np.hypot(seg[:,0], seg[:,1]) > 0))
+	return coords[keep]
+
+
+def polyline_length(coords):
+	"""
+	Planimetric length of a polyline
+	"""
+	seg = np.diff(np.asarray(coords, dtype=float), axis=0)
+	return float(np.hypot(seg[:,0], seg[:,1]).sum())
+
+
+def station_offsets(reach_len, spacing):
+	"""
+	Distances, from the start of the reach, of each station along a reach.
+	The first station is spacing/2 from the downstream end (the end of the line)
+	and each following station is "spacing" further upstream,
+	until less than spacing/2 remains. Distances are truncated to whole units,
+	the same as the v.segment rules originally written by v.xsections
+	"""
+	first = reach_len - spacing/2.0
+	if first < spacing/2.0:
+		return np.empty(0)
+	n = int(math.floor((first - spacing/2.0)/spacing)) + 1
+	return np.floor(first - spacing*np.arange(n))
+
+
+def adaptive_offsets(coords, min_spacing, max_spacing, max_turn):
+	"""
+	Distances, from the start of the reach, of stations spaced by the curvature of the reach:
+	at most max_spacing apart, and closer where the reach turns, so that the direction changes
+	by no more than about max_turn (radians) between stations, but never closer than min_spacing.
+	The turn at each vertex is shared by the two segments that meet there, which gives each
+	segment a station density, 1/max_spacing + curvature/max_turn (capped at 1/min_spacing).
+	As with station_offsets, the first station is half a step from the downstream end
+	and the stations are ordered from there upstream
+	"""
+	coords = clean_polyline(coords)
+	if len(coords) < 2:
+		return np.empty(0)
+	seg = np.diff(coords, axis=0)
+	seg_len = np.hypot(seg[:,0], seg[:,1])
+	heading = np.arctan2(seg[:,1], seg[:,0])
+	# Split long segments in pieces of at most max_spacing/2,
+	# so a bend only raises the density of stations close to it
+	pieces = np.maximum(1, np.ceil(seg_len/(max_spacing/2.0))).astype(int)
+	seg_len = np.repeat(seg_len/pieces, pieces)
+	turn = np.zeros(len(seg_len) - 1)
+	turn[np.cumsum(pieces)[:-1] - 1] = np.abs((np.diff(heading) + np.pi) % (2*np.pi) - np.pi)
+	share = np.zeros(len(seg_len))
+	share[:-1] += turn/2
+	share[1:] += turn/2
+	density = np.minimum(1.0/min_spacing, 1.0/max_spacing + share/seg_len/max_turn)
+	# Stations are evenly spaced in the measure (number of steps) along the reach
+	measure = np.concatenate(([0.0], np.cumsum(density*seg_len)))
+	total = measure[-1]
+	if total < 1.0:
+		return np.empty(0)
+	steps = total - 0.5 - np.arange(int(math.floor(total - 0.5)) + 1)
+	steps = steps[steps >= 0.5]
+	cum = np.concatenate(([0.0], np.cumsum(seg_len)))
+	return np.interp(steps, measure, cum)
+
+
+def points_along(coords, offsets):
+	"""
+	Locate points at the given distances along a polyline.
+	Returns an (n,2) array of points, and an (n,2) array with the unit direction
+	of the segment that each point falls on.
+	A distance exactly at a vertex falls on the segment ending at that vertex (as in v.segment)
+	"""
+	coords = clean_polyline(coords)
+	offsets = np.asarray(offsets, dtype=float)
+	seg = np.diff(coords, axis=0)
+	seg_len = np.hypot(seg[:,0], seg[:,1])
+	cum = np.concatenate(([0.0], np.cumsum(seg_len)))
+	idx = np.clip(np.searchsorted(cum, offsets, side='left') - 1, 0, len(seg) - 1)
+	t = (offsets - cum[idx]) / seg_len[idx]
+	pts = coords[idx] + seg[idx]*t[:,np.newaxis]
+	dirs = seg[idx] / seg_len[idx][:,np.newaxis]
+	return pts, dirs
+
+
+def cross_sections(coords, offsets, half_width):
+	"""
+	Build the cutlines for the stations at "offsets" along a reach.
+	Each cutline has three vertices: left of the river, on the river, and right of the river,
+	each side at half_width perpendicular to the local direction of the reach.
+	Returns an (n,3,2) array
+	"""
+	if len(offsets) == 0:
+		return np.empty((0, 3, 2))
+	pts, dirs = points_along(coords, offsets)
+	# Right hand normal of the reach direction
+	# (the side of a positive offset in v.segment)
+	normals = np.column_stack((dirs[:,1], -dirs[:,0]))*half_width
+	left = pts - normals
+	right = pts + normals
+	return np.concatenate((left[:,np.newaxis], pts[:,np.newaxis], right[:,np.newaxis]), axis=1)
+
+
+def water_surface_ring(extents):
+	"""
+	Closed boundary of a water surface from its extents at successive cross sections,
+	each (x left, y left, x right, y right): along the left side in the order of the
+	cross sections, then back along the right side. Returns an (n,2) array
+	"""
+	ext = np.asarray(extents, dtype=float)
+	left = ext[:,0:2]
+	right = ext[::-1,2:4]
+	return np.concatenate((left, right, left[:1]))
+
+
+def points_in_ring(x, y, ring):
+	"""
+	Even-odd test of the points x, y (1D arrays) against a closed ring, an (n,2) array.
+	Loops over the edges of the ring, each edge tested against all points at once.
+	Returns a boolean array
+	"""
+	inside = np.zeros(len(x), dtype=bool)
+	ring = np.asarray(ring, dtype=float)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+			crosses = (y0 > y) != (y1 > y)
+			if not crosses.any():
+				continue
+			x_cross = x0 + (y - y0)*(x1 - x0)/(y1 - y0)
+			inside ^= crosses & (x < x_cross)
+	return inside
+
+
+def segment_distances(x, y, segments):
+	"""
+	Distance from each of the points x, y (1D arrays) to each of the segments,
+	an (m,4) array of (x start, y start, x end, y end). Returns an (n,m) array
+	"""
+	seg = np.asarray(segments, dtype=float)
+	x0, y0 = seg[:,0], seg[:,1]
+	dx, dy = seg[:,2] - x0, seg[:,3] - y0
+	dd = dx*dx + dy*dy
+	px = x[:,np.newaxis] - x0
+	py = y[:,np.newaxis] - y0
+	with np.errstate(divide='ignore', invalid='ignore'):
+		t = np.where(dd > 0, (px*dx + py*dy)/dd, 0.0)
+	t = np.clip(t, 0.0, 1.0)
+	return np.hypot(px - t*dx, py - t*dy)
+
+
+def paired_segment_distances(x, y, segments):
+	"""
+	Distance from each of the points x, y (1D arrays) to the segment of the same index,
+	an (n,4) array of (x start, y start, x end, y end). Returns an (n,) array
+	"""
+	seg = np.asarray(segments, dtype=float)
+	x0, y0 = seg[:,0], seg[:,1]
+	dx, dy = seg[:,2] - x0, seg[:,3] - y0
+	dd = dx*dx + dy*dy
+	px = x - x0
+	py = y - y0
+	with np.errstate(divide='ignore', invalid='ignore'):
+		t = np.where(dd > 0, (px*dx + py*dy)/dd, 0.0)
+	t = np.clip(t, 0.0, 1.0)
+	return np.hypot(px - t*dx, py - t*dy)
+
+
+def _segments(lines):
+	"""
+	All segments of a list of polylines, as an (n,4) array of (x start, y start, x end, y end),
+	and the index of the polyline of each segment
+	"""
+	segs = []
+	owner = []
+	for k, coords in enumerate(lines):
+		coords = np.asarray(coords, dtype=float)
+		if len(coords) < 2:
+			continue
+		segs.append(np.column_stack((coords[:-1], coords[1:])))
+		owner.append(np.repeat(k, len(coords) - 1))
+	if not segs:
+		return np.empty((0, 4)), np.empty(0, dtype=int)
+	return np.concatenate(segs), np.concatenate(owner)
+
+
+def _grid_pairs(seg):
+	"""
+	Candidate pairs of segments whose bounding boxes share a cell of a uniform grid,
+	the grid cell size being the median segment length.
+	Each segment is entered in the few cells that its bounding box covers, the entries are
+	sorted by cell, and the segments in each cell are paired, so the work grows with
+	n log n (the sort) rather than with n squared.
+	Returns two index arrays a, b with a < b, each pair once
+	"""
+	n = len(seg)
+	if n < 2:
+		return np.empty(0, dtype=int), np.empty(0, dtype=int)
+	size = float(np.median(np.hypot(seg[:,2] - seg[:,0], seg[:,3] - seg[:,1])))
+	if size <= 0:
+		size = 1.0
+	x0 = np.minimum(seg[:,0], seg[:,2])
+	y0 = np.minimum(seg[:,1], seg[:,3])
+	gx0, gy0 = x0.min(), y0.min()
+	ix0 = np.floor((x0 - gx0)/size).astype(np.int64)
+	iy0 = np.floor((y0 - gy0)/size).astype(np.int64)
+	ix1 = np.floor((np.maximum(seg[:,0], seg[:,2]) - gx0)/size).astype(np.int64)
+	iy1 = np.floor((np.maximum(seg[:,1], seg[:,3]) - gy0)/size).astype(np.int64)
+	nx = ix1 - ix0 + 1
+	ny = iy1 - iy0 + 1
+	counts = nx*ny
+	# One entry for each cell covered by each segment
+	entry_seg = np.repeat(np.arange(n), counts)
+	local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+	cx = ix0[entry_seg] + local % nx[entry_seg]
+	cy = iy0[entry_seg] + local//nx[entry_seg]
+	cell = cx*(iy1.max() + 1) + cy
+	order = np.argsort(cell, kind='mergesort')
+	cell = cell[order]
+	entry_seg = entry_seg[order]
+	# Pair each entry with the following entries of the same cell
+	a = []
+	b = []
+	d = 1
+	while d < len(cell):
+		same = np.nonzero(cell[d:] == cell[:-d])[0]
+		if len(same) == 0:
+			break
+		a.append(entry_seg[same])
+		b.append(entry_seg[same + d])
+		d += 1
+	if not a:
+		return np.empty(0, dtype=int), np.empty(0, dtype=int)
+	a = np.concatenate(a)
+	b = np.concatenate(b)
+	lo = np.minimum(a, b)
+	hi = np.maximum(a, b)
+	key = np.unique(lo*n + hi)
+	return key//n, key % n
+
+
+def line_intersections(lines, only=None):
+	"""
+	Find where polylines cross each other (crossings of a polyline with itself are ignored).
+	With "only", a boolean array with one value for each of lines, only crossings that
+	involve at least one of the selected polylines are looked for.
+	Returns a list of (i, j, x, y), i < j being the indices of the two polylines in lines,
+	with one crossing point for each pair of polylines that cross
+	"""
+	seg, owner = _segments(lines)
+	a, b = _grid_pairs(seg)
+	other = owner[a] != owner[b]
+	if only is not None:
+		only = np.asarray(only, dtype=bool)
+		other &= only[owner[a]] | only[owner[b]]
+	a, b = a[other], b[other]
+	if len(a) == 0:
+		return []
+	p = seg[a,0:2]
+	r = seg[a,2:4] - p
+	q = seg[b,0:2]
+	s = seg[b,2:4] - q
+	qp = q - p
+	denom = r[:,0]*s[:,1] - r[:,1]*s[:,0]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		t = (qp[:,0]*s[:,1] - qp[:,1]*s[:,0])/denom
+		u = (qp[:,0]*r[:,1] - qp[:,1]*r[:,0])/denom
+	# Parallel segments (denom 0) are not counted as crossing
+	hit = np.nonzero((denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1))[0]
+	found = {}
+	for k in hit:
+		i, j = int(owner[a[k]]), int(owner[b[k]])
+		if i > j:
+			i, j = j, i
+		if (i, j) not in found:
+			x, y = p[k] + r[k]*t[k]
+			found[(i, j)] = (i, j, float(x), float(y))
+	return [found[key] for key in sorted(found)]
+
+
+def trim_cross_sections(xsects, rounds=20, margin=0.99, fixed=None):
+	"""
+	Shorten crossing cross sections, each an (3,2) array of left, center and right points
+	as from cross_sections(), until none cross or "rounds" passes have been made.
+	In each crossing pair the section that crosses farther from its center is shortened
+	on both sides alike, to just short of the crossing point.
+	The sections selected by "fixed" (a boolean array) are never shortened, the other
+	section of their crossings is, and crossings between two fixed sections are ignored.
+	Returns the trimmed sections (an (n,3,2) array), and the list of crossings that remain
+	"""
+	xsects = np.array(xsects, dtype=float)
+	free = None
+	if fixed is not None:
+		free = ~np.asarray(fixed, dtype=bool)
+	for n in range(rounds):
+		crossings = line_intersections(xsects, free)
+		if not crossings:
+			break
+		# The new half width of each section to shorten
+		half = {}
+		for i, j, x, y in crossings:
+			di = math.hypot(x - xsects[i,1,0], y - xsects[i,1,1])
+			dj = math.hypot(x - xsects[j,1,0], y - xsects[j,1,1])
+			if free is not None and not free[i]:
+				k, d = j, dj
+			elif free is not None and not free[j]:
+				k, d = i, di
+			else:
+				k, d = (i, di) if di >= dj else (j, dj)
+			if d > 0:
+				half[k] = min(half.get(k, d), d*margin)
+		if not half:
+			break
+		for k, h in half.items():
+			center = xsects[k,1]
+			for side in (0, 2):
+				v = xsects[k,side] - center
+				length = math.hypot(v[0], v[1])
+				if length > h:
+					xsects[k,side] = center + v*(h/length)
+	return xsects, line_intersections(xsects, free)
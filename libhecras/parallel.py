@@ -0,0 +1,113 @@
+"""
+Order preserving worker pools.
+Work that is mostly waiting on GRASS subprocesses or numpy goes to a pool of threads,
+which is enough to keep several of them busy at once. Work that is mostly python code
+goes to a pool of processes
+"""
+
+import sys
+import threading
+import multiprocessing
+from libhecras import profiling
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+
+def ordered_map(func, items, nprocs=1, window=None):
+	"""
+	Apply func to each of items on a pool of nprocs threads, and yield the results
+	in the same order as items.
+	At most "window" items (default 2*nprocs) are in flight, that is, submitted but
+	not yet yielded, so memory stays bounded however many items there are.
+	An exception raised by func (SystemExit from grass.fatal too) is raised again here,
+	in the calling thread, for the item that caused it
+	"""
+	if nprocs <= 1:
+		for item in items:
+			yield func(item)
+		return
+
+	if not window:
+		window = 2*nprocs
+	tasks = queue.Queue()
+	done = {}
+	cond = threading.Condition()
+	# The commands run by the workers belong to the phase that runs the map
+	phases = profiling.phase_stack()
+
+	def worker():
+		profiling.use_phases(phases)
+		while True:
+			task = tasks.get()
+			if task is None:
+				return
+			i, item = task
+			# Also SystemExit (grass.fatal) and KeyboardInterrupt: a worker that died
+			# without storing a result would leave the caller waiting for it forever
+			try:
+				result = (True, func(item))
+			except BaseException:
+				result = (False, sys.exc_info())
+			with cond:
+				done[i] = result
+				cond.notify_all()
+
+	threads = [threading.Thread(target=worker) for n in range(nprocs)]
+	for t in threads:
+		t.daemon = True
+		t.start()
+
+	items = iter(items)
+	submitted = 0
+	next_out = 0
+	try:
+		while True:
+			# Keep the window full
+			while submitted - next_out < window:
+				try:
+					item = next(items)
+				except StopIteration:
+					break
+				tasks.put((submitted, item))
+				submitted += 1
+			if next_out == submitted:
+				break
+			# Wait for the next result in order
+			with cond:
+				while next_out not in done:
+					cond.wait()
+				ok, result = done.pop(next_out)
+			next_out += 1
+			if not ok:
+				exc_type, exc_value, tb = result
+				raise exc_value
+			yield result
+	finally:
+		for t in threads:
+			tasks.put(None)
+
+
+def process_map(func, items, nprocs=1):
+	"""
+	Apply func to each of items on a pool of nprocs worker processes, and return the
+	list of results in the same order as items. The items are handed out in chunks,
+	a few chunks for each process.
+	func must be a module level function, and the items and results must pickle.
+	An exception raised by func is raised again here
+	"""
+	items = list(items)
+	if nprocs <= 1 or len(items) < 2:
+		return [func(item) for item in items]
+
+	pool = multiprocessing.Pool(min(nprocs, len(items)))
+	try:
+		results = pool.map(func, items, max(1, len(items)//(4*nprocs)))
+	except Exception:
+		pool.terminate()
+		raise
+	pool.close()
+	pool.join()
+	return results
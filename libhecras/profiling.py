@@ -0,0 +1,294 @@
+"""
+Timing of the GRASS commands run by the modules, and of their main phases.
+When profiling is started, the grass.script functions that run GRASS modules are wrapped,
+so every command is recorded with its arguments, wall time and the bytes read from its output,
+and every function decorated with timed() is recorded as a phase, with the peak memory (RSS) of the process at its end.
+finish() writes the records as JSON and prints a summary. It is also called at exit,
+so a run that fails (grass.fatal) still writes the profile up to the failure.
+When profiling is not started nothing is wrapped, and timed() only calls the function
+"""
+
+import sys
+import time
+import atexit
+import json
+import threading
+import grass.script as grass
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# The grass.script functions that start GRASS modules
+WRAPPED = ('run_command', 'read_command', 'pipe_command', 'start_command',
+	'write_command', 'parse_command', 'feed_command')
+
+_state = {'path': None, 'start': None, 'originals': {}, 'atexit': False}
+_commands = []
+_phases = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def enabled():
+	return _state['path'] is not None
+
+
+def _max_rss():
+	"""
+	Peak resident set size of this process so far (kB), None where it is not known.
+	On linux it is read from /proc, as the rusage figure counts the memory
+	of the parent process too when it was larger at the start of this one
+	"""
+	try:
+		with open('/proc/self/status') as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	if resource is None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Bytes on mac OS, kB elsewhere
+	return rss//1024 if sys.platform == 'darwin' else rss
+
+
+def _current_phase():
+	"""
+	The name and number of the innermost phase running in this thread
+	"""
+	stack = getattr(_local, 'phases', None)
+	return stack[-1] if stack else (None, None)
+
+
+def phase_stack():
+	"""
+	The phases running in this thread, for use_phases() on the worker threads it starts
+	"""
+	return list(getattr(_local, 'phases', []))
+
+
+def use_phases(stack):
+	"""
+	Record the commands and phases of this (worker) thread inside the phases of another
+	"""
+	_local.phases = list(stack)
+
+
+class _Record(object):
+	"""
+	One GRASS command
+	"""
+
+	def __init__(self, func, prog, kwargs):
+		self.func = func
+		self.prog = prog
+		self.args = dict((k, str(v)) for k, v in kwargs.items()
+				if k not in ('stdin', 'stdout', 'stderr', 'env'))
+		self.phase, self.phase_id = _current_phase()
+		self.start = time.time()
+		self.wall = None
+		self.bytes_read = 0
+
+	def finish(self):
+		if self.wall is None:
+			self.wall = time.time() - self.start
+
+	def as_dict(self):
+		return {'command': self.prog, 'function': self.func, 'args': self.args, 'phase': self.phase,
+			'phase_id': self.phase_id, 'start': self.start - _state['start'], 'wall': self.wall,
+			'bytes_read': self.bytes_read}
+
+
+class _CountingReader(object):
+	"""
+	The stdout of a piped command, counting the bytes read through it
+	"""
+
+	def __init__(self, f, record):
+		self._f = f
+		self._record = record
+
+	def _count(self, data):
+		self._record.bytes_read += len(data)
+		return data
+
+	def read(self, *args):
+		return self._count(self._f.read(*args))
+
+	def readline(self, *args):
+		return self._count(self._f.readline(*args))
+
+	def readlines(self, *args):
+		return [self._count(line) for line in self._f.readlines(*args)]
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		return self._count(next(self._f))
+
+	next = __next__
+
+	def close(self):
+		self._f.close()
+		self._record.finish()
+
+	def __getattr__(self, name):
+		return getattr(self._f, name)
+
+
+def _watch(p, record):
+	"""
+	Follow a started process: count its output, and finish the record when it is waited for
+	"""
+	if getattr(p, 'stdout', None) is not None:
+		p.stdout = _CountingReader(p.stdout, record)
+	wait = p.wait
+	communicate = p.communicate
+
+	def watched_wait(*args, **kwargs):
+		result = wait(*args, **kwargs)
+		record.finish()
+		return result
+
+	def watched_communicate(*args, **kwargs):
+		result = communicate(*args, **kwargs)
+		if result and result[0] is not None:
+			record.bytes_read = len(result[0])
+		record.finish()
+		return result
+
+	p.wait = watched_wait
+	p.communicate = watched_communicate
+	return p
+
+
+def _wrap(name, func):
+	def wrapper(*args, **kwargs):
+		# Commands started inside another wrapped call (run_command calls start_command)
+		# belong to the outer record
+		if getattr(_local, 'depth', 0) > 0:
+			return func(*args, **kwargs)
+		record = _Record(name, args[0] if args else kwargs.get('prog', '?'), kwargs)
+		with _lock:
+			_commands.append(record)
+		_local.depth = 1
+		try:
+			result = func(*args, **kwargs)
+		finally:
+			_local.depth = 0
+		if name in ('pipe_command', 'start_command', 'feed_command'):
+			return _watch(result, record)
+		if name == 'read_command' and result is not None:
+			record.bytes_read = len(result)
+		record.finish()
+		return result
+	wrapper.__name__ = func.__name__
+	wrapper.__doc__ = func.__doc__
+	return wrapper
+
+
+def start(path):
+	"""
+	Start profiling, if path (the JSON output file) is given
+	"""
+	if not path or enabled():
+		return
+	_state['path'] = path
+	_state['start'] = time.time()
+	if not _state['atexit']:
+		atexit.register(finish)
+		_state['atexit'] = True
+	with _lock:
+		del _commands[:]
+		del _phases[:]
+	modules = [grass]
+	core = sys.modules.get('grass.script.core')
+	if core is not None and core is not grass:
+		modules.append(core)
+	for name in WRAPPED:
+		func = getattr(grass, name, None)
+		if func is None:
+			continue
+		wrapped = _wrap(name, func)
+		for module in modules:
+			if getattr(module, name, None) is func:
+				_state['originals'][(module, name)] = func
+				setattr(module, name, wrapped)
+
+
+def timed(func):
+	"""
+	Decorator recording each call of a function as a phase
+	"""
+	def wrapper(*args, **kwargs):
+		if not enabled():
+			return func(*args, **kwargs)
+		if not hasattr(_local, 'phases'):
+			_local.phases = []
+		with _lock:
+			phase = {'phase': func.__name__, 'id': len(_phases)}
+			_phases.append(phase)
+		_local.phases.append((func.__name__, phase['id']))
+		begin = time.time()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			_local.phases.pop()
+			phase['start'] = begin - _state['start']
+			phase['wall'] = time.time() - begin
+			phase['max_rss_kb'] = _max_rss()
+	wrapper.__name__ = func.__name__
+	wrapper.__doc__ = func.__doc__
+	return wrapper
+
+
+def summary():
+	"""
+	The profile as a dict: total wall time, phases, commands, and totals for each command
+	"""
+	with _lock:
+		commands = [r.as_dict() for r in _commands]
+		phases = [dict(p) for p in _phases if 'wall' in p]
+	totals = {}
+	for c in commands:
+		t = totals.setdefault(c['command'], {'command': c['command'], 'calls': 0, 'wall': 0.0, 'bytes_read': 0})
+		t['calls'] += 1
+		t['wall'] += c['wall'] or 0.0
+		t['bytes_read'] += c['bytes_read']
+	for p in phases:
+		inside = [c for c in commands if c['phase_id'] == p['id']]
+		p['commands'] = len(inside)
+		p['command_wall'] = sum([c['wall'] or 0.0 for c in inside])
+	return {'wall': time.time() - _state['start'], 'phases': phases, 'commands': commands,
+		'max_rss_kb': _max_rss(), 'totals': sorted(totals.values(), key=lambda t: -t['wall'])}
+
+
+def finish():
+	"""
+	Write the profile to the JSON file, print the summary tables, and unwrap the grass.script functions.
+	Only the first call after start() does anything, the one at exit is then skipped
+	"""
+	if not enabled():
+		return
+	result = summary()
+	with open(_state['path'], 'w') as f:
+		json.dump(result, f, indent=1, sort_keys=True)
+
+	lines = ["Profile: total %.3f s" % result['wall'], "",
+		"%-32s %10s %9s %13s" % ("phase", "wall (s)", "commands", "in commands")]
+	for p in result['phases']:
+		lines.append("%-32s %10.3f %9d %13.3f" % (p['phase'], p['wall'], p['commands'], p['command_wall']))
+	lines += ["", "%-32s %10s %9s %13s" % ("command", "wall (s)", "calls", "bytes read")]
+	for t in result['totals']:
+		lines.append("%-32s %10.3f %9d %13d" % (t['command'], t['wall'], t['calls'], t['bytes_read']))
+	grass.message("\n".join(lines))
+	grass.message("Profile written to: %s" % _state['path'])
+
+	for (module, name), func in _state['originals'].items():
+		setattr(module, name, func)
+	_state['originals'].clear()
+	_state['path'] = None
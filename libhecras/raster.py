@@ -0,0 +1,342 @@
+"""
+Sampling of the elevation raster for the HEC-RAS export
+"""
+
+import os
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+import grass.script as grass
+from libhecras import vector
+
+# Written by r.out.bin in place of null cells
+NULL_VALUE = -1.0e30
+
+
+def what(elev, coords):
+	"""
+	Query the raster value at many points with one r.what call.
+	coords is a list of (x,y) pairs (numbers or strings), fed to r.what on stdin.
+	Returns a list of the values as strings (in the same order as coords),
+	with "*" for null cells, just as r.what prints them
+	"""
+	if not coords:
+		return []
+	pts = "".join(["%s %s\n" % (x, y) for x, y in coords])
+	p = grass.start_command('r.what', map=elev, separator=",", quiet=True,
+				stdin=grass.PIPE, stdout=grass.PIPE)
+	out = vector.decode(p.communicate(pts.encode('utf-8'))[0])
+	# Each output line is: x,y,label,value
+	values = [line.split(",")[3].rstrip() for line in out.splitlines() if line.strip()]
+	if len(values) != len(coords):
+		grass.fatal("r.what returned %d values for %d points" % (len(values), len(coords)))
+	return values
+
+
+def rprofile(elev, coords, res):
+	"""
+	Elevation profile along a polyline using r.profile (in the current region).
+	Returns a list of (x, y, elevation) strings as printed by r.profile -g
+	"""
+	surface=[]
+	pp=grass.pipe_command('r.profile', input=elev, coordinates=coords, resolution=res, flags="g", quiet=True)
+	for line in vector.text_lines(pp.stdout):
+		l=line.rstrip('\n').split(" ")
+		# The r.profile output has x,y in first two columns and elev in 4th column
+		surface.append((l[0], l[1], l[3]))
+	pp.stdout.close()
+	pp.wait()
+	return surface
+
+
+def region_env(region, proj, zone):
+	"""
+	A GRASS_REGION string for the region dict (as returned by grass.region())
+	"""
+	return ("proj:%s;zone:%s;north:%r;south:%r;east:%r;west:%r;cols:%d;rows:%d;"
+		"e-w resol:%r;n-s resol:%r;top:1;bottom:0;cols3:%d;rows3:%d;depths:1;"
+		"e-w resol3:%r;n-s resol3:%r;t-b resol:1;" %
+		(proj, zone, region['n'], region['s'], region['e'], region['w'],
+		region['cols'], region['rows'], region['ewres'], region['nsres'],
+		region['cols'], region['rows'], region['ewres'], region['nsres']))
+
+
+def projection():
+	"""
+	Projection code and zone of the current location, as needed for GRASS_REGION
+	"""
+	d = grass.parse_key_val(grass.read_command('g.region', flags="pu"), sep=":")
+	return d['projection'].split()[0], d['zone'].strip()
+
+
+def window(region, r0, r1, c0, c1):
+	"""
+	The region dict of rows r0 to r1 and columns c0 to c1 (not including r1, c1) of region
+	"""
+	return {
+		'n': region['n'] - r0*region['nsres'], 's': region['n'] - r1*region['nsres'],
+		'w': region['w'] + c0*region['ewres'], 'e': region['w'] + c1*region['ewres'],
+		'nsres': region['nsres'], 'ewres': region['ewres'], 'rows': r1 - r0, 'cols': c1 - c0}
+
+
+def read_window(elev, win, proj, zone):
+	"""
+	Read the cells of a raster in the window "win" (a region dict on the grid of the raster region)
+	with r.out.bin into a memory mapped temp file, without changing the current region.
+	Null cells are NaN. Returns the temp file name and the 2D array
+	"""
+	env = os.environ.copy()
+	env['GRASS_REGION'] = region_env(win, proj, zone)
+	tmp_bin = grass.tempfile()
+	grass.run_command('r.out.bin', input=elev, output=tmp_bin, bytes=8, null=NULL_VALUE,
+			flags="f", quiet=True, overwrite=True, env=env)
+	data = np.memmap(tmp_bin, dtype=np.float64, mode='r+', shape=(int(win['rows']), int(win['cols'])))
+	data[data == NULL_VALUE] = np.nan
+	return tmp_bin, data
+
+
+def _morton(tr, tc):
+	"""
+	Z-order of a tile row and column, so that tiles next to each other are visited together
+	"""
+	key = 0
+	for bit in range(32):
+		key |= ((tr >> bit) & 1) << (2*bit + 1) | ((tc >> bit) & 1) << (2*bit)
+	return key
+
+
+class TileCache(object):
+	"""
+	Square windows (tiles) of a raster on the grid of region,
+	read on demand with r.out.bin and kept as memory mapped files.
+	Only tiles that are sampled are ever read, and at most "memory" MB of tiles
+	are kept, the least recently used being dropped first.
+	Null cells are NaN
+	"""
+
+	def __init__(self, elev, region, tile_size=512, memory=300):
+		self.elev = elev
+		self.region = region
+		self.tile_size = tile_size
+		self.nrows = int(region['rows'])
+		self.ncols = int(region['cols'])
+		self.tile_cols = (self.ncols + tile_size - 1)//tile_size
+		self.capacity = max(1, int(memory*1024*1024//(tile_size*tile_size*8)))
+		self.tiles = OrderedDict()
+		self.reads = 0
+		self.lock = threading.Lock()
+		# Projection and zone for the GRASS_REGION of each tile
+		self.proj, self.zone = projection()
+
+	def _read(self, tr, tc):
+		ts = self.tile_size
+		reg = self.region
+		r0, c0 = tr*ts, tc*ts
+		r1, c1 = min(r0 + ts, self.nrows), min(c0 + ts, self.ncols)
+		self.reads += 1
+		return read_window(self.elev, window(reg, r0, r1, c0, c1), self.proj, self.zone)
+
+	def tile(self, tr, tc):
+		"""
+		The cells of one tile, as a 2D array
+		"""
+		key = (tr, tc)
+		with self.lock:
+			if key in self.tiles:
+				# Mark as recently used
+				entry = self.tiles.pop(key)
+			else:
+				entry = self._read(tr, tc)
+				while len(self.tiles) >= self.capacity:
+					old_key, (old_file, old_data) = self.tiles.popitem(last=False)
+					del old_data
+					os.unlink(old_file)
+			self.tiles[key] = entry
+			return entry[1]
+
+	def cells(self, row, col):
+		"""
+		Values of the cells at row, col (integer arrays on the region grid),
+		NaN for null cells and for cells outside the region.
+		The tiles are visited in Z-order, each tile once
+		"""
+		row = np.asarray(row)
+		col = np.asarray(col)
+		vals = np.empty(len(row))
+		vals.fill(np.nan)
+		inside = np.nonzero((row >= 0) & (row < self.nrows) & (col >= 0) & (col < self.ncols))[0]
+		if len(inside) == 0:
+			return vals
+		ts = self.tile_size
+		tr = row[inside]//ts
+		tc = col[inside]//ts
+		keys = tr*self.tile_cols + tc
+		for key in sorted(set(keys.tolist()), key=lambda k: _morton(k//self.tile_cols, k % self.tile_cols)):
+			sel = inside[keys == key]
+			t_r, t_c = key//self.tile_cols, key % self.tile_cols
+			data = self.tile(t_r, t_c)
+			vals[sel] = data[row[sel] - t_r*ts, col[sel] - t_c*ts]
+		return vals
+
+	def close(self):
+		"""
+		Remove all tile files
+		"""
+		with self.lock:
+			while self.tiles:
+				key, (tile_file, data) = self.tiles.popitem()
+				del data
+				os.unlink(tile_file)
+
+
+def profile_points(coords, res):
+	"""
+	The positions sampled by r.profile along a polyline, at "res" intervals.
+	Each segment is stepped from its start vertex, in the same way (and the same
+	floating point order) as r.profile, stopping before the end vertex.
+	As in r.profile, the direction of each segment is computed in single precision
+	(C float) from its rows and cols, and the steps in double precision.
+	Returns two arrays, x and y
+	"""
+	xs = []
+	ys = []
+	for i in range(1, len(coords)):
+		e1, n1 = coords[i-1]
+		e2, n2 = coords[i]
+		rows = np.float32(n1 - n2)
+		cols = np.float32(e1 - e2)
+		if rows == 0 and cols == 0:
+			# No movement, only the vertex itself
+			xs.append(np.array([e1]))
+			ys.append(np.array([n1]))
+			continue
+		azi = math.atan(float(rows/cols)) if cols != 0 else math.pi/2
+		X = abs(res*math.cos(azi))
+		Y = abs(res*math.sin(azi))
+		# Direction of the steps, by quadrant
+		if rows >= 0 and cols < 0:
+			de, dn = X, -Y
+		elif rows < 0 and cols <= 0:
+			de, dn = X, Y
+		elif rows > 0 and cols >= 0:
+			de, dn = -X, -Y
+		else:
+			de, dn = -X, Y
+		nsteps = int(math.hypot(rows, cols)/res) + 2
+		while True:
+			e = np.add.accumulate(np.concatenate(([e1], np.repeat(de, nsteps))))
+			n = np.add.accumulate(np.concatenate(([n1], np.repeat(dn, nsteps))))
+			# Keep stepping while either coordinate has not yet reached the end vertex
+			go = ((e < e2) if de > 0 else (e > e2)) | ((n < n2) if dn > 0 else (n > n2))
+			if not go.all():
+				break
+			nsteps *= 2
+		stop = int(np.argmin(go))
+		xs.append(e[:stop])
+		ys.append(n[:stop])
+
+	if not xs:
+		return np.empty(0), np.empty(0)
+	return np.concatenate(xs), np.concatenate(ys)
+
+
+class ProfileSampler(object):
+	"""
+	Elevation profiles along cutlines, sampled in memory from the elevation raster.
+	Only the tiles of the raster (on the grid of the current region) under the cutlines
+	are read, and at most "memory" MB of them are kept;
+	with method="nearest" the profiles are the same as r.profile -g run in that region
+	"""
+
+	def __init__(self, elev, res, method="nearest", memory=300):
+		self.elev = elev
+		self.region = grass.region()
+		self.res = float(res)
+		self.method = method
+		info = grass.raster_info(elev)
+		# Integer values are printed as integers, like r.profile does
+		self.is_int = info['datatype'] == "CELL" and method == "nearest"
+		self.tiles = TileCache(elev, self.region, memory=memory)
+
+	def values(self, x, y):
+		"""
+		Raster values at the points x,y (arrays), NaN for null cells
+		and for points outside the region
+		"""
+		reg = self.region
+		nrows, ncols = int(reg['rows']), int(reg['cols'])
+		if self.method == "bilinear":
+			# Position relative to the cell centers
+			fr = (reg['n'] - y)/reg['nsres'] - 0.5
+			fc = (x - reg['w'])/reg['ewres'] - 0.5
+			r0 = np.floor(fr).astype(int)
+			c0 = np.floor(fc).astype(int)
+			dr = fr - r0
+			dc = fc - c0
+			r0c = np.clip(r0, 0, nrows-1)
+			r1c = np.clip(r0+1, 0, nrows-1)
+			c0c = np.clip(c0, 0, ncols-1)
+			c1c = np.clip(c0+1, 0, ncols-1)
+			# All four neighbors in one pass over the tiles
+			n = len(x)
+			v = self.tiles.cells(np.concatenate((r0c, r0c, r1c, r1c)), np.concatenate((c0c, c1c, c0c, c1c)))
+			vals = (v[:n]*(1-dr)*(1-dc) + v[n:2*n]*(1-dr)*dc +
+				v[2*n:3*n]*dr*(1-dc) + v[3*n:]*dr*dc)
+			# Where a neighbor is null, fall back to the nearest cell
+			nearest = np.isnan(vals)
+			if nearest.any():
+				vals[nearest] = self._nearest(x[nearest], y[nearest])
+			outside = (fr < -0.5) | (fr >= nrows - 0.5) | (fc < -0.5) | (fc >= ncols - 0.5)
+			vals[outside] = np.nan
+			return vals
+		return self._nearest(x, y)
+
+	def _nearest(self, x, y):
+		reg = self.region
+		# Truncated toward zero, as in r.profile
+		row = np.trunc((reg['n'] - y)/reg['nsres']).astype(int)
+		col = np.trunc((x - reg['w'])/reg['ewres']).astype(int)
+		return self.tiles.cells(row, col)
+
+	def profiles(self, cutlines):
+		"""
+		Sample a batch of cutlines (each a list of x,y pairs) in one vectorized pass.
+		Returns a list with one profile for each cutline,
+		each a list of (x, y, elevation) strings formatted as by r.profile -g
+		"""
+		pts = [profile_points(np.asarray(c, dtype=float), self.res) for c in cutlines]
+		if not pts:
+			return []
+		x = np.concatenate([p[0] for p in pts])
+		y = np.concatenate([p[1] for p in pts])
+		vals = self.values(x, y)
+		surfaces = []
+		start = 0
+		for px, py in pts:
+			end = start + len(px)
+			surfaces.append([format_point(x[i], y[i], vals[i], self.is_int) for i in range(start, end)])
+			start = end
+		return surfaces
+
+	def close(self):
+		self.tiles.close()
+
+	def profile(self, coords):
+		"""
+		Sample a single cutline
+		"""
+		return self.profiles([coords])[0]
+
+
+def format_point(x, y, z, is_int=False):
+	"""
+	Format one profile point the way r.profile prints it
+	"""
+	if np.isnan(z):
+		elev = "*"
+	elif is_int:
+		elev = "%d" % z
+	else:
+		elev = "%f" % z
+	return ("%f" % x, "%f" % y, elev)
@@ -0,0 +1,423 @@
+"""
+Reading and writing of HEC-RAS spatial data format (sdf) files
+"""
+
+import os
+import json
+import datetime
+
+# HEC-RAS units for the units of the GRASS location
+UNITS = {'metres': "METRIC", 'feet': "US CUSTOMARY"}
+
+
+class SdfWriter(object):
+	"""
+	Buffered writer for a HEC-RAS sdf file.
+	Text is written with "\\n" line endings, and converted to the chosen line ending
+	(windows CR-LF by default) as it is written.
+	Output goes to a temporary file next to the sdf, which is renamed to the sdf
+	only when the writer is closed successfully, so a failed export never leaves
+	a truncated sdf behind.
+	With keep, the temporary file of a failed export is kept, and a later writer
+	can continue it from the byte offset given by resume
+	"""
+
+	def __init__(self, sdf, newline="\r\n", bufsize=4*1024*1024, keep=False, resume=None):
+		self.sdf = sdf
+		self.tmp = sdf + ".tmp"
+		self.newline = newline
+		self.keep = keep
+		if resume is None:
+			self.file = open(self.tmp, 'wb', bufsize)
+			self.offset = 0
+		else:
+			self.file = open(self.tmp, 'r+b', bufsize)
+			self.file.truncate(resume)
+			self.file.seek(resume)
+			self.offset = resume
+
+	def write(self, text):
+		if self.newline != "\n":
+			text = text.replace("\n", self.newline)
+		if not isinstance(text, bytes):
+			text = text.encode('utf-8')
+		self.file.write(text)
+		self.offset += len(text)
+
+	def flush(self):
+		"""
+		Make sure all that is written so far is on disk
+		"""
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+		"""
+		Finish the file, and move it into place
+		"""
+		self.file.close()
+		if os.name == 'nt' and os.path.exists(self.sdf):
+			# rename does not replace an existing file on windows
+			os.remove(self.sdf)
+		os.rename(self.tmp, self.sdf)
+
+	def abort(self):
+		"""
+		Discard the partly written file, unless it is kept to be resumed
+		"""
+		self.file.close()
+		if not self.keep and os.path.exists(self.tmp):
+			os.remove(self.tmp)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+		return False
+
+
+class Checkpoint(object):
+	"""
+	Progress of an sdf export, kept next to the partial file in <sdf>.ckpt,
+	so that an export which fails part way can be resumed.
+	The first line holds the identity of the inputs (a dict of strings and numbers)
+	and the byte offset where the cross sections start, and each following line
+	a finished cross section: its reach, station and the byte offset of the end of its block.
+	Sections are recorded only once their blocks are on disk
+	"""
+
+	def __init__(self, sdf, inputs):
+		self.path = sdf + ".ckpt"
+		self.tmp = sdf + ".tmp"
+		self.inputs = inputs
+		self.start = None
+		self.sections = []
+		self.changed = []
+		self.file = None
+
+	def load(self):
+		"""
+		Read the checkpoint of an earlier export of the same sdf, and return the byte offset
+		of the partial file to continue from, or None if there is nothing to resume.
+		If the inputs have changed since, their keys are listed in changed, and None is returned
+		"""
+		if not (os.path.exists(self.path) and os.path.exists(self.tmp)):
+			return None
+		size = os.path.getsize(self.tmp)
+		with open(self.path, 'r') as f:
+			try:
+				saved = json.loads(f.readline())
+				inputs, start = saved['inputs'], saved['start']
+			except (ValueError, KeyError):
+				return None
+			self.changed = sorted([k for k in set(inputs) | set(self.inputs)
+					if inputs.get(k) != self.inputs.get(k)])
+			if self.changed or start > size:
+				return None
+			for line in f:
+				try:
+					reach, station, end = json.loads(line)
+				except ValueError:
+					# The last line was cut short
+					break
+				if end > size:
+					break
+				self.sections.append((reach, station, end))
+		self.start = start
+		if self.sections:
+			return self.sections[-1][2]
+		return start
+
+	def open(self, outfile):
+		"""
+		Start recording: the cross sections start at the current offset of outfile,
+		or continue after the sections loaded from an earlier export
+		"""
+		if self.start is None:
+			outfile.flush()
+			self.start = outfile.offset
+		self.file = open(self.path, 'w')
+		self.file.write(json.dumps({'inputs': self.inputs, 'start': self.start}) + "\n")
+		for section in self.sections:
+			self.file.write(json.dumps(list(section)) + "\n")
+		self.file.flush()
+
+	def record(self, outfile, sections):
+		"""
+		Record the sections just written to outfile, as (reach, station, end offset)
+		"""
+		outfile.flush()
+		for section in sections:
+			self.file.write(json.dumps(list(section)) + "\n")
+		self.file.flush()
+		self.sections.extend(sections)
+
+	def remove(self):
+		"""
+		The export is finished (or starts over), drop the checkpoint
+		"""
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+
+def write_header(outfile, version, units, stream_layer, xsection_layer, extent, num_reaches, num_xsects):
+	"""
+	Write the comments and HEADER section of a geometry sdf file.
+	extent is (xmin, xmax, ymin, ymax), and all values are strings
+	"""
+	outfile.write("# RAS geometry file create on: "+str(datetime.date.today())+"\n")
+	outfile.write("# exported from GRASS GIS version: "+version+"\n\n")
+	outfile.write("BEGIN HEADER:\n")
+	outfile.write(" UNITS: "+ units + "\n")
+	outfile.write(" DTM TYPE: GRID\n")
+	outfile.write(" STREAM LAYER: "+ stream_layer +"\n")
+	outfile.write(" CROSS-SECTION LAYER: "+ xsection_layer +"\n")
+	outfile.write(" BEGIN SPATIALEXTENT: \n")
+	outfile.write("   Xmin: "+ extent[0] +"\n")
+	outfile.write("   Xmax: "+ extent[1] +"\n")
+	outfile.write("   Ymin: "+ extent[2] +"\n")
+	outfile.write("   Ymax: "+ extent[3] +"\n")
+	outfile.write(" END SPATIALEXTENT: \n")
+	outfile.write(" NUMBER OF REACHES: "+ num_reaches +"\n")
+	outfile.write(" NUMBER OF CROSS-SECTIONS: "+ num_xsects +"\n")
+	outfile.write("END HEADER:\n\n")
+
+
+def write_stream_network(outfile, stream_id, reaches):
+	"""
+	Write the STREAM NETWORK section: the two endpoints of each reach, and then each reach
+	with the stations along its centerline.
+	reaches is a list of (reach id, start point, end point, stations), each point an (x, y, elevation)
+	and stations a list of (station id, x, y) from the downstream end; all values are strings.
+	The endpoints get the ids reach id + "1" and reach id + "2"
+	"""
+	outfile.write("BEGIN STREAM NETWORK:\n")
+	for reach_id, start, end, stations in reaches:
+		outfile.write(" ENDPOINT: "+start[0]+","+start[1]+","+start[2]+","+reach_id+"1\n")
+		outfile.write(" ENDPOINT: "+end[0]+","+end[1]+","+end[2]+","+reach_id+"2\n")
+
+	for reach_id, start, end, stations in reaches:
+		outfile.write(" REACH:\n")
+		outfile.write("   STREAM ID: %s\n" % stream_id)
+		outfile.write("   REACH ID: %s\n" % reach_id)
+		outfile.write("   FROM POINT: %s1\n" % reach_id)
+		outfile.write("   TO POINT: %s2\n" % reach_id)
+		# The centerline is from upstream to downstream
+		outfile.write("   CENTERLINE:\n")
+		for st_id, x, y in reversed(stations):
+			outfile.write("	"+x+","+y+",NULL,"+st_id+"\n")
+		outfile.write(" END:\n")
+
+	outfile.write("END STREAM NETWORK:\n\n")
+
+
+def write_cross_section(outfile, stream_id, reach_id, station, cutline, surface):
+	"""
+	Write one CROSS-SECTION block: cutline is a list of (x, y), and surface
+	(the elevation points along the cutline) a list of (x, y, elevation), all strings
+	"""
+	outfile.write(" CROSS-SECTION:\n")
+	outfile.write("   STREAM ID: %s\n" % stream_id)
+	outfile.write("   REACH ID: %s\n" % reach_id)
+	outfile.write("   STATION: %s\n" % station)
+	outfile.write("   CUTLINE:\n")
+	for x, y in cutline:
+		outfile.write("	 "+x+","+y+"\n")
+	outfile.write("   SURFACE LINE:\n")
+	for x, y, z in surface:
+		outfile.write("	 "+x+","+y+","+z+"\n")
+	outfile.write(" END:\n\n")
+
+
+class CrossSection(object):
+	"""
+	One CROSS-SECTION block of an sdf file.
+	Coordinates are floats: cutline is a list of (x,y), surface_line a list of (x,y,z),
+	bank_positions the left and right bank as fractions of the cutline length,
+	water_elevation one value per profile, and water_extents one
+	(x left, y left, x right, y right) per profile.
+	offset is the byte offset of the block in the file
+	"""
+
+	def __init__(self, offset=None):
+		self.offset = offset
+		self.stream_id = None
+		self.reach_id = None
+		self.station = None
+		self.cutline = []
+		self.surface_line = []
+		self.bank_positions = []
+		self.water_elevation = []
+		self.water_extents = []
+
+	def __repr__(self):
+		return "CrossSection(reach=%r, station=%r)" % (self.reach_id, self.station)
+
+
+# Keywords of a CROSS-SECTION block that are followed by lines of coordinates
+_COORD_BLOCKS = {
+	'CUT LINE': 'cutline',
+	'CUTLINE': 'cutline',
+	'SURFACE LINE': 'surface_line',
+	'WATER SURFACE EXTENTS': 'water_extents',
+	'WATER SURFACE EXTENT': 'water_extents',
+}
+
+
+def _numbers(text):
+	return [float(v) for v in text.replace(" ", "").split(",") if v]
+
+
+def _lines(sdf, offset=0):
+	"""
+	Stream the lines of an sdf file with their byte offsets
+	"""
+	with open(sdf, 'rb') as f:
+		f.seek(offset)
+		for raw in f:
+			yield offset, raw.decode('latin-1').strip()
+			offset += len(raw)
+
+
+def read_header(sdf):
+	"""
+	The key: value pairs of the HEADER section, as a dict of strings
+	"""
+	header = {}
+	for offset, line in _lines(sdf):
+		if line.startswith("END HEADER"):
+			break
+		if ":" in line and not line.startswith("BEGIN HEADER"):
+			key, value = line.split(":", 1)
+			header[key.strip()] = value.strip()
+	return header
+
+
+def read_cross_sections(sdf, offset=0, limit=None):
+	"""
+	Stream the CROSS-SECTION blocks of an sdf file (HEC-RAS results or v.out.hecras output),
+	yielding a CrossSection for each one, without reading the whole file into memory.
+	Reading may begin at the byte offset of a block (as found in the index),
+	and stop after "limit" blocks
+	"""
+	xs = None
+	block = None
+	count = 0
+	for pos, line in _lines(sdf, offset):
+		if not line:
+			continue
+		if line.startswith("CROSS-SECTION:"):
+			xs = CrossSection(pos)
+			block = None
+			continue
+		if xs is None:
+			continue
+		if line.startswith("END:"):
+			yield xs
+			xs = None
+			count += 1
+			if limit is not None and count >= limit:
+				return
+			continue
+		if ":" in line:
+			key, value = line.split(":", 1)
+			key = key.strip()
+			value = value.strip()
+			block = _COORD_BLOCKS.get(key)
+			if key == "STREAM ID":
+				xs.stream_id = value
+			elif key == "REACH ID":
+				xs.reach_id = value
+			elif key == "STATION":
+				xs.station = value
+			elif key == "BANK POSITIONS":
+				xs.bank_positions = _numbers(value)
+			elif key == "WATER ELEVATION":
+				xs.water_elevation = _numbers(value)
+			elif block is not None and value:
+				# Coordinates on the same line as the keyword
+				getattr(xs, block).append(tuple(_numbers(value)))
+			continue
+		if block is not None:
+			getattr(xs, block).append(tuple(_numbers(line)))
+
+
+def build_index(sdf):
+	"""
+	Scan an sdf file once, and return a dict of (stream id, reach id, station) -> byte offset
+	of each CROSS-SECTION block, for use with read_cross_sections(sdf, offset, 1).
+	The stream is part of the key, as reach ids (such as "Reach 1") repeat between streams
+	"""
+	index = {}
+	stream = reach = station = None
+	pos = None
+	for offset, line in _lines(sdf):
+		if line.startswith("CROSS-SECTION:"):
+			pos = offset
+			stream = reach = station = None
+		elif pos is not None:
+			if line.startswith("STREAM ID:"):
+				stream = line.split(":", 1)[1].strip()
+			elif line.startswith("REACH ID:"):
+				reach = line.split(":", 1)[1].strip()
+			elif line.startswith("STATION:"):
+				station = line.split(":", 1)[1].strip()
+			elif line.startswith("END:"):
+				index[(stream, reach, station)] = pos
+				pos = None
+	return index
+
+
+def load_index(sdf):
+	"""
+	The byte offset index of an sdf file, kept next to it in <sdf>.idx
+	and rebuilt when the sdf file has changed (or was indexed without the streams)
+	"""
+	idx_file = sdf + ".idx"
+	st = os.stat(sdf)
+	stamp = [st.st_size, st.st_mtime]
+	if os.path.exists(idx_file):
+		try:
+			with open(idx_file, 'r') as f:
+				saved = json.load(f)
+			if saved['stamp'] == stamp:
+				return dict(((t, r, s), o) for t, r, s, o in saved['sections'])
+		except (IOError, ValueError, KeyError):
+			pass
+	index = build_index(sdf)
+	try:
+		with open(idx_file, 'w') as f:
+			json.dump({'stamp': stamp, 'sections': [[t, r, s, o] for (t, r, s), o in index.items()]}, f)
+	except IOError:
+		# The index is only a shortcut, carry on without saving it
+		pass
+	return index
+
+
+def reach_selected(names, stream_id, reach_id):
+	"""
+	True if the reach is one of names: given by its reach id alone (on any stream),
+	or as "stream id:reach id"
+	"""
+	return reach_id in names or "%s:%s" % (stream_id, reach_id) in names
+
+
+def read_reaches(sdf, names, index=None):
+	"""
+	Stream the CROSS-SECTION blocks of the reaches in names only (see reach_selected),
+	in the order of the file, seeking straight to each of them with the byte offset index
+	(by default from load_index)
+	"""
+	if index is None:
+		index = load_index(sdf)
+	names = set(names)
+	for offset in sorted(o for (t, r, s), o in index.items() if reach_selected(names, t, r)):
+		for xs in read_cross_sections(sdf, offset, 1):
+			yield xs
@@ -0,0 +1,88 @@
+"""
+Thinning of cross section profiles (station/elevation lines) for HEC-RAS,
+which accepts at most 500 station-elevation points per cross section
+"""
+
+import numpy as np
+
+
+def point_importance(station, elev):
+	"""
+	Douglas-Peucker ranking of the points of a station/elevation line.
+	The importance of a point is the vertical distance at which Douglas-Peucker
+	would keep it: keeping the points with importance above a tolerance gives the
+	Douglas-Peucker simplification for that tolerance, and keeping the n most important
+	points gives the best n point approximation that the algorithm finds.
+	The end points, and the lowest point (the thalweg), are always kept
+	"""
+	n = len(station)
+	importance = np.zeros(n)
+	if n == 0:
+		return importance
+	importance[0] = importance[-1] = np.inf
+	importance[int(np.argmin(elev))] = np.inf
+	stack = [(0, n - 1, np.inf)]
+	while stack:
+		i, j, parent = stack.pop()
+		if j - i < 2:
+			continue
+		s = station[i+1:j]
+		if station[j] == station[i]:
+			chord = np.repeat(elev[i], j - i - 1)
+		else:
+			chord = elev[i] + (elev[j] - elev[i])*(s - station[i])/(station[j] - station[i])
+		dist = np.abs(elev[i+1:j] - chord)
+		k = i + 1 + int(np.argmax(dist))
+		# A point is never more important than the segment it splits
+		importance[k] = max(importance[k], min(dist[k-i-1], parent))
+		stack.append((i, k, importance[k]))
+		stack.append((k, j, importance[k]))
+	return importance
+
+
+def thin_profile(surface, max_points=None, tolerance=None):
+	"""
+	Simplify a profile, a list of (x, y, elevation) strings.
+	Each run of null ("*") points is kept by its first and last points only.
+	Points closer than tolerance (vertically) to the simplified line are dropped,
+	and then the least important points until at most max_points remain, the
+	null points included. When the runs of nulls alone are more than max_points
+	(even kept by one point each), ValueError is raised.
+	Returns the thinned profile and the number of points dropped
+	"""
+	if len(surface) < 3 or (max_points is None and tolerance is None):
+		return surface, 0
+	xy = np.array([[float(p[0]), float(p[1])] for p in surface])
+	step = np.hypot(np.diff(xy[:,0]), np.diff(xy[:,1]))
+	station = np.concatenate(([0.0], np.cumsum(step)))
+	valid = np.array([p[2] != "*" for p in surface])
+	elev = np.array([float(p[2]) if v else 0.0 for p, v in zip(surface, valid)])
+
+	null = ~valid
+	run_start = null & ~np.concatenate(([False], null[:-1]))
+	run_end = null & ~np.concatenate((null[1:], [False]))
+	keep = run_start | run_end
+	if max_points is not None and keep.sum() > max_points:
+		# Too many gaps to keep both ends of each
+		keep = run_start
+		if keep.sum() > max_points:
+			raise ValueError("%d runs of null elevations, more than max_points (%d)" %
+					(int(keep.sum()), max_points))
+	idx = np.nonzero(valid)[0]
+	if len(idx) > 0:
+		importance = point_importance(station[idx], elev[idx])
+		keep_valid = np.ones(len(idx), dtype=bool)
+		if tolerance is not None:
+			keep_valid &= importance > tolerance
+		if max_points is not None:
+			room = max_points - int(keep.sum())
+			if keep_valid.sum() > room:
+				# The most important points that fit
+				order = np.argsort(-importance, kind='mergesort')
+				top = np.zeros(len(idx), dtype=bool)
+				top[order[:room]] = True
+				keep_valid &= top
+		keep[idx[keep_valid]] = True
+
+	thinned = [surface[i] for i in range(len(surface)) if keep[i]]
+	return thinned, len(surface) - len(thinned)
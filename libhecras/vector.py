@@ -0,0 +1,324 @@
+"""
+Bulk reading and writing of GRASS vector geometry and attributes.
+Each function runs a fixed number of GRASS modules, however many features the map has.
+"""
+
+import os
+from collections import OrderedDict
+import numpy as np
+import grass.script as grass
+
+try:
+	import sqlite3
+except ImportError:
+	sqlite3 = None
+
+
+def decode(text):
+	"""
+	Output of a GRASS command as text. The stdout of a piped command is bytes with
+	Python 3 (GRASS >= 7.8), decoded as grass.script does, and already str with Python 2
+	"""
+	if isinstance(text, str):
+		return text
+	if hasattr(grass, 'decode'):
+		return grass.decode(text)
+	return text.decode('utf-8')
+
+
+def text_lines(stream):
+	"""
+	The lines of the stdout of a piped GRASS command, as text
+	"""
+	for line in stream:
+		yield decode(line)
+
+
+def read_lines(vect, layer=1, type='line', parts=False):
+	"""
+	Read all lines of a vector map with a single v.out.ascii call.
+	Returns an OrderedDict with the line cat (in the given layer) as key
+	and an (n,2) numpy array of the line vertices as value.
+	With parts, the vertices of all lines with the same cat are joined in the order read,
+	otherwise only the first line found with each cat is kept, with a warning naming the others
+	"""
+	lines = OrderedDict()
+	dropped = []
+	p = grass.pipe_command('v.out.ascii', input=vect, format="standard", type=type, layer=layer, quiet=True)
+	stdout = text_lines(p.stdout)
+	# Skip the header, the features begin after the VERTI: line
+	for line in stdout:
+		if line.startswith("VERTI:"):
+			break
+
+	for line in stdout:
+		hdr = line.split()
+		if not hdr:
+			continue
+		# Each feature: "L <num vertices> <num cats>", then the vertices, then "<layer> <cat>" lines
+		num_verts = int(hdr[1])
+		num_cats = int(hdr[2]) if len(hdr) > 2 else 0
+		coords = np.empty((num_verts, 2))
+		for i in range(num_verts):
+			xy = next(stdout).split()
+			coords[i] = float(xy[0]), float(xy[1])
+		cat = None
+		for i in range(num_cats):
+			lc = next(stdout).split()
+			if int(lc[0]) == int(layer) and cat is None:
+				cat = int(lc[1])
+		if hdr[0] not in ('L', 'l') or cat is None:
+			continue
+		if cat not in lines:
+			lines[cat] = coords
+		elif parts:
+			lines[cat] = np.vstack((lines[cat], coords))
+		else:
+			dropped.append(cat)
+
+	p.stdout.close()
+	p.wait()
+	if dropped:
+		names = ", ".join(str(c) for c in dropped[:20])
+		if len(dropped) > 20:
+			names += ", ... and %d more" % (len(dropped) - 20)
+		grass.warning("%d lines of <%s> have the same cat as an earlier line and were skipped: cats %s"
+			% (len(dropped), vect, names))
+	return lines
+
+
+def write_line(outfile, coords, cat, layer=1):
+	"""
+	Write one line feature in the GRASS standard ASCII vector format
+	"""
+	outfile.write("L %d 1\n" % len(coords))
+	for x, y in coords:
+		outfile.write(" %.8f %.8f\n" % (x, y))
+	outfile.write(" %d %d\n" % (layer, cat))
+
+
+def format_coord(value, dp=8):
+	"""
+	Format a coordinate the way v.out.ascii prints it:
+	"dp" decimal places, with trailing zeros removed
+	"""
+	s = "%.*f" % (dp, value)
+	if "." in s:
+		s = s.rstrip("0").rstrip(".")
+	return s
+
+
+def sql_value(value):
+	"""
+	A python value as an SQL literal
+	"""
+	if value is None:
+		return "NULL"
+	if isinstance(value, (int, float, np.integer, np.floating)):
+		return repr(value.item() if hasattr(value, 'item') else value)
+	return "'%s'" % str(value).replace("'", "''")
+
+
+def _plain(value):
+	"""
+	A numpy scalar as the python value the sqlite3 module accepts
+	"""
+	return value.item() if isinstance(value, (np.integer, np.floating)) else value
+
+
+def _sqlite_path(database):
+	"""
+	The file of an sqlite database, with the GRASS variables in its name substituted
+	"""
+	if "$" not in database:
+		return database
+	env = grass.gisenv()
+	for var in ('GISDBASE', 'LOCATION_NAME', 'MAPSET'):
+		database = database.replace("$" + var, env[var])
+	return database
+
+
+def _sqlite_execute(database, statements, prepared, rows):
+	"""
+	Run the statements, and then the prepared statement once for each of rows,
+	all in one transaction of an sqlite database
+	"""
+	conn = sqlite3.connect(_sqlite_path(database), isolation_level=None)
+	try:
+		cur = conn.cursor()
+		cur.execute("BEGIN TRANSACTION")
+		try:
+			for statement in statements:
+				cur.execute(statement)
+			cur.executemany(prepared, ([_plain(v) for v in row] for row in rows))
+		except Exception:
+			cur.execute("ROLLBACK")
+			raise
+		cur.execute("COMMIT")
+	finally:
+		conn.close()
+
+
+def _db_execute(driver, database, statements, rows_sql):
+	"""
+	Run the statements, and then the SQL of each of rows_sql (an iterable of statements),
+	with a single db.execute call on the database (of a map's DB link, not necessarily
+	the default connection), in one transaction where the driver supports it
+	"""
+	transaction = driver in ('sqlite', 'pg')
+	tmp_sql = grass.tempfile()
+	with open(tmp_sql, 'w') as sql:
+		if transaction:
+			sql.write("BEGIN TRANSACTION;\n")
+		for statement in statements:
+			sql.write(statement + ";\n")
+		for statement in rows_sql:
+			sql.write(statement + ";\n")
+		if transaction:
+			sql.write("COMMIT;\n")
+	grass.run_command('db.execute', input=tmp_sql, driver=driver, database=database, quiet=True)
+	os.unlink(tmp_sql)
+
+
+def _table_exists(conn, table):
+	"""
+	True if the table is in the database of the connection (a dict as from grass.db_connection)
+	"""
+	if conn.get('driver') == 'sqlite' and sqlite3 is not None:
+		db = sqlite3.connect(_sqlite_path(conn['database']))
+		try:
+			found = db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+					(table,)).fetchone()
+		finally:
+			db.close()
+		return found is not None
+	tables = grass.read_command('db.tables', flags="p", driver=conn['driver'],
+			database=conn['database'], quiet=True).split()
+	return table in tables
+
+
+def write_table(vect, columns, rows, layer=1):
+	"""
+	Create the attribute table of a vector map and load all of its rows at once,
+	and then connect it to the map. With the sqlite driver the table is created and
+	filled with one prepared statement in a single transaction, otherwise by a single
+	db.execute call (in one transaction where the database driver supports it).
+	columns is a list of (name, SQL type) pairs, not including the cat column,
+	rows an iterable of tuples of (cat, values...)
+	An existing table of the same name is replaced only when it is the table of this
+	map in the layer, it is an error otherwise
+	"""
+	table = vect.split("@")[0]
+	if int(layer) != 1:
+		table = "%s_%s" % (table, layer)
+	conn = grass.db_connection()
+	driver = conn.get('driver', '')
+	if driver == 'sqlite':
+		conn['database'] = _sqlite_path(conn['database'])
+	cols = ", ".join(["%s %s" % (name, sql_type) for name, sql_type in columns])
+	statements = ["CREATE TABLE %s (cat INTEGER, %s)" % (table, cols)]
+	if _table_exists(conn, table):
+		link = grass.vector_db(vect).get(int(layer))
+		if link is None or link['table'] != table:
+			grass.fatal("Table <%s> already exists and is not linked to layer %s of vector map <%s>"
+					% (table, layer, vect))
+		statements.insert(0, "DROP TABLE %s" % table)
+	if driver == 'sqlite' and sqlite3 is not None:
+		_sqlite_execute(conn['database'], statements,
+				"INSERT INTO %s VALUES (%s)" % (table, ",".join(["?"]*(len(columns) + 1))), rows)
+	else:
+		_db_execute(driver, conn['database'], statements, ("INSERT INTO %s VALUES (%s)" %
+				(table, ",".join([sql_value(v) for v in row])) for row in rows))
+	grass.run_command('v.db.connect', map=vect, table=table, layer=layer, key="cat", flags="o", quiet=True)
+
+
+def update_table(vect, columns, rows, layer=1, add=()):
+	"""
+	Set the values of columns of the attribute table of a vector map for many features
+	at once, adding the columns that do not exist yet, all in one transaction.
+	columns is a list of (name, SQL type) pairs, rows an iterable of tuples of
+	(cat, values...) with one value for each of columns.
+	The columns in "add", (name, SQL type) pairs too, are only created if missing.
+	With the sqlite driver the rows are updated with one prepared statement,
+	otherwise all statements go to a single db.execute call.
+	A map without a table in the layer gets a new table
+	"""
+	dblinks = grass.vector_db(vect)
+	if int(layer) not in dblinks:
+		write_table(vect, list(columns) + list(add), 
+				(tuple(row) + (None,)*len(add) for row in rows), layer)
+		return
+	link = dblinks[int(layer)]
+	table, key, driver = link['table'], link['key'], link['driver']
+	existing = grass.vector_columns(vect, int(layer)).keys()
+	statements = ["ALTER TABLE %s ADD COLUMN %s %s" % (table, name, sql_type)
+			for name, sql_type in list(columns) + list(add) if name not in existing]
+	names = [name for name, sql_type in columns]
+	if driver == 'sqlite' and sqlite3 is not None:
+		_sqlite_execute(link['database'], statements, "UPDATE %s SET %s WHERE %s=?" %
+				(table, ", ".join(["%s=?" % name for name in names]), key),
+				(tuple(row[1:]) + (row[0],) for row in rows))
+	else:
+		_db_execute(driver, link['database'], statements, ("UPDATE %s SET %s WHERE %s=%s" % (table, 
+				", ".join(["%s=%s" % (name, sql_value(v)) for name, v in zip(names, row[1:])]),
+				key, sql_value(row[0])) for row in rows))
+
+
+def cat_list(cats):
+	"""
+	A list of cats as a GRASS category list, with runs of cats as ranges ("1-5,8")
+	"""
+	cats = sorted(set(int(c) for c in cats))
+	ranges = []
+	i = 0
+	while i < len(cats):
+		j = i
+		while j + 1 < len(cats) and cats[j+1] == cats[j] + 1:
+			j += 1
+		ranges.append(str(cats[i]) if i == j else "%d-%d" % (cats[i], cats[j]))
+		i = j + 1
+	return ",".join(ranges)
+
+
+def insert_rows(vect, rows, layer=1):
+	"""
+	Add many rows to the attribute table of a vector map at once.
+	rows is an iterable of tuples of (cat, values...) in the order of the table columns
+	"""
+	link = grass.vector_db(vect)[int(layer)]
+	table, driver = link['table'], link['driver']
+	rows = list(rows)
+	if not rows:
+		return
+	if driver == 'sqlite' and sqlite3 is not None:
+		_sqlite_execute(link['database'], [],
+				"INSERT INTO %s VALUES (%s)" % (table, ",".join(["?"]*len(rows[0]))), rows)
+	else:
+		_db_execute(driver, link['database'], [], ("INSERT INTO %s VALUES (%s)" %
+				(table, ",".join([sql_value(v) for v in row])) for row in rows))
+
+
+def delete_features(vect, cats, layer=1):
+	"""
+	Remove the features with the given cats from a vector map, and their rows
+	from its attribute table, with one v.edit call and one transaction
+	"""
+	if not cats:
+		return
+	grass.run_command('v.edit', map=vect, tool="delete", cats=cat_list(cats), layer=layer, quiet=True)
+	link = grass.vector_db(vect)[int(layer)]
+	table, key, driver = link['table'], link['key'], link['driver']
+	if driver == 'sqlite' and sqlite3 is not None:
+		_sqlite_execute(link['database'], [], "DELETE FROM %s WHERE %s=?" % (table, key),
+				[(int(c),) for c in cats])
+	else:
+		_db_execute(driver, link['database'], [], ("DELETE FROM %s WHERE %s=%d" % (table, key, int(c)) for c in cats))
+
+
+def append_features(vect, ascii_file, rows, layer=1):
+	"""
+	Add the features of a standard format ASCII vector file (without header)
+	to an existing vector map, with one v.edit call, and their rows to its attribute table
+	"""
+	grass.run_command('v.edit', map=vect, tool="add", input=ascii_file, flags="n", quiet=True)
+	insert_rows(vect, rows, layer)
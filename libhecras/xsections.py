@@ -0,0 +1,227 @@
+"""
+Generation of the stations and cross sections of a river network in memory,
+and their output as GRASS vector maps.
+Used by v.xsections, and by v.to.hecras which writes the sdf file directly from the geometry in memory
+"""
+
+import os
+import math
+import grass.script as grass
+from collections import OrderedDict
+from libhecras import geometry, parallel, profiling, vector
+
+# Attribute columns of the output maps (besides cat)
+STATION_COLUMNS = [("x", "DOUBLE PRECISION"), ("y", "DOUBLE PRECISION"),
+		("reach_id", "INTEGER"), ("seq", "INTEGER")]
+XSECTION_COLUMNS = [("reach", "INTEGER"), ("station_id", "INTEGER")]
+INTERSECT_COLUMNS = [("x", "DOUBLE PRECISION"), ("y", "DOUBLE PRECISION"), ("reach_a", "INTEGER"),
+		("station_a", "INTEGER"), ("reach_b", "INTEGER"), ("station_b", "INTEGER")]
+
+
+def station_layout(reaches, spacing, next_id=1, adaptive=None):
+	"""
+	The stations of the reaches: for each reach (in order of reach cat) the distances
+	of its stations along the reach, from the downstream end upstream, and the id of its
+	first station. Station ids are one sequence over all reaches, beginning at next_id,
+	so the n-th station (from 0) of a reach has id first_id + n, however many stations
+	a reach has.
+	With adaptive, (min spacing, max spacing, max turn in degrees), the spacing follows
+	the curvature of each reach instead of the fixed spacing.
+	Returns an OrderedDict of reach cat -> (first_id, offsets)
+	"""
+	layout = OrderedDict()
+	for c in sorted(reaches):
+		if adaptive:
+			min_spacing, max_spacing, max_turn = adaptive
+			offsets = geometry.adaptive_offsets(reaches[c], min_spacing, max_spacing, math.radians(max_turn))
+		else:
+			# The first station is postioned spacing/2 from the downstream end of the reach
+			# and the last no less than spacing/2 from the start
+			offsets = geometry.station_offsets(geometry.polyline_length(reaches[c]), spacing)
+		layout[c] = (next_id, offsets)
+		next_id += len(offsets)
+	return layout
+
+
+def reach_features(task):
+	"""
+	The stations and cross sections of one reach, computed in memory
+	(in a worker process when nprocs > 1).
+	task is (reach cat, reach vertices, first station id, station offsets, half width).
+	Returns the stations as points in the standard ASCII vector format, with the
+	station id as cat, their attribute rows (station id, x, y, reach, sequence along the reach),
+	and the cross sections as a list of (reach, station id, points)
+	"""
+	reach, coords, first_id, offsets, half_width = task
+	if len(offsets) == 0:
+		return "", [], []
+	pts, dirs = geometry.points_along(coords, offsets)
+	text = []
+	rows = []
+	for i in range(len(offsets)):
+		pt_id = first_id + i
+		x, y = float(pts[i,0]), float(pts[i,1])
+		text.append("P 1 1\n %.8f %.8f\n 1 %d\n" % (x, y, pt_id))
+		rows.append((pt_id, x, y, reach, i+1))
+	# Each cross section has three points: left of river, on the river, and right of river
+	# at 1/2 width distance, with the same station ids as the stations schematic
+	lines = geometry.cross_sections(coords, offsets, half_width)
+	xsects = [(reach, first_id + i, lines[i]) for i in range(len(lines))]
+	return "".join(text), rows, xsects
+
+
+@profiling.timed
+def build_features(reaches, layout, width, nprocs=1):
+	"""
+	The stations and cross sections of each reach in layout,
+	the reaches split among nprocs worker processes.
+	The station ids come from layout, and the results are merged in the order of layout,
+	so the output is the same however many processes are used.
+	Returns a list of the results of reach_features, one for each reach
+	"""
+	half_width = float(width)/2
+	tasks = [(reach, reaches[reach], layout[reach][0], layout[reach][1], half_width) for reach in layout]
+	return parallel.process_map(reach_features, tasks, nprocs)
+
+
+def write_stations(tmp, features):
+	"""
+	Write the stations of all reaches to tmp, a standard format ASCII vector file.
+	Returns the attribute rows of all stations
+	"""
+	rows = []
+	for text, station_rows, xsects in features:
+		tmp.write(text)
+		rows.extend(station_rows)
+	return rows
+
+
+@profiling.timed
+def create_stations_schematic(outvect, features):
+	""" 
+	Loop thru all river reaches, and for each reach
+	begin at the downstream end of the reach, 
+	and locate a series of points at each "spacing" interval along the reach.
+	Put these points into a standard format ASCII vector file
+	and run v.in.ascii once to create the stations along the original river.
+	The station id is the point cat, and the coordinates, the reach and the sequence
+	of the station along the reach are loaded into the attribute table at once
+	"""
+	# Create temp file for Points
+	tmp_stations = grass.tempfile()
+	with open(tmp_stations,'w') as tmp:
+		rows = write_stations(tmp, features)
+	
+	grass.run_command('v.in.ascii', input=tmp_stations, output=outvect, format="standard",
+				quiet=True, overwrite=True, flags='n')
+	os.unlink(tmp_stations)
+
+	# The coordinates, reach id and sequence of each station
+	vector.write_table(outvect, STATION_COLUMNS, rows)
+	
+	return len(rows)
+
+
+def write_cross_sections(tmp, xsects):
+	"""
+	Write out a standard format ASCII file of line segments
+	each segment with three nodes: left of river, on the river, and right of river.
+	The cat of each cross section is its station id.
+	Returns the attribute rows: (station id, reach, station id)
+	"""
+	rows = []
+	for reach, station_id, line in xsects:
+		vector.write_line(tmp, line, station_id)
+		rows.append((station_id, reach, station_id))
+	return rows
+
+
+def all_cross_sections(features, trim=False):
+	"""
+	The cross sections of all reaches, from the results of build_features,
+	as a list of (reach, station id, points).
+	With trim, cross sections that intersect are shortened until they no longer intersect
+	"""
+	xsects = []
+	for text, station_rows, reach_xsects in features:
+		xsects.extend(reach_xsects)
+
+	if trim and xsects:
+		lines = [line for r, st, line in xsects]
+		before = len(geometry.line_intersections(lines))
+		lines, remaining = geometry.trim_cross_sections(lines)
+		grass.message("Trimmed cross sections to remove %d of %d intersections" % 
+				(before - len(remaining), before))
+		xsects = [(r, st, line) for (r, st, old), line in zip(xsects, lines)]
+	return xsects
+
+
+@profiling.timed
+def create_cross_sections(outvect, xsects):
+	""" 
+	Create the cross sections vector from the geometry in memory:
+	Put the point triples into a standard format ASCII vector line file,
+	then run v.in.ascii once to create all the cross section line segments,
+	and write the reach and station id of each one to the attribute table.
+	"""
+	tmp_xsects=grass.tempfile()
+	with open(tmp_xsects,'w') as tmp:
+		rows = write_cross_sections(tmp, xsects)
+	grass.run_command('v.in.ascii',input=tmp_xsects, output=outvect, format="standard", 
+				quiet=True, overwrite=True, flags='n')
+	os.unlink(tmp_xsects)
+
+	# The reach and station id of each cross section are known here, load them all at once
+	vector.write_table(outvect, XSECTION_COLUMNS, rows)
+
+
+def intersect_rows(crossings, xsects, first_cat=1):
+	"""
+	Report the pairs of intersecting cross sections, in one warning
+	(each message is a GRASS command) naming the first few pairs.
+	Returns the attribute rows of the intersection points, with cats from first_cat:
+	(cat, x, y, reach and station id of both cross sections)
+	"""
+	rows = []
+	for i, j, x, y in crossings:
+		reach_a, station_a = xsects[i][0:2]
+		reach_b, station_b = xsects[j][0:2]
+		rows.append((first_cat + len(rows), x, y, reach_a, station_a, reach_b, station_b))
+	if rows:
+		pairs = ["reach %d station %d intersects reach %d station %d" % row[3:] for row in rows[:20]]
+		if len(rows) > 20:
+			pairs.append("... and %d more" % (len(rows) - 20))
+		grass.warning("%d pairs of cross sections intersect:\n%s" % (len(rows), "\n".join(pairs)))
+	return rows
+
+
+def write_intersects(tmp, rows):
+	"""
+	Write the intersection points to tmp, a standard format ASCII vector file
+	"""
+	for row in rows:
+		tmp.write("P 1 1\n %.8f %.8f\n 1 %d\n" % (row[1], row[2], row[0]))
+
+
+@profiling.timed
+def create_xsection_intersects(xsects, outvect=None):
+	""" 
+	Find all intersections between cross sections, from the cross section lines in memory
+	with a grid index, so only cross sections near each other are compared.
+	Each pair of intersecting cross sections is reported, and when outvect is given the
+	intersection points are written to that point vector, with the reach and station id
+	of both cross sections.
+	Returns the number of intersections
+	"""
+	crossings = geometry.line_intersections([line for r, st, line in xsects])
+	rows = intersect_rows(crossings, xsects)
+	if outvect:
+		tmp_pts = grass.tempfile()
+		with open(tmp_pts, 'w') as tmp:
+			write_intersects(tmp, rows)
+		grass.run_command('v.in.ascii', input=tmp_pts, output=outvect, format="standard",
+				quiet=True, overwrite=True, flags='n')
+		os.unlink(tmp_pts)
+		vector.write_table(outvect, INTERSECT_COLUMNS, rows)
+
+	return len(rows)
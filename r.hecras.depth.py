@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+#
+############################################################################
+#
+# MODULE:	   r.hecras.depth
+# AUTHOR(S):   	Micha Silver
+#				micha@arava.co.il  Arava Drainage Authority
+# PURPOSE:	  Reads an *.sdf file in HEC-RAS text format, with the WATER ELEVATION
+#			and WATER SURFACE EXTENTS of each cross section, and creates a raster
+#			of flood depth: the water surface, interpolated between the cross sections
+#			of each reach, less the elevation raster, inside the water surface extents
+# COPYRIGHT: 	This program is free software under the GNU General Public
+#			   License (>=v2). Read the file COPYING that comes with GRASS
+#			   for details.
+#
+#############################################################################
+
+#%module
+#% description: Create a raster of flood depth from the water surface elevations of a HEC-RAS analysis
+#% keywords: HEC-RAS
+#% keywords: water surface
+#% keywords: raster
+#%end
+#%option
+#% key: input
+#% type: string
+#% description: Name of input HEC-RAS file (from run of simulation)
+#% required: yes
+#%end
+#%option G_OPT_R_ELEV
+#% key: elevation
+#% description: Name of elevation raster
+#% required: yes
+#%end
+#%option G_OPT_R_OUTPUT
+#% key: output
+#% description: Name of output flood depth raster
+#% required: yes
+#%end
+#%option
+#% key: water_profile
+#% type: string
+#% description: Name or number (from 1) of the water surface profile (default: the first)
+#% required: no
+#%end
+#%option
+#% key: memory
+#% type: integer
+#% description: Maximum memory (MB) for the rows of the region held at once
+#% answer: 300
+#% required: no
+#%end
+#%option
+#% key: profile
+#% type: string
+#% description: Name of output JSON file with the timing of each GRASS command and phase (profiling)
+#% required: no
+#%end
+
+import sys
+import os
+import numpy as np
+import grass.script as grass
+from collections import OrderedDict
+from libhecras import geometry, profiling, raster, sdf
+
+# Number of cells whose distances to the cross sections are computed at once
+CHUNK_CELLS = 65536
+
+
+def cleanup():
+	grass.message("Finished")
+
+
+class WaterSurface(object):
+	"""
+	The water surface of one reach for one profile: its boundary (from the extents),
+	and the water elevation along the line between the extents of each cross section
+	"""
+
+	def __init__(self, reach, extents, elevations):
+		self.reach = reach
+		self.segments = np.asarray(extents, dtype=float)
+		self.elevations = np.asarray(elevations, dtype=float)
+		self.ring = geometry.water_surface_ring(extents)
+		self.xmin, self.ymin = self.ring.min(axis=0)
+		self.xmax, self.ymax = self.ring.max(axis=0)
+		# Every point between two successive cross sections is closer than this to both,
+		# so looking this far around a block of cells finds the cross sections on either side
+		seg = self.segments
+		ends = np.concatenate((
+			np.hypot(seg[1:,0] - seg[:-1,0], seg[1:,1] - seg[:-1,1]),
+			np.hypot(seg[1:,2] - seg[:-1,2], seg[1:,3] - seg[:-1,3]),
+			np.hypot(seg[1:,0] - seg[:-1,2], seg[1:,1] - seg[:-1,3]),
+			np.hypot(seg[1:,2] - seg[:-1,0], seg[1:,3] - seg[:-1,1]),
+			np.hypot(seg[:,2] - seg[:,0], seg[:,3] - seg[:,1])))
+		self.reach_gap = float(ends.max())
+		self.seg_xmin = np.minimum(seg[:,0], seg[:,2])
+		self.seg_xmax = np.maximum(seg[:,0], seg[:,2])
+		self.seg_ymin = np.minimum(seg[:,1], seg[:,3])
+		self.seg_ymax = np.maximum(seg[:,1], seg[:,3])
+		# The side of the line of each cross section (+1 left, -1 right) on which the
+		# previous and the next cross sections of the reach lie, 0 at the ends of the reach
+		mid_x = (seg[:,0] + seg[:,2])/2
+		mid_y = (seg[:,1] + seg[:,3])/2
+		self.prev_side = np.zeros(len(seg))
+		self.next_side = np.zeros(len(seg))
+		self.prev_side[1:] = self._side(np.arange(1, len(seg)), mid_x[:-1], mid_y[:-1])
+		self.next_side[:-1] = self._side(np.arange(len(seg) - 1), mid_x[1:], mid_y[1:])
+
+	def _side(self, k, x, y):
+		"""
+		The side of the line of cross sections k on which the points x, y lie:
+		+1 left, -1 right, 0 on the line
+		"""
+		seg = self.segments[k]
+		return np.sign((seg[:,2] - seg[:,0])*(y - seg[:,1]) - (seg[:,3] - seg[:,1])*(x - seg[:,0]))
+
+	def elevation(self, x, y):
+		"""
+		Water surface elevation at the points x, y (all inside the water surface):
+		interpolated by distance between the two cross sections that bracket each point
+		along the reach, the nearest one and its upstream or downstream neighbour on the
+		side of the point. Beyond the first or last cross section, its elevation
+		"""
+		gap = self.reach_gap
+		near = np.nonzero((self.seg_xmax >= x.min() - gap) & (self.seg_xmin <= x.max() + gap) &
+				(self.seg_ymax >= y.min() - gap) & (self.seg_ymin <= y.max() + gap))[0]
+		if len(near) == 0:
+			near = np.arange(len(self.segments))
+		dist = geometry.segment_distances(x, y, self.segments[near])
+		nearest = np.argmin(dist, axis=1)
+		k = near[nearest]
+		d = dist[np.arange(len(x)), nearest]
+		side = self._side(k, x, y)
+		other = np.empty(len(x), dtype=int)
+		other.fill(-1)
+		prev = (side != 0) & (side == self.prev_side[k])
+		other[prev] = k[prev] - 1
+		nxt = ~prev & (side != 0) & (side == self.next_side[k])
+		other[nxt] = k[nxt] + 1
+		z = self.elevations[k].copy()
+		pair = np.nonzero(other >= 0)[0]
+		d_other = geometry.paired_segment_distances(x[pair], y[pair], self.segments[other[pair]])
+		total = d[pair] + d_other
+		pair = pair[total > 0]
+		d_other = d_other[total > 0]
+		z[pair] = (self.elevations[k[pair]]*d_other + self.elevations[other[pair]]*d[pair])/(d[pair] + d_other)
+		return z
+
+
+@profiling.timed
+def read_sdf(input, profile):
+	"""
+	Stream the input SDF, and for the chosen profile collect the water surface extents
+	and water elevation of each cross section, grouped by stream and reach
+	(reach ids such as "Reach 1" repeat between streams).
+	Returns the profile name and a list of WaterSurface, one for each reach with at least
+	two cross sections
+	"""
+	header = sdf.read_header(input)
+	reaches = OrderedDict()
+	num_profiles = 0
+	for xs in sdf.read_cross_sections(input):
+		num_profiles = max(num_profiles, len(xs.water_extents))
+		key = (xs.stream_id, xs.reach_id)
+		reaches.setdefault(key, [])
+		if len(xs.water_extents) > profile and len(xs.water_elevation) > profile:
+			reaches[key].append((xs.water_extents[profile], xs.water_elevation[profile]))
+
+	names = [n.strip() for n in header.get('PROFILE NAMES', '').split(",") if n.strip()]
+	if len(names) != num_profiles:
+		names = [str(p+1) for p in range(num_profiles)]
+	if profile >= len(names):
+		return None, []
+
+	surfaces = []
+	for stream, reach in reaches:
+		sections = reaches[(stream, reach)]
+		if len(sections) < 2:
+			grass.warning("Stream: %s reach: %s has less than two cross sections with a water elevation, skipped" %
+					(stream, reach))
+			continue
+		surfaces.append(WaterSurface((stream, reach), [ext for ext, z in sections], [z for ext, z in sections]))
+	return names[profile], surfaces
+
+
+def profile_index(input, profile):
+	"""
+	The index of a profile given by name or number
+	"""
+	if not profile:
+		return 0
+	names = [n.strip() for n in sdf.read_header(input).get('PROFILE NAMES', '').split(",")]
+	if profile in names:
+		return names.index(profile)
+	if profile.isdigit() and int(profile) > 0:
+		return int(profile) - 1
+	grass.fatal("Profile <%s> not found in sdf file" % profile)
+
+
+def strip_water_surface(surfaces, reg, r0, r1):
+	"""
+	The water surface elevation of the cells in rows r0 to r1 (not including r1)
+	of the region, NaN outside all water surfaces.
+	Where the water surfaces of two reaches overlap the higher one is kept
+	"""
+	cols = int(reg['cols'])
+	ns, ew = reg['nsres'], reg['ewres']
+	wse = np.empty((r1 - r0, cols))
+	wse.fill(np.nan)
+	strip_n = reg['n'] - r0*ns
+	strip_s = reg['n'] - r1*ns
+	for surf in surfaces:
+		if surf.ymin > strip_n or surf.ymax < strip_s or surf.xmax < reg['w'] or surf.xmin > reg['e']:
+			continue
+		# The rows and columns of the strip covered by the water surface
+		sr0 = max(0, int(np.floor((strip_n - surf.ymax)/ns)))
+		sr1 = min(r1 - r0, int(np.ceil((strip_n - surf.ymin)/ns)))
+		c0 = max(0, int(np.floor((surf.xmin - reg['w'])/ew)))
+		c1 = min(cols, int(np.ceil((surf.xmax - reg['w'])/ew)))
+		if sr1 <= sr0 or c1 <= c0:
+			continue
+		x = reg['w'] + (np.arange(c0, c1) + 0.5)*ew
+		block_rows = max(1, CHUNK_CELLS//(c1 - c0))
+		for b0 in range(sr0, sr1, block_rows):
+			b1 = min(sr1, b0 + block_rows)
+			y = strip_n - (np.arange(b0, b1) + 0.5)*ns
+			xx, yy = np.meshgrid(x, y)
+			xx = xx.ravel()
+			yy = yy.ravel()
+			inside = np.nonzero(geometry.points_in_ring(xx, yy, surf.ring))[0]
+			if len(inside) == 0:
+				continue
+			z = np.empty(len(xx))
+			z.fill(np.nan)
+			z[inside] = surf.elevation(xx[inside], yy[inside])
+			block = wse[b0:b1, c0:c1]
+			block[...] = np.fmax(block, z.reshape(block.shape))
+	return wse
+
+
+@profiling.timed
+def create_depth(surfaces, elev, out_rast, memory):
+	"""
+	Compute the depth in strips of rows of the current region, reading only the strips
+	of the elevation raster that hold water, and write all strips to one binary file
+	that is imported with a single r.in.bin call
+	"""
+	reg = grass.region()
+	rows, cols = int(reg['rows']), int(reg['cols'])
+	# About four arrays of the size of a strip are in memory at once
+	strip_rows = max(1, min(rows, int(memory*1024*1024//(cols*8*4))))
+	proj, zone = raster.projection()
+	tmp_depth = grass.tempfile()
+	wet = 0
+	with open(tmp_depth, 'wb') as out:
+		for r0 in range(0, rows, strip_rows):
+			r1 = min(rows, r0 + strip_rows)
+			grass.percent(r0, rows, 1)
+			depth = strip_water_surface(surfaces, reg, r0, r1)
+			if np.isfinite(depth).any():
+				tmp_elev, dem = raster.read_window(elev, raster.window(reg, r0, r1, 0, cols), proj, zone)
+				depth -= dem
+				del dem
+				os.unlink(tmp_elev)
+				with np.errstate(invalid='ignore'):
+					depth[~(depth > 0)] = raster.NULL_VALUE
+				wet += int((depth != raster.NULL_VALUE).sum())
+			else:
+				depth.fill(raster.NULL_VALUE)
+			depth.tofile(out)
+	grass.percent(1, 1, 1)
+
+	grass.run_command('r.in.bin', input=tmp_depth, output=out_rast, flags="d", bytes=8,
+			north=reg['n'], south=reg['s'], east=reg['e'], west=reg['w'], rows=rows, cols=cols,
+			anull=raster.NULL_VALUE, quiet=True, overwrite=True)
+	os.unlink(tmp_depth)
+	grass.run_command('r.colors', map=out_rast, color="water", quiet=True)
+	grass.message("Number of flooded cells: %d" % wet)
+
+
+def main():
+	profiling.start(options['profile'])
+	in_sdf = options['input']
+	elev = options['elevation']
+	out_rast = options['output']
+	memory = int(options['memory'])
+
+	if not os.path.isfile(in_sdf):
+		grass.fatal(_("Input sdf: %s not found") % in_sdf)
+	if not grass.find_file(elev, element='cell')['name']:
+		grass.fatal("Raster map: %s not found" % elev)
+	if memory < 1:
+		grass.fatal("memory must be at least 1 MB")
+
+	name, surfaces = read_sdf(in_sdf, profile_index(in_sdf, options['water_profile']))
+	if name is None:
+		grass.fatal("Profile <%s> not found in sdf file" % options['water_profile'])
+	if not surfaces:
+		grass.fatal("No WATER ELEVATION and WATER SURFACE EXTENTS data in sdf file")
+	grass.message("Profile: %s, %d reaches" % (name, len(surfaces)))
+
+	create_depth(surfaces, elev, out_rast, memory)
+	grass.run_command('r.support', map=out_rast, title="Flood depth, profile %s" % name,
+			source1=os.path.basename(in_sdf), quiet=True)
+	grass.message("Raster: %s has been created" % out_rast)
+
+	profiling.finish()
+	cleanup()
+
+if __name__ == "__main__":
+	options, flags = grass.parser()
+	sys.exit(main())
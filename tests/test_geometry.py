@@ -0,0 +1,132 @@
+"""
+Unit tests of the cross section geometry (libhecras.geometry): crossings of polylines,
+stations spaced by curvature, and the trimming of crossing cross sections.
+They need no GRASS session
+"""
+
+import os
+import sys
+import math
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from libhecras import geometry
+
+
+class LineIntersectionsTest(unittest.TestCase):
+
+	def test_crossing(self):
+		lines = [[(0, 0), (2, 2)], [(0, 2), (2, 0)]]
+		found = geometry.line_intersections(lines)
+		self.assertEqual(len(found), 1)
+		i, j, x, y = found[0]
+		self.assertEqual((i, j), (0, 1))
+		self.assertAlmostEqual(x, 1.0)
+		self.assertAlmostEqual(y, 1.0)
+
+	def test_apart_and_parallel(self):
+		lines = [[(0, 0), (2, 0)], [(0, 1), (2, 1)], [(5, 5), (6, 6)]]
+		self.assertEqual(geometry.line_intersections(lines), [])
+
+	def test_one_point_per_pair(self):
+		# A zigzag crosses the straight line three times
+		lines = [[(0, 0), (6, 0)], [(1, -1), (2, 1), (3, -1), (4, 1)]]
+		found = geometry.line_intersections(lines)
+		self.assertEqual([(i, j) for i, j, x, y in found], [(0, 1)])
+
+	def test_self_crossing_ignored(self):
+		lines = [[(0, 0), (2, 2), (2, 0), (0, 2)]]
+		self.assertEqual(geometry.line_intersections(lines), [])
+
+	def test_only(self):
+		lines = [[(0, 0), (4, 0)], [(1, -1), (1, 1)], [(3, -1), (3, 1)]]
+		self.assertEqual([(i, j) for i, j, x, y in geometry.line_intersections(lines)],
+				[(0, 1), (0, 2)])
+		found = geometry.line_intersections(lines, only=[False, False, True])
+		self.assertEqual([(i, j) for i, j, x, y in found], [(0, 2)])
+
+
+class AdaptiveOffsetsTest(unittest.TestCase):
+
+	def test_straight_reach(self):
+		offsets = geometry.adaptive_offsets([(0, 0), (1000, 0)], 10, 100, math.radians(15))
+		steps = np.diff(offsets)
+		self.assertTrue(len(offsets) > 0)
+		self.assertTrue(np.allclose(np.abs(steps), 100))
+		self.assertTrue(np.all((offsets > 0) & (offsets < 1000)))
+
+	def test_bend(self):
+		# A right angle bend half way: the stations are closer near the bend,
+		# never closer than min_spacing, and never farther apart than max_spacing
+		coords = [(0, 0), (500, 0), (500, 500)]
+		offsets = geometry.adaptive_offsets(coords, 10, 100, math.radians(15))
+		steps = np.abs(np.diff(offsets))
+		self.assertTrue(np.all(steps >= 10 - 1e-9))
+		self.assertTrue(np.all(steps <= 100 + 1e-9))
+		near = np.abs(offsets - 500) < 50
+		self.assertTrue(near.sum() > 1)
+		straight = len(geometry.adaptive_offsets([(0, 0), (1000, 0)], 10, 100, math.radians(15)))
+		self.assertTrue(len(offsets) > straight)
+
+	def test_short_reach(self):
+		self.assertEqual(len(geometry.adaptive_offsets([(0, 0), (10, 0)], 10, 100, 0.2)), 0)
+		self.assertEqual(len(geometry.adaptive_offsets([(0, 0), (0, 0)], 10, 100, 0.2)), 0)
+
+
+class TrimCrossSectionsTest(unittest.TestCase):
+
+	def crossing(self):
+		# Two sections whose right sides cross at (5, 0)
+		return [
+			[(0, -5), (0, 0), (10, 5)],
+			[(10, -5), (10, 0), (0, 5)],
+		]
+
+	def test_trimmed(self):
+		xsects = self.crossing()
+		self.assertEqual(len(geometry.line_intersections(xsects)), 1)
+		trimmed, remaining = geometry.trim_cross_sections(xsects)
+		self.assertEqual(remaining, [])
+		self.assertEqual(geometry.line_intersections(trimmed), [])
+		# The centers stay, and the sections keep their directions
+		self.assertTrue(np.allclose(trimmed[:,1], np.array(xsects)[:,1]))
+
+	def test_fixed(self):
+		xsects = self.crossing()
+		trimmed, remaining = geometry.trim_cross_sections(xsects, fixed=[True, False])
+		self.assertEqual(remaining, [])
+		self.assertTrue(np.allclose(trimmed[0], xsects[0]))
+		self.assertFalse(np.allclose(trimmed[1], xsects[1]))
+
+	def test_both_fixed(self):
+		xsects = self.crossing()
+		trimmed, remaining = geometry.trim_cross_sections(xsects, fixed=[True, True])
+		self.assertEqual(remaining, [])
+		self.assertTrue(np.allclose(trimmed, xsects))
+
+	def test_apart(self):
+		xsects = [[(0, -5), (0, 0), (0, 5)], [(10, -5), (10, 0), (10, 5)]]
+		trimmed, remaining = geometry.trim_cross_sections(xsects)
+		self.assertEqual(remaining, [])
+		self.assertTrue(np.allclose(trimmed, xsects))
+
+
+class SegmentDistancesTest(unittest.TestCase):
+
+	def test_paired(self):
+		segments = [(0, 0, 10, 0), (0, 0, 0, 10), (5, 5, 5, 5)]
+		x = np.array([5.0, -3.0, 8.0])
+		y = np.array([2.0, 14.0, 9.0])
+		paired = geometry.paired_segment_distances(x, y, segments)
+		self.assertTrue(np.allclose(paired, [2.0, 5.0, 5.0]))
+		full = geometry.segment_distances(x, y, segments)
+		self.assertTrue(np.allclose(paired, np.diag(full)))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,180 @@
+"""
+Unit tests of the order preserving worker pools (libhecras.parallel) and of the
+profile cache (libhecras.cache).
+They need no GRASS session: without one, the modules are imported with the
+benchmark stand-in for grass.script (bench/fakegrass)
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, REPO_DIR)
+
+try:
+	import grass.script
+except ImportError:
+	sys.path.append(os.path.join(REPO_DIR, 'bench', 'fakegrass'))
+
+from libhecras import parallel
+from libhecras import cache
+
+# Seconds to wait for a map that should finish at once
+TIMEOUT = 10
+
+
+def square(n):
+	# Later items finish first
+	time.sleep(0.001*(n % 5))
+	return n*n
+
+
+def run(func, items, nprocs):
+	"""
+	Consume ordered_map in a thread: returns ('done', results) or ('raised', exception),
+	or ('hung', None) if the map did not finish within TIMEOUT
+	"""
+	outcome = [('hung', None)]
+
+	def consume():
+		try:
+			outcome[0] = ('done', list(parallel.ordered_map(func, items, nprocs)))
+		except BaseException as e:
+			outcome[0] = ('raised', e)
+
+	t = threading.Thread(target=consume)
+	t.daemon = True
+	t.start()
+	t.join(TIMEOUT)
+	return outcome[0]
+
+
+class OrderedMapTest(unittest.TestCase):
+
+	def test_order(self):
+		for nprocs in (1, 4):
+			self.assertEqual(run(square, range(50), nprocs), ('done', [n*n for n in range(50)]))
+
+	def test_window(self):
+		# No more than window items are taken from the input ahead of the output
+		taken = []
+
+		def items():
+			for n in range(40):
+				taken.append(n)
+				yield n
+
+		for k, result in enumerate(parallel.ordered_map(square, items(), 3, window=5)):
+			self.assertEqual(result, k*k)
+			self.assertTrue(len(taken) <= k + 5)
+
+	def test_exception(self):
+		def func(n):
+			if n == 7:
+				raise ValueError("bad item")
+			return n
+
+		for nprocs in (1, 4):
+			state, e = run(func, range(20), nprocs)
+			self.assertEqual(state, 'raised')
+			self.assertTrue(isinstance(e, ValueError))
+
+	def test_system_exit(self):
+		# grass.fatal raises SystemExit in the worker: it must reach the caller,
+		# not leave it waiting for the result
+		def func(n):
+			if n == 3:
+				sys.exit("ERROR: bad item")
+			return n
+
+		for nprocs in (1, 4):
+			state, e = run(func, range(20), nprocs)
+			self.assertEqual(state, 'raised')
+			self.assertTrue(isinstance(e, SystemExit))
+
+	def test_results_before_error(self):
+		def func(n):
+			if n == 10:
+				raise ValueError("bad item")
+			return n
+
+		results = []
+		try:
+			for result in parallel.ordered_map(func, range(20), 4):
+				results.append(result)
+		except ValueError:
+			pass
+		self.assertEqual(results, list(range(10)))
+
+
+class ProcessMapTest(unittest.TestCase):
+
+	def test_order(self):
+		self.assertEqual(parallel.process_map(abs, range(-20, 20), 1), [abs(n) for n in range(-20, 20)])
+		self.assertEqual(parallel.process_map(abs, range(-20, 20), 2), [abs(n) for n in range(-20, 20)])
+
+
+class ProfileCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'profile_cache')
+		# The stamp of a raster needs a GRASS database
+		self.raster_stamp = cache.raster_stamp
+		cache.raster_stamp = lambda elev: elev + "@test"
+
+	def tearDown(self):
+		cache.raster_stamp = self.raster_stamp
+		shutil.rmtree(self.dir)
+
+	def cutline(self, k):
+		return [(str(k), "0"), (str(k), "100")]
+
+	def surface(self, k):
+		return [(str(k), str(float(y)), "%.3f" % (k + y/10.0)) for y in range(100)]
+
+	def test_get_put(self):
+		profiles = cache.ProfileCache(self.path, "dem", 1.0, "bilinear", 10**6)
+		self.assertEqual(profiles.get(self.cutline(1)), None)
+		profiles.put(self.cutline(1), self.surface(1))
+		self.assertEqual(profiles.get(self.cutline(1)), self.surface(1))
+		self.assertEqual(profiles.get(self.cutline(2)), None)
+		self.assertEqual((profiles.hits, profiles.misses), (1, 2))
+
+	def test_keys(self):
+		# Any change to the raster, resolution or method misses the cache
+		profiles = cache.ProfileCache(self.path, "dem", 1.0, "bilinear", 10**6)
+		profiles.put(self.cutline(1), self.surface(1))
+		for elev, res, method in (("dem2", 1.0, "bilinear"), ("dem", 2.0, "bilinear"), ("dem", 1.0, "nearest")):
+			other = cache.ProfileCache(self.path, elev, res, method, 10**6)
+			self.assertEqual(other.get(self.cutline(1)), None)
+
+	def test_trim(self):
+		profiles = cache.ProfileCache(self.path, "dem", 1.0, "bilinear", 0)
+		for k in range(5):
+			profiles.put(self.cutline(k), self.surface(k))
+			os.utime(profiles._file(self.cutline(k)), (1000 + k, 1000 + k))
+		# Using an entry makes it the most recent
+		self.assertEqual(profiles.get(self.cutline(0)), self.surface(0))
+		profiles.max_size = sum(os.path.getsize(profiles._file(self.cutline(k))) for k in (0, 4))
+		self.assertEqual(profiles.trim(), 3)
+		kept = [k for k in range(5) if os.path.exists(profiles._file(self.cutline(k)))]
+		self.assertEqual(kept, [0, 4])
+		self.assertEqual(profiles.trim(), 0)
+
+	def test_clear(self):
+		profiles = cache.ProfileCache(self.path, "dem", 1.0, "bilinear", 10**6)
+		profiles.put(self.cutline(1), self.surface(1))
+		cache.clear(self.path)
+		self.assertFalse(os.path.exists(self.path))
+		self.assertEqual(profiles.get(self.cutline(1)), None)
+
+
+if __name__ == '__main__':
+	unittest.main()
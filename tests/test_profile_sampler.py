@@ -0,0 +1,117 @@
+"""
+Regression test of the in memory cross section sampler (libhecras.raster.ProfileSampler)
+against r.profile -g, on a synthetic elevation raster (bench/synthetic.py).
+It needs a GRASS session (run it inside one, in a scratch mapset: the rasters
+test_sampler_dem and test_sampler_int are created and removed), and is skipped otherwise,
+also with the benchmark stand-in for grass.script, which has no r.profile.
+
+Tolerances: the points must be the same in number, and their coordinates agree within
+COORD_TOL map units. The elevations must be the same as printed by r.profile (both null,
+or equal within VALUE_TOL), except at points less than COORD_TOL from a cell edge,
+where the rounding of the position may pick the neighbouring cell
+"""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+
+try:
+	import grass.script as grass
+except ImportError:
+	grass = None
+
+COORD_TOL = 0.001
+VALUE_TOL = 1e-6
+
+DEM = "test_sampler_dem"
+INT_DEM = "test_sampler_int"
+
+
+def grass_session():
+	"""
+	True inside a real GRASS session, with r.profile available
+	"""
+	if grass is None or 'GISRC' not in os.environ or not hasattr(grass, 'find_program'):
+		return False
+	return grass.find_program('r.profile', '--help')
+
+
+@unittest.skipUnless(grass_session(), "needs a GRASS session")
+class ProfileSamplerTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		import synthetic
+		from libhecras import geometry
+		grass.use_temp_region()
+		net = synthetic.Network(200, spacing=100, width=200)
+		dem_file = grass.tempfile()
+		hdr = net.write_dem(dem_file, max_cells=250000)
+		grass.run_command('r.in.bin', input=dem_file, output=DEM, flags="d", bytes=8,
+				north=hdr['n'], south=hdr['s'], east=hdr['e'], west=hdr['w'],
+				rows=hdr['rows'], cols=hdr['cols'], overwrite=True, quiet=True)
+		os.unlink(dem_file)
+		grass.run_command('g.region', raster=DEM, quiet=True)
+		grass.mapcalc("%s = round(%s * 100)" % (INT_DEM, DEM), overwrite=True, quiet=True)
+		cls.region = grass.region()
+
+		# The cross sections of the network, and lines that leave the region (null cells)
+		# or run exactly along the grid; formatted as the modules give them to both
+		lines = []
+		for cat, coords in net.reaches.items():
+			offsets = geometry.station_offsets(geometry.polyline_length(coords), 100.0)
+			lines.extend(geometry.cross_sections(coords, offsets, 100.0))
+		reg = cls.region
+		lines.append([(reg['w'] - 55.5, reg['s'] + 10.25), (reg['e'] + 40.0, reg['n'] - 3.5)])
+		lines.append([(reg['w'] + 3*reg['ewres'], reg['n']), (reg['w'] + 3*reg['ewres'], reg['s'])])
+		lines.append([(reg['w'], reg['n'] - 5*reg['nsres']), (reg['e'], reg['n'] - 5*reg['nsres'])])
+		cls.cutlines = [[["%f" % x, "%f" % y] for x, y in line] for line in lines]
+
+	@classmethod
+	def tearDownClass(cls):
+		grass.run_command('g.remove', type="raster", name="%s,%s" % (DEM, INT_DEM), flags="f", quiet=True)
+
+	def on_cell_edge(self, x, y):
+		reg = self.region
+		fc = (x - reg['w'])/reg['ewres']
+		fr = (reg['n'] - y)/reg['nsres']
+		return (abs(fc - round(fc))*reg['ewres'] < COORD_TOL or
+			abs(fr - round(fr))*reg['nsres'] < COORD_TOL)
+
+	def compare(self, elev, res):
+		from libhecras import raster
+		sampler = raster.ProfileSampler(elev, res, "nearest", memory=100)
+		try:
+			sampled = sampler.profiles(self.cutlines)
+		finally:
+			sampler.close()
+		for cutline, surface in zip(self.cutlines, sampled):
+			expected = raster.rprofile(elev, cutline, res)
+			self.assertEqual(len(surface), len(expected), "number of points along %r" % (cutline,))
+			for (x, y, z), (ex, ey, ez) in zip(surface, expected):
+				self.assertTrue(abs(float(x) - float(ex)) < COORD_TOL and abs(float(y) - float(ey)) < COORD_TOL,
+					"point %s,%s, r.profile %s,%s" % (x, y, ex, ey))
+				if z == ez:
+					continue
+				if z != "*" and ez != "*" and abs(float(z) - float(ez)) <= VALUE_TOL:
+					continue
+				self.assertTrue(self.on_cell_edge(float(ex), float(ey)),
+					"elevation at %s,%s: %s, r.profile %s" % (ex, ey, z, ez))
+
+	def test_raster_resolution(self):
+		self.compare(DEM, self.region['ewres'])
+
+	def test_other_resolution(self):
+		self.compare(DEM, self.region['ewres']*0.37)
+
+	def test_integer_raster(self):
+		self.compare(INT_DEM, self.region['ewres'])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,139 @@
+"""
+Unit tests of the sdf reading and writing (libhecras.sdf): the byte offset index,
+the selection of reaches, and the checkpoint of a partial export.
+They need no GRASS session
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from libhecras import sdf
+
+# Two streams with a reach of the same id
+SECTIONS = [
+	("Creek", "Reach 1", "150"),
+	("Creek", "Reach 1", "50"),
+	("Creek", "Reach 2", "75"),
+	("River", "Reach 1", "150"),
+	("River", "Reach 1", "50"),
+]
+
+
+class SdfTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.sdf = os.path.join(self.dir, "test.sdf")
+		with sdf.SdfWriter(self.sdf) as outfile:
+			outfile.write("BEGIN CROSS-SECTIONS:\n\n")
+			for k, (stream, reach, station) in enumerate(SECTIONS):
+				cutline = [(str(k), "0"), (str(k), "10")]
+				surface = [(str(k), "0", "5"), (str(k), "5", "4"), (str(k), "10", "6")]
+				sdf.write_cross_section(outfile, stream, reach, station, cutline, surface)
+			outfile.write("END CROSS-SECTIONS:\n")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_read(self):
+		sections = list(sdf.read_cross_sections(self.sdf))
+		self.assertEqual([(xs.stream_id, xs.reach_id, xs.station) for xs in sections], SECTIONS)
+		xs = sections[2]
+		self.assertEqual(xs.cutline, [(2.0, 0.0), (2.0, 10.0)])
+		self.assertEqual(len(xs.surface_line), 3)
+		self.assertFalse(os.path.exists(self.sdf + ".tmp"))
+
+	def test_index(self):
+		index = sdf.build_index(self.sdf)
+		self.assertEqual(sorted(index), sorted(SECTIONS))
+		for key, offset in index.items():
+			xs = list(sdf.read_cross_sections(self.sdf, offset, 1))
+			self.assertEqual(len(xs), 1)
+			self.assertEqual((xs[0].stream_id, xs[0].reach_id, xs[0].station), key)
+
+	def test_load_index(self):
+		index = sdf.load_index(self.sdf)
+		self.assertTrue(os.path.exists(self.sdf + ".idx"))
+		self.assertEqual(sdf.load_index(self.sdf), index)
+
+	def test_old_index_rebuilt(self):
+		# An index saved without the streams
+		st = os.stat(self.sdf)
+		with open(self.sdf + ".idx", 'w') as f:
+			json.dump({'stamp': [st.st_size, st.st_mtime],
+					'sections': [["Reach 1", "150", 0]]}, f)
+		self.assertEqual(sdf.load_index(self.sdf), sdf.build_index(self.sdf))
+
+	def test_read_reaches(self):
+		found = [(xs.stream_id, xs.reach_id, xs.station) for xs in sdf.read_reaches(self.sdf, ["Reach 1"])]
+		self.assertEqual(found, [s for s in SECTIONS if s[1] == "Reach 1"])
+		found = [(xs.stream_id, xs.reach_id, xs.station) for xs in sdf.read_reaches(self.sdf, ["River:Reach 1"])]
+		self.assertEqual(found, SECTIONS[3:])
+		found = [(xs.stream_id, xs.reach_id, xs.station)
+				for xs in sdf.read_reaches(self.sdf, ["Reach 2", "River:Reach 1"])]
+		self.assertEqual(found, SECTIONS[2:])
+		self.assertEqual(list(sdf.read_reaches(self.sdf, ["Creek:Reach 3"])), [])
+
+	def test_failed_write(self):
+		other = os.path.join(self.dir, "failed.sdf")
+		try:
+			with sdf.SdfWriter(other) as outfile:
+				outfile.write("BEGIN HEADER:\n")
+				raise RuntimeError("export failed")
+		except RuntimeError:
+			pass
+		self.assertFalse(os.path.exists(other))
+		self.assertFalse(os.path.exists(other + ".tmp"))
+
+
+class CheckpointTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.sdf = os.path.join(self.dir, "test.sdf")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def export(self, inputs, count):
+		"""
+		Write the header and count cross sections, and fail
+		"""
+		outfile = sdf.SdfWriter(self.sdf, keep=True)
+		outfile.write("BEGIN HEADER:\nEND HEADER:\n")
+		checkpoint = sdf.Checkpoint(self.sdf, inputs)
+		checkpoint.open(outfile)
+		for stream, reach, station in SECTIONS[:count]:
+			sdf.write_cross_section(outfile, stream, reach, station, [("0", "0")], [("0", "0", "1")])
+			checkpoint.record(outfile, [(reach, station, outfile.offset)])
+		checkpoint.file.close()
+		outfile.abort()
+		return checkpoint
+
+	def test_resume(self):
+		first = self.export({'elevation': "dem"}, 2)
+		checkpoint = sdf.Checkpoint(self.sdf, {'elevation': "dem"})
+		resume = checkpoint.load()
+		self.assertEqual(resume, first.sections[-1][2])
+		self.assertEqual(resume, os.path.getsize(self.sdf + ".tmp"))
+		self.assertEqual([s[:2] for s in checkpoint.sections],
+				[(r, s) for t, r, s in SECTIONS[:2]])
+
+	def test_changed_inputs(self):
+		self.export({'elevation': "dem"}, 2)
+		checkpoint = sdf.Checkpoint(self.sdf, {'elevation': "dem2"})
+		self.assertEqual(checkpoint.load(), None)
+		self.assertEqual(checkpoint.changed, ['elevation'])
+		self.assertEqual(checkpoint.start, None)
+
+
+if __name__ == '__main__':
+	unittest.main()
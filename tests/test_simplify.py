@@ -0,0 +1,83 @@
+"""
+Unit tests of the thinning of cross section profiles (libhecras.simplify).
+They need no GRASS session
+"""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from libhecras import simplify
+
+
+def profile(elevations):
+	"""
+	A profile along the x axis, one point per metre, "*" for None
+	"""
+	return [(str(float(i)), "0", "*" if z is None else repr(float(z)))
+			for i, z in enumerate(elevations)]
+
+
+class ThinProfileTest(unittest.TestCase):
+
+	def test_unchanged(self):
+		surface = profile([5, 4, 3, 4, 5])
+		self.assertEqual(simplify.thin_profile(surface), (surface, 0))
+		self.assertEqual(simplify.thin_profile(surface, max_points=10), (surface, 0))
+
+	def test_straight_line(self):
+		# Only the ends and the lowest point are left of a sloping line
+		surface = profile(range(100, 0, -1))
+		thinned, dropped = simplify.thin_profile(surface, tolerance=0.001)
+		self.assertEqual(thinned, [surface[0], surface[-1]])
+		self.assertEqual(dropped, 98)
+
+	def test_max_points(self):
+		surface = profile([(i % 7)*(i % 3) for i in range(1000)])
+		thinned, dropped = simplify.thin_profile(surface, max_points=500)
+		self.assertEqual(len(thinned), 500)
+		self.assertEqual(dropped, 500)
+		self.assertEqual(thinned[0], surface[0])
+		self.assertEqual(thinned[-1], surface[-1])
+		# The points stay in order
+		self.assertEqual(thinned, [p for p in surface if p in thinned])
+
+	def test_thalweg_kept(self):
+		elevations = [10 + (i % 2) for i in range(600)]
+		elevations[321] = 0
+		surface = profile(elevations)
+		thinned, dropped = simplify.thin_profile(surface, max_points=50)
+		self.assertTrue(surface[321] in thinned)
+
+	def test_null_runs(self):
+		# Each run of nulls is kept by its first and last points, which count in max_points
+		elevations = [1, 2, None, None, None, None, 3, 4, 1, None, 5, 2]
+		surface = profile(elevations)
+		thinned, dropped = simplify.thin_profile(surface, tolerance=100)
+		nulls = [p for p in thinned if p[2] == "*"]
+		self.assertEqual(nulls, [surface[2], surface[5], surface[9]])
+		thinned, dropped = simplify.thin_profile(surface, max_points=6)
+		self.assertEqual(len(thinned), 6)
+		self.assertEqual(len([p for p in thinned if p[2] == "*"]), 3)
+
+	def test_all_null(self):
+		surface = profile([None]*600)
+		thinned, dropped = simplify.thin_profile(surface, max_points=500)
+		self.assertEqual(thinned, [surface[0], surface[-1]])
+
+	def test_too_many_null_runs(self):
+		# 450 runs of one null each: kept by one point each, they fit in 500 points
+		surface = profile([None if i % 2 else 1 for i in range(900)])
+		thinned, dropped = simplify.thin_profile(surface, max_points=500)
+		self.assertEqual(len(thinned), 500)
+		# 600 runs do not
+		surface = profile([None if i % 2 else 1 for i in range(1200)])
+		self.assertRaises(ValueError, simplify.thin_profile, surface, 500)
+
+
+if __name__ == '__main__':
+	unittest.main()
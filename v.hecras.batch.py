@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+#
+############################################################################
+#
+# MODULE:	   v.hecras.batch
+# AUTHOR(S):   	Micha Silver
+#				micha@arava.co.il  Arava Drainage Authority
+# PURPOSE:	  Creates HEC RAS geometry files (sdf) for many river networks in one run:
+#			each river is processed as by v.to.hecras, on one pool of workers sharing
+#			the elevation raster tiles, the profile cache and the location metadata,
+#			with one summary for the whole batch
+# COPYRIGHT: 	This program is free software under the GNU General Public
+#			   License (>=v2). Read the file COPYING that comes with GRASS
+#			   for details.
+#
+#############################################################################
+
+
+#%module
+#% description: Creates HEC RAS geometry files of cross sections for a batch of river networks, on one pool of workers
+#% keywords: vector
+#% keywords: HEC RAS
+#% keywords: cross sections
+#%end
+#%flag
+#%  key: t
+#%  description: Trim intersecting cross sections (equally on both sides of the river) until they no longer intersect
+#%end
+#%flag
+#%  key: u
+#%  description: Add Posix line separator to output (default is windows CR-LF)
+#%end
+#%flag
+#%  key: n
+#%  description: Do not use the cross section profile cache
+#%end
+#%flag
+#%  key: c
+#%  description: Clear the cross section profile cache before export
+#%end
+#%option
+#% key: input
+#% type: string
+#% description: Names of input river network line vectors
+#% multiple: yes
+#% required: no
+#%end
+#%option
+#% key: pattern
+#% type: string
+#% description: Wildcard pattern of input river network line vectors in the current mapset (as for g.list)
+#% required: no
+#%end
+#%option
+#% key: file
+#% type: string
+#% description: Text file of input river networks, one per line: river,spacing,width,output (spacing, width and output may be left empty)
+#% required: no
+#%end
+#%option
+#% key: elevation
+#% type: string
+#% description: Name of input elevation raster for making cross section profiles
+#% required: yes
+#%end
+#%option
+#% key: directory
+#% type: string
+#% description: Directory of the output HEC RAS geometry files (each named as its river, unless given in the file)
+#% answer: .
+#% required: no
+#%end
+#%option
+#% key: spacing
+#% type: integer
+#% description: Spacing between cross sections (for rivers without their own spacing)
+#% answer: 100
+#% required: no
+#%end
+#%option
+#% key: width
+#% type: integer
+#% description: Width of cross sections (for rivers without their own width)
+#% answer: 200
+#% required: no
+#%end
+#%option
+#% key: layer
+#% type: integer
+#% description: Layer of the river network categories
+#% answer: 1
+#% required: no
+#%end
+#%option
+#% key: resolution
+#% type: integer
+#% description: Resolution along the cross sections for getting elevation points (if not given, the elevation raster resolution will be used)
+#% required: no
+#%end
+#%option
+#% key: interpolation
+#% type: string
+#% description: Interpolation of elevation points along the cross sections
+#% options: nearest,bilinear
+#% answer: nearest
+#% required: no
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of rivers to process in parallel
+#% answer: 1
+#% required: no
+#%end
+#%option
+#% key: cache_size
+#% type: integer
+#% description: Size limit of the cross section profile cache in the current mapset (MB)
+#% answer: 256
+#% required: no
+#%end
+#%option
+#% key: max_points
+#% type: integer
+#% description: Maximum number of elevation points in each cross section (HEC-RAS allows 500)
+#% required: no
+#%end
+#%option
+#% key: tolerance
+#% type: double
+#% description: Vertical tolerance for thinning the elevation points of each cross section
+#% required: no
+#%end
+#%option
+#% key: memory
+#% type: integer
+#% description: Maximum memory for tiles of the elevation raster, shared by all rivers (MB)
+#% answer: 300
+#% required: no
+#%end
+#%option
+#% key: summary
+#% type: string
+#% description: Name of output CSV file with the summary of each river (counts, time, intersections, errors)
+#% required: no
+#%end
+#%option
+#% key: profile
+#% type: string
+#% description: Name of output JSON file with the timing of each GRASS command and phase (profiling)
+#% required: no
+#%end
+
+import sys
+import os
+import time
+import grass.script as grass
+from libhecras import cache, parallel, profiling, raster, vector
+from libhecras.sdf import SdfWriter
+from libhecras.export import location_info, output_headers, output_centerline, output_xsections
+from libhecras.xsections import station_layout, build_features, all_cross_sections, create_xsection_intersects
+
+def cleanup():
+	grass.message("Finished")
+
+
+def read_jobs(path, spacing, width):
+	"""
+	Read the batch file: one river per line as river,spacing,width,output,
+	the last fields may be left out or empty. Blank lines and lines starting with # are skipped.
+	Returns a list of [river, spacing, width, output]
+	"""
+	jobs = []
+	with open(path, 'r') as f:
+		for num, line in enumerate(f):
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			fields = [v.strip() for v in line.split(",")]
+			fields += [""]*(4 - len(fields))
+			river, sp, wd, out = fields[:4]
+			try:
+				sp = float(sp) if sp else spacing
+				wd = float(wd) if wd else width
+			except ValueError:
+				grass.fatal("Line %d of %s: spacing and width must be numbers" % (num+1, path))
+			if not river or len(fields) > 4 or sp <= 0 or wd <= 0:
+				grass.fatal("Line %d of %s: expected river,spacing,width,output" % (num+1, path))
+			jobs.append([river, sp, wd, out or river.split("@")[0]])
+	return jobs
+
+
+@profiling.timed
+def export_river(river, spacing, width, sdf, layer, trim, newline, elev, res, sampler, prof_cache,
+		max_points, tolerance, version, units):
+	"""
+	Create the stations and cross sections of one river network in memory,
+	and write its geometry sdf file. Returns the number of reaches,
+	cross sections and cross section intersections
+	"""
+	reaches = vector.read_lines(river, layer)
+	if not reaches:
+		grass.fatal("No lines with categories in layer %s of <%s>" % (layer, river))
+	layout = station_layout(reaches, spacing)
+	features = build_features(reaches, layout, width)
+	xsects = all_cross_sections(features, trim)
+	intersect_cnt = create_xsection_intersects(xsects)
+	with SdfWriter(sdf, newline) as sdf_file:
+		output_headers(river, river, reaches, xsects, sdf_file, version, units)
+		output_centerline(river, reaches, features, layout, elev, sdf_file)
+		output_xsections(xsects, sdf_file, elev, res, river, sampler, 1, prof_cache,
+				max_points, tolerance)
+	return len(reaches), len(xsects), intersect_cnt
+
+
+def write_summary(path, results):
+	"""
+	The summary of each river as CSV
+	"""
+	with open(path, 'w') as f:
+		f.write("river,output,reaches,xsections,intersections,seconds,error\n")
+		for r in results:
+			f.write("%s,%s,%s,%s,%s,%.3f,%s\n" % (r['river'], r['output'], r['reaches'], r['xsections'],
+				r['intersections'], r['seconds'], r['error'] or ""))
+
+
+def main():
+	profiling.start(options['profile'])
+	inputs = options['input']
+	pattern = options['pattern']
+	batch_file = options['file']
+	elev = options['elevation']
+	directory = options['directory']
+	spacing = float(options['spacing'])
+	width = float(options['width'])
+	layer = options['layer']
+	res = options['resolution']
+	method = options['interpolation']
+	nprocs = int(options['nprocs'])
+	cache_size = int(options['cache_size'])
+	memory = int(options['memory'])
+	max_points = options['max_points']
+	tolerance = options['tolerance']
+	summary = options['summary']
+
+	if nprocs < 1:
+		grass.fatal("nprocs must be at least 1")
+	if max_points:
+		max_points = int(max_points)
+		if max_points < 3:
+			grass.fatal("max_points must be at least 3")
+	else:
+		max_points = None
+	if tolerance:
+		tolerance = float(tolerance)
+	else:
+		tolerance = None
+	if not os.path.isdir(directory):
+		grass.fatal("Output directory <%s> not found" % directory)
+
+	# The rivers of the batch: those in the file (with their own settings) first,
+	# then those listed in input, then those matching the pattern
+	mapset = grass.gisenv()['MAPSET']
+	jobs = []
+	if batch_file:
+		jobs.extend(read_jobs(batch_file, spacing, width))
+	if inputs:
+		jobs.extend([[river, spacing, width, river.split("@")[0]] for river in inputs.split(",")])
+	if pattern:
+		found = grass.read_command('g.list', type="vector", pattern=pattern, mapset=mapset)
+		jobs.extend([[river, spacing, width, river] for river in found.split()])
+	listed = set()
+	unique = []
+	for job in jobs:
+		if job[0] not in listed:
+			listed.add(job[0])
+			unique.append(job)
+	jobs = unique
+	if not jobs:
+		grass.fatal("No river networks given, use input, pattern or file")
+
+	# do input maps exist in CURRENT mapset?
+	missing = [job[0] for job in jobs if not grass.find_file(job[0], element = 'vector', mapset = mapset)['file']]
+	if missing:
+		grass.fatal(_("Vector maps not found in current mapset: %s") % ", ".join(missing))
+	if not grass.find_file(elev, element = 'raster', mapset = mapset)['file']:
+		grass.fatal(_("Raster map <%s> not found in current mapset") % elev)
+	for job in jobs:
+		if ".sdf" != job[3].lower()[-4:]:
+			job[3] += ".sdf"
+		job[3] = os.path.join(directory, job[3])
+	if len(set([job[3] for job in jobs])) < len(jobs):
+		grass.fatal("Two rivers of the batch have the same output file")
+	grass.message("Exporting %d river networks" % len(jobs))
+
+	# Looked up once for the whole batch
+	version, units = location_info()
+	if not res:
+		# No resolution given, use the resolution of the elevation raster
+		info = grass.read_command('r.info', map=elev, flags="g")
+		res = grass.parse_key_val(info)['ewres']
+	# One temporary region on the elevation raster, and one sampler, so the tiles
+	# read for one river are there for its neighbours
+	grass.use_temp_region()
+	grass.run_command('g.region', raster=elev, res=res, quiet=True, flags="a")
+	sampler = raster.ProfileSampler(elev, res, method, memory)
+
+	cache_path = cache.default_path()
+	if flags['c']:
+		grass.message("Clearing profile cache: %s" % cache_path)
+		cache.clear(cache_path)
+	if flags['n']:
+		prof_cache = None
+	else:
+		prof_cache = cache.ProfileCache(cache_path, elev, res, method, cache_size*1024*1024)
+
+	if flags['u']:
+		newline = "\n"
+	else:
+		newline = "\r\n"
+
+	# Each river is one task on the pool, a river that fails does not stop the batch
+	def run(job):
+		river, sp, wd, sdf = job
+		result = {'river': river, 'output': sdf, 'reaches': 0, 'xsections': 0, 'intersections': 0,
+			'error': None}
+		start = time.time()
+		try:
+			result['reaches'], result['xsections'], result['intersections'] = export_river(
+				river, sp, wd, sdf, layer, flags['t'], newline, elev, res, sampler, prof_cache,
+				max_points, tolerance, version, units)
+		except SystemExit:
+			# grass.fatal, its message is already printed
+			result['error'] = "failed"
+		except Exception as e:
+			grass.error("<%s>: %s" % (river, e))
+			result['error'] = str(e) or e.__class__.__name__
+		result['seconds'] = time.time() - start
+		return result
+
+	results = list(parallel.ordered_map(run, jobs, nprocs))
+
+	grass.message("%-30s %8s %10s %14s %9s" % ("River", "Reaches", "Sections", "Intersections", "Seconds"))
+	for r in results:
+		grass.message("%-30s %8d %10d %14d %9.1f%s" % (r['river'], r['reaches'], r['xsections'],
+			r['intersections'], r['seconds'], "  FAILED" if r['error'] else ""))
+	grass.message("%-30s %8d %10d %14d %9.1f" % ("Total (%d rivers)" % len(results),
+		sum([r['reaches'] for r in results]), sum([r['xsections'] for r in results]),
+		sum([r['intersections'] for r in results]), sum([r['seconds'] for r in results])))
+	grass.verbose("Elevation tiles read: %d" % sampler.tiles.reads)
+	sampler.close()
+	if prof_cache is not None:
+		evicted = prof_cache.trim()
+		grass.message("Profile cache: %d sections reused, %d sampled, %d evicted" %
+				(prof_cache.hits, prof_cache.misses, evicted))
+	if summary:
+		write_summary(summary, results)
+		grass.message("Summary written to %s" % summary)
+
+	crossing = [r for r in results if r['intersections'] > 0]
+	if crossing:
+		grass.message("  *** Found intersection points in %d rivers: %s ***" % (len(crossing),
+			", ".join(["%s (%d)" % (r['river'], r['intersections']) for r in crossing])), flag="w")
+		grass.message("  *** Correct these cross sections before using the sdf files  ***", flag="w")
+	failed = [r['river'] for r in results if r['error']]
+	if failed:
+		grass.message("  *** Export failed for %d rivers: %s ***" % (len(failed), ", ".join(failed)), flag="w")
+
+	profiling.finish()
+	cleanup()
+	if failed:
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	options, flags = grass.parser()
+	sys.exit(main())
@@ -9,6 +9,7 @@
 #			The input file must include WATER SURFACE EXTENTS: rows 
 #			as part of the HEC-RAS output
 #			These water surface extent points are used to create a GRASS polygon vector
+#			with the water surface of each reach and profile (the areas with its cat)
 # COPYRIGHT: 	This program is free software under the GNU General Public
 #			   License (>=v2). Read the file COPYING that comes with GRASS
 #			   for details.
@@ -33,93 +34,223 @@
 #% description: Name of output GRASS polygon vector
 #% required: yes
 #%end
+#%option
+#% key: water_profiles
+#% type: string
+#% description: Names or numbers (from 1) of the water surface profiles to import (default: all)
+#% multiple: yes
+#% required: no
+#%end
+#%option
+#% key: reaches
+#% type: string
+#% description: Reach ids (or stream id:reach id) of the water surfaces to import (default: all), read with the index of the sdf file
+#% multiple: yes
+#% required: no
+#%end
+#%option
+#% key: profile
+#% type: string
+#% description: Name of output JSON file with the timing of each GRASS command and phase (profiling)
+#% required: no
+#%end
 
 import sys
 import os
 import grass.script as grass
+import numpy as np
+from collections import OrderedDict
+from libhecras import geometry, profiling, sdf, vector
 
 def cleanup():
 	grass.message("Finished")
 
 
-def read_sdf(input):
+@profiling.timed
+def read_sdf(input, reach_ids=None):
+	"""
+	Stream the input SDF, and for each cross section with WATER SURFACE EXTENTS
+	save the station and the extents of all profiles, grouped by stream and reach
+	(reach ids such as "Reach 1" repeat between streams)
+	With reach_ids, only the cross sections of those reaches are read, found with the
+	byte offset index of the SDF (saved next to it as <input>.idx for the next runs)
+	Return the list of profile names and the reaches, keyed by (stream id, reach id)
+	in the order they appear in the SDF
+	"""
+	header = sdf.read_header(input)
+	if reach_ids:
+		index = sdf.load_index(input)
+		streams_reaches = set((t, r) for t, r, s in index)
+		for name in reach_ids:
+			if not any(sdf.reach_selected([name], t, r) for t, r in streams_reaches):
+				grass.fatal("Reach <%s> not found in sdf file" % name)
+		sections = sdf.read_reaches(input, reach_ids, index)
+	else:
+		sections = sdf.read_cross_sections(input)
+	reaches = OrderedDict()
+	num_profiles = 0
+	for xs in sections:
+		if xs.water_extents:
+			reaches.setdefault((xs.stream_id, xs.reach_id), []).append((xs.station, xs.water_extents))
+			num_profiles = max(num_profiles, len(xs.water_extents))
+
+	names = [n.strip() for n in header.get('PROFILE NAMES', '').split(",") if n.strip()]
+	if len(names) != num_profiles:
+		names = [str(p+1) for p in range(num_profiles)]
+
+	return names, reaches
+
+def area_cats(points, rings, ring_cats):
 	"""
-	Read the input SDF, scanning for lines with "WATER SURFACE EXTENT"
-	read the coords from the next line, and save to two lists
-	Return the lists
+	The cats of the rings (water surfaces) that cover each of the points (the centroids
+	of the areas), tested only against the rings whose bounding box holds the point.
+	Returns a list with a list of cats for each point
 	"""
-	left_pairs=[]
-	right_pairs=[]
-	with open(input, 'r') as sdf:
-		lines = sdf.readlines()
-		sdf.close()
-		
-        for i in range(len(lines)):
-            if 'WATER SURFACE EXTENT' in lines[i]:
-	    # Found a surface extent line, the next line has the coord pairs
-	        coords = lines[i+1].strip().replace(" ", "").split(",")
-	        lpair = [coords[0], coords[1]]
-                rpair = [coords[2], coords[3]]
-	        left_pairs.append(lpair)
-	        right_pairs.append(rpair)	
-        	
-        return left_pairs, right_pairs
-
-def create_water_surface(left_pairs, right_pairs, out_vect):
+	cats = [[] for pt in points]
+	if not points:
+		return cats
+	pts = np.asarray(points, dtype=float)
+	for ring, cat in zip(rings, ring_cats):
+		xmin, ymin = ring.min(axis=0)
+		xmax, ymax = ring.max(axis=0)
+		near = np.nonzero((pts[:,0] >= xmin) & (pts[:,0] <= xmax) & (pts[:,1] >= ymin) & (pts[:,1] <= ymax))[0]
+		if not len(near):
+			continue
+		inside = geometry.points_in_ring(pts[near,0], pts[near,1], ring)
+		for k in near[inside]:
+			cats[k].append(cat)
+	return cats
+
+
+@profiling.timed
+def create_water_surface(names, reaches, out_vect, profiles=None):
 	"""
-	Use the two lists of coordinate pairs to create a text file for import into v.in.ascii
-	The left coords first, then the right coords starting from the end, 
-	in order to make a closed polygon. Starting upstream along the left side of the water surface, 
-	to the end of the reach, then back to the start along the right side
-	Add the first point of the left pairs a second time to complete the boundary
+	Create the water surface of each reach and each profile, in a single pass:
+	Along the left extents of the reach from upstream to the end of the reach,
+	then back to the start along the right extents, closing at the first point.
+	All boundaries are written into one file in the standard ASCII format, and imported
+	with a single v.in.ascii call. Water surfaces of different profiles (nested or not)
+	and of neighbouring reaches overlap, so the boundaries are broken at their intersections
+	(v.clean), and each resulting area gets a centroid (v.centroids) with the cats of all
+	the water surfaces that cover it: the areas with one cat make up that reach and profile.
+	The attribute table holds the stream, reach, profile and range of stations of each cat
 	"""
+	if profiles is None:
+		profiles = range(len(names))
 	tmp_coords = grass.tempfile()
-	proc=os.getpid()
-	tmp_vect = out_vect+"_tmp_"+str(proc)
-	
-	# How many total points in the boundary: all the right side+ left side +1 
-	# to allow for the first point a 2nd time to close boundary
-	ttl_pts = len(left_pairs)+len(right_pairs)+1
-	grass.message("Total number of vertices to be added to water surface polygon: %s" % ttl_pts)
-	
+	attrs = []
+	rings = []
+	cat = 0
 	with open(tmp_coords,'w') as tmp:
-	# Write coords in the standard ASCII file format for a grass boundary
-	# Loop thru the left coord pairs, then in reverse thru the right pairs
-	    tmp.write("VERTI:\n")
-	    tmp.write("B %s\n" % ttl_pts)
-	    for i in range(len(left_pairs)):
-	        tmp.write(" "+left_pairs[i][0]+" "+left_pairs[i][1]+"\n")
-			
-	    for j in range(len(right_pairs)-1, -1, -1):
-		tmp.write(" "+right_pairs[j][0]+" "+right_pairs[j][1]+"\n")
-	
-        # Finally add the first point of the left pairs again to close the boundary
-            tmp.write(" "+left_pairs[0][0]+" "+left_pairs[0][1]+"\n")
-	
-	tmp.close()
-	
-	# Now feed into v.in.ascii and also run v.centroids to make a centroid for the polygon
-	grass.run_command('v.in.ascii',input=tmp_coords, output=tmp_vect, format="standard", 
+		# Write coords in the standard ASCII file format for grass boundaries
+		tmp.write("VERTI:\n")
+		for stream, reach in reaches:
+			stations = reaches[(stream, reach)]
+			for p in profiles:
+				# The cross sections of this reach that have extents for this profile
+				sections = [(st, ext) for st, ext in stations if len(ext) > p]
+				if len(sections) < 2:
+					grass.warning("Stream: %s reach: %s profile: %s has less than two cross sections, skipped" %
+							(stream, reach, names[p]))
+					continue
+				ring = geometry.water_surface_ring([ext[p] for st, ext in sections])
+				cat += 1
+				tmp.write("B %d\n" % len(ring))
+				for x, y in ring:
+					tmp.write(" %r %r\n" % (float(x), float(y)))
+				rings.append(ring)
+				attrs.append((cat, stream, reach, names[p], sections[0][0], sections[-1][0]))
+
+	grass.message("Total number of water surfaces: %d" % cat)
+	# Import, break the boundaries where they cross, and find a point in each area
+	tmp_vect = "tmp_hecras_%d" % os.getpid()
+	grass.run_command('v.in.ascii',input=tmp_coords, output=tmp_vect+"_b", format="standard", 
+				quiet=True, overwrite=True)
+	grass.run_command('v.clean', input=tmp_vect+"_b", output=tmp_vect+"_c", type="boundary",
+				tool="break,rmdupl", quiet=True, overwrite=True)
+	grass.run_command('v.centroids', input=tmp_vect+"_c", output=tmp_vect+"_a", option="add",
 				quiet=True, overwrite=True)
-	grass.run_command('v.centroids', input=tmp_vect, output=out_vect, quiet=True, overwrite=True)
+
+	# Copy the cleaned boundaries, and give each centroid the cats of the surfaces covering it
+	centroids = []
+	with open(tmp_coords,'w') as tmp:
+		tmp.write("VERTI:\n")
+		pp = grass.pipe_command('v.out.ascii', input=tmp_vect+"_a", format="standard",
+				type="boundary,centroid", quiet=True)
+		stdout = vector.text_lines(pp.stdout)
+		for line in stdout:
+			if line.startswith("VERTI:"):
+				break
+		for line in stdout:
+			hdr = line.split()
+			if not hdr:
+				continue
+			num_verts = int(hdr[1])
+			num_cats = int(hdr[2]) if len(hdr) > 2 else 0
+			verts = [next(stdout) for k in range(num_verts)]
+			for k in range(num_cats):
+				next(stdout)
+			if hdr[0] in ('C', 'c'):
+				xy = verts[0].split()
+				centroids.append((float(xy[0]), float(xy[1])))
+			else:
+				tmp.write("B %d\n" % num_verts)
+				tmp.writelines(verts)
+		pp.stdout.close()
+		pp.wait()
+		covered = 0
+		for (x, y), cats in zip(centroids, area_cats(centroids, rings, range(1, cat+1))):
+			if not cats:
+				# An area enclosed by water surfaces, but not part of any
+				continue
+			covered += 1
+			tmp.write("C 1 %d\n" % len(cats))
+			tmp.write(" %r %r\n" % (x, y))
+			for c in cats:
+				tmp.write(" 1 %d\n" % c)
+
+	grass.message("Number of water surface areas: %d" % covered)
+	grass.run_command('v.in.ascii',input=tmp_coords, output=out_vect, format="standard", 
+				quiet=True, overwrite=True)
+	grass.run_command('g.remove', type="vector", name="%s_b,%s_c,%s_a" % (tmp_vect, tmp_vect, tmp_vect),
+				flags="f", quiet=True)
+	vector.write_table(out_vect, [("stream", "VARCHAR(80)"), ("reach", "VARCHAR(80)"), ("profile", "VARCHAR(80)"),
+				("station_from", "VARCHAR(40)"), ("station_to", "VARCHAR(40)")], attrs)
 	grass.message("Polygon vector: %s has been created" % (out_vect))
-	grass.message("Cleaning up tmp files %s,%s" %(str(tmp), str(tmp_vect)))
-	grass.run_command('g.remove',type='vect', name=tmp_vect, flags="f")
 	os.unlink(tmp_coords)	
 
 
 def main():
+	profiling.start(options['profile'])
 	in_sdf = options['input']
 	out_vect = options['output']
+	profiles = options['water_profiles']
+	reach_ids = options['reaches']
 
 	if not os.path.isfile(in_sdf):
 		grass.fatal(_("Input sdf: %s not found") % in_sdf)
 		sys.exit(0)
 
-        left_pairs, right_pairs = read_sdf(in_sdf)
-        create_water_surface(left_pairs, right_pairs, out_vect)
+	names, reaches = read_sdf(in_sdf, [r.strip() for r in reach_ids.split(",")] if reach_ids else None)
+	if not reaches:
+		grass.fatal("No WATER SURFACE EXTENTS data in sdf file")
+
+	# Profiles may be given by name or by number
+	if profiles:
+		selected = []
+		for p in profiles.split(","):
+			if p in names:
+				selected.append(names.index(p))
+			elif p.isdigit() and 0 < int(p) <= len(names):
+				selected.append(int(p)-1)
+			else:
+				grass.fatal("Profile <%s> not found in sdf file" % p)
+	else:
+		selected = None
+	create_water_surface(names, reaches, out_vect, selected)
 
-        cleanup()
+	profiling.finish()
+	cleanup()
 	
 if __name__ == "__main__":
 	options, flags = grass.parser()
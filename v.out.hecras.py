@@ -57,83 +57,115 @@
 #% description: Name of output HEC RAS geometry file (without .sdf extension)
 #% required: yes
 #%end
+#%option
+#% key: interpolation
+#% type: string
+#% description: Interpolation of elevation points along the cross sections
+#% options: nearest,bilinear
+#% answer: nearest
+#% required: no
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of cross section profiles to extract in parallel
+#% answer: 1
+#% required: no
+#%end
+#%option
+#% key: cache_size
+#% type: integer
+#% description: Size limit of the cross section profile cache in the current mapset (MB)
+#% answer: 256
+#% required: no
+#%end
+#%option
+#% key: max_points
+#% type: integer
+#% description: Maximum number of elevation points in each cross section (HEC-RAS allows 500)
+#% required: no
+#%end
+#%option
+#% key: tolerance
+#% type: double
+#% description: Vertical tolerance for thinning the elevation points of each cross section
+#% required: no
+#%end
+#%option
+#% key: memory
+#% type: integer
+#% description: Maximum memory for tiles of the elevation raster (MB)
+#% answer: 300
+#% required: no
+#%end
 #%flag
 #%  key: u
 #%  description: Add Posix line separator to output (default is windows CR-LF)
 #%	required: no
 #%end
+#%flag
+#%  key: p
+#%  description: Use r.profile for cross section elevations (slower, nearest cell only)
+#%	required: no
+#%end
+#%flag
+#%  key: n
+#%  description: Do not use the cross section profile cache
+#%	required: no
+#%end
+#%flag
+#%  key: c
+#%  description: Clear the cross section profile cache before export
+#%	required: no
+#%end
+#%flag
+#%  key: r
+#%  description: Resume a failed export from its checkpoint (the inputs must be unchanged)
+#%	required: no
+#%end
+#%option
+#% key: profile
+#% type: string
+#% description: Name of output JSON file with the timing of each GRASS command and phase (profiling)
+#% required: no
+#%end
 
 import sys
-import os
 import math
-import datetime
 import grass.script as grass
+from libhecras import cache, export, profiling, raster, vector
+from libhecras.sdf import SdfWriter, Checkpoint, UNITS, write_header, write_stream_network
 
-def cleanup(sdf, nl=True):
-	if nl:
-		sdf_tmp = sdf+".tmp"
-		sdf_content = open(sdf, 'r').read()
-		f_out = open(sdf_tmp, 'w')
-		f_out.write(sdf_content.replace("\n", "\r\n"))
-		f_out.close()
-		os.rename(sdf_tmp, sdf)
-		
+def cleanup():
 	grass.message("Finished")
 
+@profiling.timed
 def output_headers(river, xsections, outfile):
 	""" 
 	Prepare the output sdf file, and add header section
 	"""
-	# Start header section
 	ver=grass.read_command('g.version')
-	dt=str(datetime.date.today())
-
-	outfile.write("# RAS geometry file create on: "+dt+"\n")
-	outfile.write("# exported from GRASS GIS version: "+ver+"\n\n")
-	outfile.write("BEGIN HEADER:\n")
 	proj=grass.read_command('g.proj',flags="g")
 	d=grass.parse_key_val(proj)
-	if d['units'] == "metres":
-		units="METRIC"
-	elif d['units'] == "feet":
-		units="US CUSTOMARY"
-	else:
-		units=""
+	units = UNITS.get(d['units'], "")
 
-	outfile.write(" UNITS: "+ units + "\n")
-	outfile.write(" DTM TYPE: GRID\n")
-	outfile.write(" STREAM LAYER: "+ river +"\n")
-	outfile.write(" CROSS-SECTION LAYER: "+ xsections +"\n")
-	
-	# write out the extents
+	# The extents
 	info = grass.read_command('v.info', map=river, flags="g")
 	d=grass.parse_key_val(info)
-	xmin=d['west']
-	xmax=d['east']
-	ymin=d['south']
-	ymax=d['north']
-	outfile.write(" BEGIN SPATIALEXTENT: \n")
-	outfile.write("   Xmin: "+ xmin +"\n")
-	outfile.write("   Xmax: "+ xmax +"\n")
-	outfile.write("   Ymin: "+ ymin +"\n")
-	outfile.write("   Ymax: "+ ymax +"\n")	
-	outfile.write(" END SPATIALEXTENT: \n")
+	extent = (d['west'], d['east'], d['south'], d['north'])
 
-	# write out how many reaches and cross sections
+	# How many reaches and cross sections
 	info = grass.read_command('v.info', map=river, flags="t")
 	d = grass.parse_key_val(info)
 	num_reaches=d['lines']
-	outfile.write(" NUMBER OF REACHES: "+ num_reaches +"\n")
-	
-
 	info = grass.read_command('v.info', map=xsections, flags="t")
 	d=grass.parse_key_val(info)
 	num_xsects=d['lines']
-	outfile.write(" NUMBER OF CROSS-SECTIONS: "+ num_xsects +"\n")
 
-	outfile.write("END HEADER:\n\n")
+	write_header(outfile, ver, units, river, xsections, extent, num_reaches, num_xsects)
 
 
+@profiling.timed
 def output_centerline(river, stations, elev, outfile):
 	""" 
 	Output the river network, including centerline for each reach
@@ -143,162 +175,101 @@ def output_centerline(river, stations, elev, outfile):
 	# Begin with the list of reach cats
 	rc=grass.read_command('v.category', input=river, type="line", option="print")
 	reach_cats=rc.strip().split("\n")
-	
-	outfile.write("BEGIN STREAM NETWORK:\n")
-	# Now get points from the river vector, one pair for each reach
-	for i in range(len(reach_cats)):
-		where_cond="cat="+str(reach_cats[i])
-		riv=grass.read_command('v.db.select',map=river, separator=" ", 
-				columns="cat,start_x,start_y,end_x,end_y", where=where_cond, flags="c")
-		riv_pts=riv.strip().split(" ")
-		pi,x1,y1,x2,y2 = riv_pts[0],riv_pts[1],riv_pts[2],riv_pts[3],riv_pts[4]
-		# Give the start point a point id of "cat"1, and the endpoint an id of "cat"2
-		pi1 = pi+"1"
-		pi2 = pi+"2"
-		# Get elevation of each endpoint from the elev raster
-		coords=x1+","+y1
-		e = grass.read_command('r.what', map=elev, coordinates=coords, separator=",")
-		start_elev=e.split(",")[3].rstrip()
-		coords=x2+","+y2
-		e = grass.read_command('r.what', map=elev, coordinates=coords, separator=",")
-		end_elev=e.split(",")[3].rstrip()
-		outfile.write(" ENDPOINT: "+x1+","+y1+","+start_elev+","+pi1+"\n")
-		outfile.write(" ENDPOINT: "+x2+","+y2+","+end_elev+","+pi2+"\n")
 
-	# Loop thru the reach_cats again, and output a REACH: section for each reach, 
-	# with all points for that reach
-	for i in range(len(reach_cats)):
-		outfile.write(" REACH:\n")
-		outfile.write("   STREAM ID: %s\n" % river)
-		reach_id=str(reach_cats[i])
-		outfile.write("   REACH ID: %s\n" % reach_id)
-		# Get the FROM POINT and TO POINT ids just like above
-		where_cond="cat="+str(reach_cats[i])
-		riv=grass.read_command('v.db.select',map=river, separator=" ", 
-				columns="cat,start_x,end_x,start_y,end_y", where=where_cond, flags="c")
-		r_pts=riv.strip().split(" ")
-		pi,x1,y1,x2,y2 = r_pts[0],r_pts[1],r_pts[2],r_pts[3],r_pts[4]
-		# Give the start point a point id of "cat"1, and the endpoint a n id of "cat"2
-		pi1 = pi+"1"
-		pi2 = pi+"2"
-		outfile.write("   FROM POINT: %s\n" % pi1)
-		outfile.write("   TO POINT: %s\n" % pi2)
+	# Get the start and end points of all reaches in one query
+	riv=grass.read_command('v.db.select',map=river, separator=" ", 
+			columns="cat,start_x,start_y,end_x,end_y", flags="c")
+	reach_pts={}
+	for line in riv.strip().split("\n"):
+		r_pts=line.strip().split(" ")
+		reach_pts[r_pts[0]] = r_pts[1:5]
 
-		# Now the actual points along centerline
-		outfile.write("   CENTERLINE:\n")
-		# loop thru the stations point vector to get each station's x,y and id
-		reach_cond="reach_id="+reach_cats[i]
-		p=grass.pipe_command('v.db.select', map=stations, where=reach_cond, quiet=True, flags="c")
-		st_list=[]
-		for line in p.stdout:
-			st=line.strip().split('|')
-			s,x,y = st[0], st[1], st[2]
-			st_list.append([s,x,y])
+	# Get all stations in one query, and group them by reach
+	p=grass.pipe_command('v.db.select', map=stations, columns="cat,x,y,reach_id", quiet=True, flags="c")
+	reach_stations={}
+	for line in vector.text_lines(p.stdout):
+		st=line.strip().split('|')
+		s,x,y,r = st[0], st[1], st[2], st[3]
+		reach_stations.setdefault(r, []).append([s,x,y])
 
-		p.stdout.close()
-		p.wait()
-		# Now write out all station points to the CENTERLINE section
-		# Go thru the st_list in reverse order so that the centerline is from upstream to downstream
-		for i in range(len(st_list)-1, -1, -1):
-			outfile.write("	"+st_list[i][1]+","+st_list[i][2]+",NULL,"+st_list[i][0]+"\n")
+	p.stdout.close()
+	p.wait()
 
-		outfile.write(" END:\n")
+	# Get elevation of all endpoints from the elev raster, in one batch
+	endpoints=[]
+	for i in range(len(reach_cats)):
+		x1,y1,x2,y2 = reach_pts[reach_cats[i]]
+		endpoints.append([x1,y1])
+		endpoints.append([x2,y2])
+	elevs = raster.what(elev, endpoints)
 
-	# Close STREAM NETWORK section
-	outfile.write("END STREAM NETWORK:\n\n")
+	# Each reach with its endpoints and the stations along it
+	reaches = []
+	for i in range(len(reach_cats)):
+		x1,y1,x2,y2 = reach_pts[reach_cats[i]]
+		reaches.append((reach_cats[i], (x1, y1, elevs[2*i]), (x2, y2, elevs[2*i+1]),
+				reach_stations.get(reach_cats[i], [])))
+	write_stream_network(outfile, river, reaches)
 
-def output_xsections(xsects, outfile, elev, res, river):
+@profiling.timed
+def read_cutlines(xsects):
 	"""
-	Create the cross section profiles by first making a points vector from the cross sections
-	loop thru the section_ids and use v.out.ascii to get the points for each cross section.
-	Feed these points into r.profile to get lists of the coords and elevation at each spot along the xsection,
-	and output these to the CROSS-SECTION paragraph
+	Read the vertices of all cross sections in one pass, together with their reach and station_id.
+	Vertices of cross sections with the same station_id (or of lines with the same cat) are grouped together.
+	Returns a list of [reach, station_id, [[x,y], ...]] in the order of the cross sections table,
+	with the coordinates formatted as v.out.ascii prints them
 	"""
-
-	# Prepare tmp vector maps to hold the points from the cross sections
-	proc=os.getpid()
-	xsect_pts="tmp_xsect_pts_"+str(proc)
-	#xsect_pts2="tmp_xsect_pts2_"+str(proc)
-	# v.to.points returns all points on the same cross section with the same cat value
-	grass.run_command('v.to.points', input=xsects, output=xsect_pts, use="vertex", quiet=True)
-	outfile.write("\n")
-	outfile.write("BEGIN CROSS-SECTIONS:\n")
-	
-	# Get the list of station ids with the reaches
-	# Layer 1 contains one cat for all points on the same xsect line, 
-	# so v.db.select returns one row for each xsect line (not for each point on the line)
-	st=grass.pipe_command('v.db.select', map=xsect_pts, layer=1, columns="reach,station_id", flags="c", quiet=True)
-	station_ids=[]
-	for line in st.stdout:	
+	lines = vector.read_lines(xsects, parts=True)
+	# Layer 1 contains one cat for each xsect line
+	st=grass.pipe_command('v.db.select', map=xsects, layer=1, columns="cat,reach,station_id", flags="c", quiet=True)
+	cutlines=[]
+	by_station={}
+	for line in vector.text_lines(st.stdout):
 		station = line.rstrip('\n').split("|")
-		r,s = station[0], station[1]
-		station_ids.append([r,s])
+		c,r,s = station[0], station[1], station[2]
+		if int(c) not in lines:
+			continue
+		pts = [[vector.format_coord(x), vector.format_coord(y)] for x,y in lines[int(c)]]
+		if s in by_station:
+			by_station[s][2].extend(pts)
+		else:
+			by_station[s] = [r, s, pts]
+			cutlines.append(by_station[s])
 
 	st.stdout.close()
 	st.wait()
-	
-	# Now loop thru those stations to create the CUTLINE and SURFACE section
-	for i in range(len(station_ids)):
-		station_id = station_ids[i][1].strip('\n')
-		reach = station_ids[i][0].rstrip('\n')
-		process_msg="Processing reach: "+reach+" at station id: "+station_id
-		grass.message(process_msg)
-		outfile.write(" CROSS-SECTION:\n")
-		outfile.write("   STREAM ID: %s\n" % river)
-		outfile.write("   REACH ID: %s\n" % reach)
-		outfile.write("   STATION: %s\n" % station_id)
-			
-		# get point coords from this reach/station and print out CUTLINE: section
-		# Save this output also for next SURFACE: section
-		station_cond="station_id="+station_id
-		p=grass.pipe_command('v.out.ascii', input=xsect_pts, columns="reach,station_id", 
-			where=station_cond ,separator=",", layer=1, quiet=True)
-		station_pts=[]
-		for line in p.stdout:
-			st = line.rstrip('\n').split(',')
-			station_pts.append(st)
+	return cutlines
 
-		p.stdout.close()
-		p.wait()
-
-		outfile.write("   CUTLINE:\n")
-		for j in range(len(station_pts)):
-			x,y = station_pts[j][0], station_pts[j][1]
-			outfile.write("	 "+x+","+y+"\n")  
-
-		# Now run the points thru r.profile, and get the elevations
-		# and print elevations to SURFACE LINE: section
-		outfile.write("   SURFACE LINE:\n")
-		profile_pts=[]
-		for k in range(len(station_pts)):
-			x,y = station_pts[k][0], station_pts[k][1]
-			profile_pts.append([x,y])
-			
-		pp=grass.pipe_command('r.profile', input=elev, coordinates=profile_pts, resolution=res, flags="g", quiet=True)
-		for line in pp.stdout:
-			l=line.rstrip('\n').split(" ")
-			# The r.profile output has x,y in first two columns and elev in 4th column
-			outfile.write("	 "+l[0]+","+l[1]+","+l[3]+"\n")
-		pp.stdout.close()
-		pp.wait()
-		
-		# CLose this CROSS-SECTION paragraph
-		outfile.write(" END:\n\n")
-
-	outfile.write("END CROSS-SECTIONS:\n\n")
-
-	# remove temp points file
-	grass.message("Removing temp vector: %s" % (xsect_pts))
-	grass.run_command('g.remove', type='vector', name=xsect_pts, quiet=True, flags="f")
+@profiling.timed
+def output_xsections(xsects, outfile, elev, res, river, sampler=None, nprocs=1, prof_cache=None,
+		max_points=None, tolerance=None, checkpoint=None):
+	"""
+	Read the points of all cross sections in one pass, then sample the elevation raster
+	along them and write the CROSS-SECTIONS section
+	(or the rest of it, when resuming from the checkpoint)
+	"""
+	if checkpoint is None or checkpoint.start is None:
+		outfile.write("\n")
+	# Get the list of station ids with the reaches, and the points of each cross section
+	cutlines = read_cutlines(xsects)
+	export.write_cross_sections(outfile, river, cutlines, elev, res, sampler, nprocs, prof_cache,
+			max_points, tolerance, checkpoint)
 
 
 def main():
+	profiling.start(options['profile'])
 	river = options['river']
 	stations = options['stations']
 	xsections = options['xsections']
 	elev = options['elevation']
 	output = options['output']
 	res = options['resolution']
+	method = options['interpolation']
+	nprocs = int(options['nprocs'])
+	cache_size = int(options['cache_size'])
+	memory = int(options['memory'])
+	max_points = options['max_points']
+	tolerance = options['tolerance']
 	
 	# do input maps exist in CURRENT mapset?
 	mapset = grass.gisenv()['MAPSET']
@@ -310,37 +281,100 @@ def main():
 		grass.fatal(_("Vector map <%s> not found in current mapset") % xsections)
 	if not grass.find_file(elev, element = 'raster', mapset = mapset)['file']:
 		grass.fatal(_("Raster map <%s> not found in current mapset") % elev)
+	if nprocs < 1:
+		grass.fatal("nprocs must be at least 1")
+	if max_points:
+		max_points = int(max_points)
+		if max_points < 3:
+			grass.fatal("max_points must be at least 3")
+	else:
+		max_points = None
+	if tolerance:
+		tolerance = float(tolerance)
+	else:
+		tolerance = None
 	if not res:
 		# No resolution given, use the resolution of the elevation raster
 		info = grass.read_command('r.info', map=elev, flags="g")
 		d=grass.parse_key_val(info)
 		res=d['ewres']  # Assume ewres=nsres
 	# Be sure region is set to dtm layer
+	# (a temporary region for this module only, the user's region is not changed)
+	# Setting the region reads no raster data, only the tiles under the cross sections are read
+	grass.use_temp_region()
 	grass.run_command('g.region', raster=elev, res=res, quiet=True, flags="a")
+	if flags['p']:
+		if method != "nearest":
+			grass.fatal("r.profile (-p flag) supports only nearest interpolation")
+		sampler = None
+	else:
+		# Sample all cross sections in memory, from windows of the elevation raster
+		sampler = raster.ProfileSampler(elev, res, method, memory)
+
+	# Profiles of unchanged cross sections are reused from earlier exports
+	cache_path = cache.default_path()
+	if flags['c']:
+		grass.message("Clearing profile cache: %s" % cache_path)
+		cache.clear(cache_path)
+	if flags['n']:
+		prof_cache = None
+	else:
+		prof_cache = cache.ProfileCache(cache_path, elev, res, method, cache_size*1024*1024)
 
 	# Prepare output file
-	if ".sdf" == output.lower()[-4]:
+	if ".sdf" == output.lower()[-4:]:
 		sdf=output
 	else:
 		sdf=output+".sdf"
+
+	# Newline chars are CR-NL for windows, unless Posix line separators are requested
+	if flags['u']:
+		newline = "\n"
+	else:
+		newline = "\r\n"
 	
-	sdf_file=open(sdf, 'w')
+	# The finished cross sections are recorded in a checkpoint next to the sdf,
+	# with the identity of the inputs, so that a failed export can be resumed
+	inputs = {'river': cache.vector_stamp(river), 'stations': cache.vector_stamp(stations),
+		'xsections': cache.vector_stamp(xsections), 'elevation': cache.raster_stamp(elev),
+		'resolution': str(res), 'interpolation': method, 'rprofile': flags['p'],
+		'max_points': max_points, 'tolerance': tolerance, 'newline': newline}
+	checkpoint = Checkpoint(sdf, inputs)
+	resume = None
+	if flags['r']:
+		resume = checkpoint.load()
+		if checkpoint.changed:
+			grass.fatal("Inputs changed since the checkpoint (%s), export again without -r" %
+					", ".join(checkpoint.changed))
+		if resume is None:
+			grass.warning("No checkpoint of an earlier export to %s, starting over" % sdf)
+	else:
+		checkpoint.remove()
 
-	# The work starts here
-	output_headers(river, xsections, sdf_file)	
-	grass.message("Headers written to %s" % sdf)
-	output_centerline(river, stations, elev, sdf_file)
-	grass.message("River network written to %s" % sdf)
-	output_xsections(xsections, sdf_file, elev, res, river)
-	grass.message("Cross sections written to %s" % sdf)
+	# The writer converts the line endings as it writes,
+	# and moves the finished file into place only if all sections succeed
+	# (the partial file of a failed export is kept for -r)
+	with SdfWriter(sdf, newline, keep=True, resume=resume) as sdf_file:
+		# The work starts here
+		if checkpoint.start is None:
+			output_headers(river, xsections, sdf_file)	
+			grass.message("Headers written to %s" % sdf)
+			output_centerline(river, stations, elev, sdf_file)
+			grass.message("River network written to %s" % sdf)
+		output_xsections(xsections, sdf_file, elev, res, river, sampler, nprocs, prof_cache,
+				max_points, tolerance, checkpoint)
+		grass.message("Cross sections written to %s" % sdf)
+	checkpoint.remove()
 
-	sdf_file.close()
-	
-	# Replace newline chars with CR-NL for windows?
-	replace_nl = True
-	if flags['u']:
-		replace_nl = False
-	cleanup(sdf, replace_nl)
+	if sampler is not None:
+		grass.verbose("Elevation tiles read: %d" % sampler.tiles.reads)
+		sampler.close()
+	if prof_cache is not None:
+		evicted = prof_cache.trim()
+		grass.message("Profile cache: %d sections reused, %d sampled, %d evicted" % 
+				(prof_cache.hits, prof_cache.misses, evicted))
+	profiling.finish()
+	cleanup()
 	return 0
 
 if __name__ == "__main__":
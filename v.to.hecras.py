@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+############################################################################
+#
+# MODULE:	   v.to.hecras
+# AUTHOR(S):   	Micha Silver
+#				micha@arava.co.il  Arava Drainage Authority
+# PURPOSE:	  Creates a HEC RAS geometry file (sdf) directly from a river network and an
+#			elevation raster: the stations and cross sections are created in memory
+#			(as by v.xsections) and their profiles sampled and written (as by v.out.hecras)
+#			without writing and reading back the intermediate vector maps
+# COPYRIGHT: 	This program is free software under the GNU General Public
+#			   License (>=v2). Read the file COPYING that comes with GRASS
+#			   for details.
+#
+#############################################################################
+
+#%module
+#% description: Creates a HEC RAS geometry file of cross sections from a river network and an elevation raster in one pass
+#% keywords: vector
+#% keywords: HEC RAS
+#% keywords: cross sections
+#%end
+#%flag
+#%  key: t
+#%  description: Trim intersecting cross sections (equally on both sides of the river) until they no longer intersect
+#%end
+#%flag
+#%  key: u
+#%  description: Add Posix line separator to output (default is windows CR-LF)
+#%end
+#%flag
+#%  key: n
+#%  description: Do not use the cross section profile cache
+#%end
+#%flag
+#%  key: c
+#%  description: Clear the cross section profile cache before export
+#%end
+#%option
+#% key: input
+#% type: string
+#% description: Name of input river network line vector
+#% required: yes
+#%end
+#%option
+#% key: elevation
+#% type: string
+#% description: Name of input elevation raster for making cross section profiles
+#% required: yes
+#%end
+#%option
+#% key: output
+#% type: string
+#% description: Name of output HEC RAS geometry file (without .sdf extension)
+#% required: yes
+#%end
+#%option
+#% key: spacing
+#% type: integer
+#% description: Spacing between cross sections
+#% answer: 100
+#% required: no
+#%end
+#%option
+#% key: width
+#% type: integer
+#% description: Width of cross sections
+#% answer: 200
+#% required: no
+#%end
+#%option
+#% key: layer
+#% type: integer
+#% description: Layer of the river network categories
+#% answer: 1
+#% required: no
+#%end
+#%option
+#% key: min_spacing
+#% type: double
+#% description: Adaptive spacing: smallest spacing between cross sections, at the sharpest bends
+#% required: no
+#%end
+#%option
+#% key: max_spacing
+#% type: double
+#% description: Adaptive spacing: largest spacing between cross sections, on straight reaches
+#% required: no
+#%end
+#%option
+#% key: max_turn
+#% type: double
+#% description: Adaptive spacing: change of river direction (degrees) allowed between cross sections
+#% answer: 10
+#% required: no
+#%end
+#%option
+#% key: resolution
+#% type: integer
+#% description: Resolution along the cross sections for getting elevation points (if not given, the elevation raster resolution will be used)
+#% required: no
+#%end
+#%option
+#% key: interpolation
+#% type: string
+#% description: Interpolation of elevation points along the cross sections
+#% options: nearest,bilinear
+#% answer: nearest
+#% required: no
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of processes for creating the cross sections, and of cross section profiles to extract in parallel
+#% answer: 1
+#% required: no
+#%end
+#%option
+#% key: cache_size
+#% type: integer
+#% description: Size limit of the cross section profile cache in the current mapset (MB)
+#% answer: 256
+#% required: no
+#%end
+#%option
+#% key: max_points
+#% type: integer
+#% description: Maximum number of elevation points in each cross section (HEC-RAS allows 500)
+#% required: no
+#%end
+#%option
+#% key: tolerance
+#% type: double
+#% description: Vertical tolerance for thinning the elevation points of each cross section
+#% required: no
+#%end
+#%option
+#% key: memory
+#% type: integer
+#% description: Maximum memory for tiles of the elevation raster (MB)
+#% answer: 300
+#% required: no
+#%end
+#%option
+#% key: stations
+#% type: string
+#% description: Name of output river stations point vector (optional, not needed for the sdf)
+#% required: no
+#%end
+#%option
+#% key: xsections
+#% type: string
+#% description: Name of output cross sections line vector (optional, not needed for the sdf)
+#% required: no
+#%end
+#%option
+#% key: intersects
+#% type: string
+#% description: Name of output point vector of cross section intersections (optional, intersections are always reported)
+#% required: no
+#%end
+#%option
+#% key: profile
+#% type: string
+#% description: Name of output JSON file with the timing of each GRASS command and phase (profiling)
+#% required: no
+#%end
+
+import sys
+import grass.script as grass
+from libhecras import cache, profiling, raster, vector
+from libhecras.sdf import SdfWriter
+from libhecras.export import location_info, output_headers, output_centerline, output_xsections
+from libhecras.xsections import (station_layout, build_features, all_cross_sections,
+		create_stations_schematic, create_cross_sections, create_xsection_intersects)
+
+def cleanup():
+	grass.message("Finished")
+
+
+def main():
+	profiling.start(options['profile'])
+	river = options['input']
+	elev = options['elevation']
+	output = options['output']
+	spacing = float(options['spacing'])
+	width = options['width']
+	layer = options['layer']
+	min_spacing = options['min_spacing']
+	max_spacing = options['max_spacing']
+	max_turn = float(options['max_turn'])
+	res = options['resolution']
+	method = options['interpolation']
+	nprocs = int(options['nprocs'])
+	cache_size = int(options['cache_size'])
+	memory = int(options['memory'])
+	max_points = options['max_points']
+	tolerance = options['tolerance']
+	stations = options['stations']
+	xsections = options['xsections']
+	intersects = options['intersects']
+
+	# do input maps exist in CURRENT mapset?
+	mapset = grass.gisenv()['MAPSET']
+	if not grass.find_file(river, element = 'vector', mapset = mapset)['file']:
+		grass.fatal(_("Vector map <%s> not found in current mapset") % river)
+	if not grass.find_file(elev, element = 'raster', mapset = mapset)['file']:
+		grass.fatal(_("Raster map <%s> not found in current mapset") % elev)
+	if nprocs < 1:
+		grass.fatal("nprocs must be at least 1")
+	adaptive = None
+	if min_spacing or max_spacing:
+		if not (min_spacing and max_spacing):
+			grass.fatal("Adaptive spacing needs both min_spacing and max_spacing")
+		adaptive = (float(min_spacing), float(max_spacing), max_turn)
+		if not 0 < adaptive[0] <= adaptive[1] or max_turn <= 0:
+			grass.fatal("Adaptive spacing needs 0 < min_spacing <= max_spacing, and max_turn > 0")
+	if max_points:
+		max_points = int(max_points)
+		if max_points < 3:
+			grass.fatal("max_points must be at least 3")
+	else:
+		max_points = None
+	if tolerance:
+		tolerance = float(tolerance)
+	else:
+		tolerance = None
+
+	# The stations and cross sections, in memory
+	reaches = vector.read_lines(river, layer)
+	if not reaches:
+		grass.fatal("No lines with categories in layer %s of <%s>" % (layer, river))
+	layout = station_layout(reaches, spacing, adaptive=adaptive)
+	features = build_features(reaches, layout, width, nprocs)
+	xsects = all_cross_sections(features, flags['t'])
+	grass.message("Created %d cross sections" % len(xsects))
+
+	# The vector maps are only side outputs
+	if stations:
+		create_stations_schematic(stations, features)
+	if xsections:
+		create_cross_sections(xsections, xsects)
+	intersect_cnt = create_xsection_intersects(xsects, intersects)
+
+	if not res:
+		# No resolution given, use the resolution of the elevation raster
+		info = grass.read_command('r.info', map=elev, flags="g")
+		res = grass.parse_key_val(info)['ewres']
+	# A temporary region on the elevation raster, only the tiles under the cross sections are read
+	grass.use_temp_region()
+	grass.run_command('g.region', raster=elev, res=res, quiet=True, flags="a")
+	sampler = raster.ProfileSampler(elev, res, method, memory)
+
+	cache_path = cache.default_path()
+	if flags['c']:
+		grass.message("Clearing profile cache: %s" % cache_path)
+		cache.clear(cache_path)
+	if flags['n']:
+		prof_cache = None
+	else:
+		prof_cache = cache.ProfileCache(cache_path, elev, res, method, cache_size*1024*1024)
+
+	if ".sdf" == output.lower()[-4:]:
+		sdf=output
+	else:
+		sdf=output+".sdf"
+	if flags['u']:
+		newline = "\n"
+	else:
+		newline = "\r\n"
+
+	version, units = location_info()
+	with SdfWriter(sdf, newline) as sdf_file:
+		output_headers(river, xsections or river, reaches, xsects, sdf_file, version, units)
+		output_centerline(river, reaches, features, layout, elev, sdf_file)
+		output_xsections(xsects, sdf_file, elev, res, river, sampler, nprocs, prof_cache,
+				max_points, tolerance)
+	grass.message("Cross sections written to %s" % sdf)
+
+	grass.verbose("Elevation tiles read: %d" % sampler.tiles.reads)
+	sampler.close()
+	if prof_cache is not None:
+		evicted = prof_cache.trim()
+		grass.message("Profile cache: %d sections reused, %d sampled, %d evicted" %
+				(prof_cache.hits, prof_cache.misses, evicted))
+	if intersect_cnt > 0:
+		grass.message("  *** Found %d intersection points ***" % intersect_cnt, flag="w")
+		grass.message("  *** Correct these cross sections before using the sdf file  ***", flag="w")
+
+	profiling.finish()
+	cleanup()
+	return 0
+
+if __name__ == "__main__":
+	options, flags = grass.parser()
+	sys.exit(main())
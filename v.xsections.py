@@ -23,6 +23,14 @@
 #%  key: s
 #%  description: Perform smoothing on input map with v.generalize (uses "snakes" algorithm)
 #%end
+#%flag
+#%  key: i
+#%  description: Incremental: only regenerate the cross sections of reaches added, removed or changed since the last run
+#%end
+#%flag
+#%  key: t
+#%  description: Trim intersecting cross sections (equally on both sides of the river) until they no longer intersect
+#%end
 #% option
 #% key: input 
 #% description: Name of input (river) line vector
@@ -79,183 +87,204 @@
 #% description: The threshold for the smoothed vector name (only when -s flag is used)
 #% required: no
 #%end
+#%option
+#% key: min_spacing
+#% type: double
+#% description: Adaptive spacing: smallest spacing between cross sections, at the sharpest bends
+#% required: no
+#%end
+#%option
+#% key: max_spacing
+#% type: double
+#% description: Adaptive spacing: largest spacing between cross sections, on straight reaches
+#% required: no
+#%end
+#%option
+#% key: max_turn
+#% type: double
+#% description: Adaptive spacing: change of river direction (degrees) allowed between cross sections
+#% answer: 10
+#% required: no
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of processes for creating the stations and cross sections of the reaches
+#% answer: 1
+#% required: no
+#%end
+#%option
+#% key: profile
+#% type: string
+#% description: Name of output JSON file with the timing of each GRASS command and phase (profiling)
+#% required: no
+#%end
 
 import sys
 import os
-import math
+import json
+import hashlib
+import numpy as np
 import grass.script as grass
+from collections import OrderedDict
+from libhecras import geometry, profiling, vector
+from libhecras.xsections import (station_layout, build_features, write_stations, write_cross_sections,
+		all_cross_sections, intersect_rows, write_intersects, create_stations_schematic,
+		create_cross_sections, create_xsection_intersects)
+
 
 def cleanup():
 	grass.message("Finished")
 
-def create_stations_schematic(invect, outvect, spacing, cats):
-	""" 
-	Loop thru all river reaches, and for each reach
-	begin at the downstream end of the reach, 
-	and create a series of points at each "spacing" interval. 
-	Put these points into an ASCII file, formatted for v.segment
-	and run v.segment to create a line vector of stations along the original river
+
+def manifest_file(xsections):
 	"""
-	# Create temp file for Points
-	tmp_stations = grass.tempfile()
-	tmp = open(tmp_stations,'w')
-	# Keep track of how many total river stations were marked
-	station_cnt=0
-	# cats is a dict with cat as key and reach length as value
-	for c in cats:
-		reach_len=float(cats[c])
-		# Begins at the downstream of each river reach, and work upstream
-		# Each iteration creates a line segment "spacing" meters upstream of the previous
-		# Use the same line id for each segment in the reach
-		# The first station is postioned spacing/2 from the downstream end of the read
-		station=reach_len-(spacing/2)
-		pt=0
-		# Loop until the remaining length < spacing/2
-		while station>=spacing/2:
-			# concatenate (as strings) a point iterator with the line cat value to create a point cat 
-			pt+=1
-			pt_id=c + "%03d" % pt
-			st1=str(math.floor(station))
-			tmp.write("P "+pt_id+" "+c+" "+st1+"\n")
-			grass.message("Adding point: %s at position:%s" % (pt_id, st1))
-			station -= spacing
-			station_cnt+=1
-
-	tmp.close()
-	
-	grass.run_command('v.segment',input=invect, output=outvect, rules=tmp_stations, overwrite=True, quiet=True)
-	os.unlink(tmp_stations)
+	The manifest is kept in the directory of the cross sections vector map,
+	so it is removed and renamed together with the map. g.copy copies only the
+	files of the map itself, so a copy has no manifest (and -i creates all cross sections)
+	"""
+	f = grass.find_file(xsections, element='vector', mapset=grass.gisenv()['MAPSET'])['file']
+	if not f:
+		return None
+	return os.path.join(f, "hecras_manifest.json")
 
-	# Add coordinates to each station
-	grass.run_command('v.db.addtable', map=outvect, quiet=True)
-	grass.run_command('v.db.addcolumn', map=outvect, columns="x DOUBLE PRECISION, y DOUBLE PRECISION", quiet=True)
-	grass.run_command('v.to.db', map=outvect, option="coor", columns="x,y", quiet=True)
-	
-	# Also get the reach id for each station
-	# The point ids are created from line (reach) cats + three more digits.
-	# Dividing point id by 1000 returns original line id
-	grass.run_command('v.db.addcolumn', map=outvect, columns="reach_id INTEGER", quiet=True)
-	grass.run_command('v.to.db', map=outvect, option="query", columns="reach_id", qcolumn="cat/1000", quiet=True)
-	
-	return station_cnt
+
+def reach_hash(coords):
+	"""
+	Identity of the geometry of a reach
+	"""
+	return hashlib.sha1(np.ascontiguousarray(coords, dtype=np.float64).tobytes()).hexdigest()
 
 
-def create_cross_sections(invect, outvect, stations, spacing, width, cats):
-	""" 
-	Loop thru all river reaches, and for each reach 
-	begin at the end of each reach, and create a series of point pairs, at each "spacing" interval
-	and at "width/2" offset from the original river. 
-	Put these point pairs into a standard format ASCII vector line file,
-	then run v.in.ascii to create cross section line segments from each pair
+def read_manifest(xsections):
 	"""
-	# create temp file for point pairs
-	tmp_pairs = grass.tempfile()
-	#print tmp_pairs
-	tmp = open(tmp_pairs, 'w')
-	# Also create a temp map for the point pairs 
-	# (this is needed as an interim step to making the cross section line segments)
-	proc=os.getpid()
-	tmp_pairs_map="tmp_pairs_" + str(proc) 
-	# Each point will be placed at 1/2 width distance to the left and right of river
-	half_width= int(width)/2
-	pi = 1
-	for c in cats:
-		l=float(cats[c])
-		# Begin at 1/2 spacing from the beginning of the reach
-		station=l-(spacing/2)
-		# Stop at 1/2 spacing before the start of the reach
-		while station >= spacing/2:
-			stat=str(math.floor(station))
-			# write tthree points with same cat, at right and left of river line
-			# and one point one the line
-			tmp.write("P "+str(pi)+" "+c+" "+stat+ " " + str(-half_width)+"\n")
-			tmp.write("P "+str(pi)+" "+c+" "+stat+ " " + "0"+"\n")
-			tmp.write("P "+str(pi)+" "+c+" "+stat+ " " + str(half_width)+"\n")
-			station -= spacing
-			pi +=1
-
-	tmp.close()
-	grass.run_command('v.segment',input=invect, output=tmp_pairs_map, rules=tmp_pairs, overwrite=True, quiet=True)
-	
-	# Now dump the point pairs - selected by cats - into a new ASCII format file to create the lines
-	# First add a DB connection
-	grass.run_command('v.db.addtable', map=tmp_pairs_map, quiet=True)
-	# Now get a list of the cats from the tmp_pairs 
-	# Use -c flag to prevent printing of the "cat" column name
-	xsect_cats=[] 
-	cats=grass.read_command('v.db.select', map=tmp_pairs_map, columns="cat", quiet=True, flags="c")
-	for c in cats.split():
-		xsect_cats.append(c)
-	#print xsect_cats
-	
-	# Loop thru the cats and extract X-Y for each triple of points, 
-	# and put into a standard format ascii file as Line segments
-	coord_list=[]
-	tmp_xsects=grass.tempfile()
-	#print tmp_xsects
-	tmp=open(tmp_xsects,'w')
-	xsect_cnt=0
-	for i in range(len(xsect_cats)):
-		c=xsect_cats[i]
-		coords=grass.read_command('v.out.ascii', input=tmp_pairs_map, separator=",", quiet=True, where="cat="+c).split('\n')
-		coord_list.append(coords)
-		# coord_list is a list of strings, each string has two space separated entries. 
-		# Each entry is a comma separated coordinate pair and the cat value for those points 
-		# both points have the same cat
-	
-	for i in range(len(coord_list)):
-		p1, p2, p3 = coord_list[i][0], coord_list[i][1], coord_list[i][2]
-		x1, y1 = p1.split(',')[0], p1.split(',')[1]
-		x2, y2 = p2.split(',')[0], p2.split(',')[1]
-		x3, y3 = p3.split(',')[0], p3.split(',')[1]
-		cat = p1.split(',')[2]
-		# Write out a standard format ASCII file of line segments
-		# each segment with exactly two nodes
-		tmp.write("L 3 1\n")
-		tmp.write(" "+x1+" "+y1+"\n")
-		tmp.write(" "+x2+" "+y2+"\n")
-		tmp.write(" "+x3+" "+y3+"\n")
-		tmp.write(" 1 "+cat+"\n")
-		xsect_cnt += 1
-
-	tmp.close()
-	grass.run_command('v.in.ascii',input=tmp_xsects, output=outvect, format="standard", 
-				quiet=True, overwrite=True, flags='n')
-	# Use v.distance to upload values from the stations point vector to the new cross sections line vector
-	tmp_lines_map="tmp_lines_"+str(proc)
-	grass.run_command('v.db.addtable', map=outvect, columns="reach INTEGER, station_id INTEGER", quiet=True)
-	vdist_params='from='+stations+', to='+outvect+', output='+tmp_lines_map
-	grass.run_command('v.distance', from_=outvect, to=stations, 
-				upload="cat,to_attr", to_column="reach_id", column="station_id,reach", quiet=True) 
-
-	os.unlink(tmp_pairs)
-	grass.run_command('g.remove',type='vect', name=tmp_pairs_map, flags="f")
-	grass.run_command('g.remove',type='vect', name=tmp_lines_map, flags="f")
-
-	return xsect_cnt
-
-def create_xsection_intersects(invect, outvect):
-	""" 
-		Run v.clean on the cross section vector to find all intersection points
-		using the error=... option with tool=break to create a point vector 
+	The manifest of a previous run, or None
 	"""
-	proc=os.getpid()
-	dummy="dummy_out_" + str(proc)
+	path = manifest_file(xsections)
+	if not path or not os.path.exists(path):
+		return None
+	try:
+		with open(path, 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
 
-	grass.run_command('v.clean', input=invect, output=dummy, error=outvect, tool="break", quiet=True, overwrite=True)
-	info = grass.read_command('v.info', map=outvect, flags="t")
-	d=grass.parse_key_val(info)
-	grass.run_command('g.remove',type='vect', name=dummy, flags="f")
-	
-	return int(d['points'])
 
+def write_manifest(xsections, settings, reaches, layout, next_id, next_point):
+	"""
+	Record the settings of this run, and for each reach cat the hash of its geometry
+	and the ids of its stations, for an incremental rerun
+	"""
+	manifest = {
+		'settings': settings,
+		'next_id': next_id,
+		'next_point': next_point,
+		'reaches': dict((str(c), {'hash': reach_hash(reaches[c]), 'first_id': layout[c][0],
+				'count': len(layout[c][1])}) for c in layout),
+	}
+	with open(manifest_file(xsections), 'w') as f:
+		json.dump(manifest, f, sort_keys=True)
+
+
+@profiling.timed
+def update_xsections(stations, xsections, intersects, width, trim, reaches, spacing, adaptive, manifest, nprocs=1):
+	"""
+	Regenerate the stations and cross sections of the reaches that were added, removed
+	or changed since the run that wrote manifest, and splice them into the existing maps.
+	The stations of unchanged reaches keep their ids, those of changed and added reaches
+	get new ids following the last id used. Intersections are only looked for
+	between the new cross sections and their neighbours.
+	Returns the layout of all reaches, the next unused station id and intersection cat,
+	and the number of intersections; or None, before changing any map, when the kept
+	cross sections cannot be trimmed with the new ones (edited to other than 3 points)
+	"""
+	old = manifest['reaches']
+	changed = [c for c in sorted(reaches)
+			if str(c) not in old or old[str(c)]['hash'] != reach_hash(reaches[c])]
+	stale = [int(c) for c in old if int(c) not in reaches or int(c) in changed]
+	grass.message("%d reaches added or changed, %d reaches removed" % 
+			(len(changed), len([c for c in old if int(c) not in reaches])))
+
+	# The layout of the unchanged reaches, and new station ids for the changed ones
+	layout = OrderedDict((int(c), (old[c]['first_id'], range(old[c]['count'])))
+			for c in old if int(c) not in stale)
+	new_layout = station_layout(dict((c, reaches[c]) for c in changed), spacing, manifest['next_id'], adaptive)
+	next_id = manifest['next_id'] + sum([len(new_layout[c][1]) for c in new_layout])
+	layout.update(new_layout)
+	next_point = manifest['next_point']
+	if not changed and not stale:
+		grass.message("Cross sections are up to date")
+		return layout, next_id, next_point, None
+
+	stale_ids = []
+	for c in stale:
+		first_id, count = old[str(c)]['first_id'], old[str(c)]['count']
+		stale_ids.extend(range(first_id, first_id + count))
+	# The cross sections that are kept. Trimming takes left, center and right points,
+	# as v.xsections makes them, but the map may have been edited since
+	stale_set = set(stale_ids)
+	kept_lines = vector.read_lines(xsections)
+	kept_lines = OrderedDict((c, kept_lines[c]) for c in kept_lines if c not in stale_set)
+	if trim and any(len(line) != 3 for line in kept_lines.values()):
+		grass.message("Cross sections of vector map <%s> were edited (not 3 points each), "
+				"they cannot be trimmed: creating all cross sections" % xsections)
+		return None
+
+	# Remove the stations, cross sections and intersections of the stale reaches
+	vector.delete_features(stations, stale_ids)
+	vector.delete_features(xsections, stale_ids)
+	if stale:
+		reach_list = ",".join([str(c) for c in stale])
+		d = grass.read_command('v.db.select', map=intersects, columns="cat", flags="c", quiet=True,
+				where="reach_a IN (%s) OR reach_b IN (%s)" % (reach_list, reach_list))
+		vector.delete_features(intersects, [int(c) for c in d.split()])
+
+	# The reach of each cross section that is left
+	d = grass.read_command('v.db.select', map=xsections, columns="cat,reach", separator="=", flags="c", quiet=True)
+	kept_reach = grass.parse_key_val(d, val_type=int)
+	kept = [(kept_reach[str(c)], c, kept_lines[c]) for c in kept_lines]
+
+	features = build_features(reaches, new_layout, width, nprocs)
+	new = []
+	for text, station_rows, reach_xsects in features:
+		new.extend(reach_xsects)
+	if trim and new:
+		# Only the new cross sections are shortened
+		lines, remaining = geometry.trim_cross_sections([line for r, st, line in kept + new],
+				fixed=[True]*len(kept) + [False]*len(new))
+		new = [(r, st, line) for (r, st, old_line), line in zip(new, lines[len(kept):])]
+
+	tmp_file = grass.tempfile()
+	with open(tmp_file, 'w') as tmp:
+		rows = write_stations(tmp, features)
+	vector.append_features(stations, tmp_file, rows)
+	with open(tmp_file, 'w') as tmp:
+		rows = write_cross_sections(tmp, new)
+	vector.append_features(xsections, tmp_file, rows)
 
+	# Intersections involving at least one of the new cross sections
+	xsects = kept + new
+	crossings = geometry.line_intersections([line for r, st, line in xsects],
+			only=[False]*len(kept) + [True]*len(new))
+	rows = intersect_rows(crossings, xsects, next_point)
+	with open(tmp_file, 'w') as tmp:
+		write_intersects(tmp, rows)
+	vector.append_features(intersects, tmp_file, rows)
+	os.unlink(tmp_file)
+	grass.message("Created %d stations and cross sections" % (len(new)))
+
+	d = grass.read_command('v.db.select', map=intersects, columns="cat", flags="c", quiet=True)
+	return layout, next_id, next_point + len(rows), len(d.split())
+
+
+@profiling.timed
 def create_river_network(invect, outvect):
 	"""
 	Prepare the input river network vector by:
 	possibly smoothing the line, and
 	adding several columns to the vector attribute table.
 	THe added columns include start and end points for output to HEC-RAS
+	Returns the reaches, an OrderedDict of reach cat -> line vertices
 	"""	
 
 	thresh = options['threshold']
@@ -266,40 +295,27 @@ def create_river_network(invect, outvect):
 		grass.run_command('v.generalize', input=invect, output=outvect, _method='snakes',
 			threshold=thresh, overwrite=True, quiet=True)
 	
-	# Add a reach length column to the river vector
-	# First check if column exists
-	columns_exist = grass.vector_columns(outvect, int(layer)).keys()
-	if not "reach_len" in columns_exist:
-		grass.run_command('v.db.addcolumn', map=outvect, columns="reach_len DOUBLE PRECISION", quiet=True)
-	# Also add columns for start and end point of each reach
-	if not "start_x" in columns_exist:
-		grass.run_command('v.db.addcolumn', map=outvect, columns="start_x DOUBLE PRECISION", quiet=True)
-	if not "start_y" in columns_exist:
-		grass.run_command('v.db.addcolumn', map=outvect, columns="start_y DOUBLE PRECISION", quiet=True)
-	if not "start_elev" in columns_exist:
-		grass.run_command('v.db.addcolumn', map=outvect, columns="start_elev DOUBLE PRECISION", quiet=True)
-	if not "end_x" in columns_exist:
-		grass.run_command('v.db.addcolumn', map=outvect, columns="end_x DOUBLE PRECISION", quiet=True)
-	if not "end_y" in columns_exist:
-		grass.run_command('v.db.addcolumn', map=outvect, columns="end_y DOUBLE PRECISION", quiet=True)
-	if not "end_elev" in columns_exist:
-		grass.run_command('v.db.addcolumn', map=outvect, columns="end_elev DOUBLE PRECISION", quiet=True)
-	# Now update those columns
-	grass.run_command('v.to.db',map=outvect, option="length", columns="reach_len", quiet=True)
-	grass.run_command('v.to.db',map=outvect, option="start", columns="start_x,start_y",quiet=True)
-	grass.run_command('v.to.db',map=outvect, option="end", columns="end_x,end_y", quiet=True)
-	d=grass.read_command('v.db.select',map=outvect, separator="=", columns="cat,reach_len", flags="c")
-
-	# Initialize dict of reach categories with their lengths
-	# Each key in the dictionary is the cat of a river reach
-	# each value is the length of that reach
-	reach_cats=grass.parse_key_val(d, val_type=float)
-
-	return reach_cats
+	# The geometry of all reaches, with one v.out.ascii call
+	reaches = vector.read_lines(outvect, layer)
+	
+	# Reach length, and start and end point of each reach for output to HEC-RAS,
+	# computed from the geometry and written to the river table in one transaction
+	# (adding the columns that do not exist yet)
+	rows = []
+	for c in reaches:
+		coords = reaches[c]
+		rows.append((c, geometry.polyline_length(coords), coords[0,0], coords[0,1], coords[-1,0], coords[-1,1]))
+	double = "DOUBLE PRECISION"
+	vector.update_table(outvect, [("reach_len", double), ("start_x", double), ("start_y", double),
+				("end_x", double), ("end_y", double)], rows, layer,
+				add=[("start_elev", double), ("end_elev", double)])
+
+	return reaches
 	
 
 
 def main():
+	profiling.start(options['profile'])
 	river = options['input']
 	stations = options['stations']
 	xsections = options['xsections']
@@ -307,13 +323,26 @@ def main():
 	spacing = float(options['spacing'])
 	smooth_river = options['smooth_river']
 	thresh = options['threshold']
-	layer = options['layer']
 	intersects = options['intersects']
+	nprocs = int(options['nprocs'])
+	min_spacing = options['min_spacing']
+	max_spacing = options['max_spacing']
+	max_turn = float(options['max_turn'])
 
 	# does input rivers map exist in CURRENT mapset?
 	mapset = grass.gisenv()['MAPSET']
 	if not grass.find_file(river, element = 'vector', mapset = mapset)['file']:
 		grass.fatal(_("Vector map <%s> not found in current mapset") % river)
+	if nprocs < 1:
+		grass.fatal("nprocs must be at least 1")
+	# Adaptive spacing when both min_spacing and max_spacing are given
+	adaptive = None
+	if min_spacing or max_spacing:
+		if not (min_spacing and max_spacing):
+			grass.fatal("Adaptive spacing needs both min_spacing and max_spacing")
+		adaptive = (float(min_spacing), float(max_spacing), max_turn)
+		if not 0 < adaptive[0] <= adaptive[1] or max_turn <= 0:
+			grass.fatal("Adaptive spacing needs 0 < min_spacing <= max_spacing, and max_turn > 0")
 
 	if (flags['s']):
 		if not smooth_river or not thresh:
@@ -324,17 +353,53 @@ def main():
 		grass.run_command('g.copy', vect='%s,%s' % (river,smooth_river), overwrite=True)
 		
 	# The work starts here
-	reach_cats = create_river_network(river, smooth_river)
-	# Call functions to create new vectors
-	station_count = create_stations_schematic(smooth_river, stations, spacing, reach_cats)
-	grass.message("Created %d stations" % station_count)
-	xsection_count = create_cross_sections(smooth_river, xsections, stations, spacing, width, reach_cats)
-	grass.message("Created %d cross sections" % xsection_count)
-	intersect_cnt=create_xsection_intersects(xsections, intersects)
+	reaches = create_river_network(river, smooth_river)
+	settings = {'stations': stations, 'intersects': intersects, 'spacing': spacing,
+			'width': width, 'trim': bool(flags['t']), 'adaptive': adaptive and list(adaptive)}
+	manifest = None
+	if flags['i']:
+		manifest = read_manifest(xsections)
+		outputs = [grass.find_file(v, element='vector', mapset=mapset)['file'] for v in (stations, intersects)]
+		if manifest is None:
+			grass.message("No manifest of a previous run in vector map <%s> (g.copy does not copy it), "
+					"creating all cross sections" % xsections)
+		elif manifest.get('settings') != settings:
+			grass.message("The manifest of vector map <%s> is of a run with other options, "
+					"creating all cross sections" % xsections)
+			manifest = None
+		elif not all(outputs):
+			grass.message("Vector map <%s> or <%s> not found in current mapset, creating all cross sections"
+					% (stations, intersects))
+			manifest = None
+	if manifest is not None:
+		updated = update_xsections(stations, xsections, intersects,
+				width, flags['t'], reaches, spacing, adaptive, manifest, nprocs)
+		if updated is None:
+			manifest = None
+		else:
+			layout, next_id, next_point, intersect_cnt = updated
+			if intersect_cnt is None:
+				profiling.finish()
+				cleanup()
+				return 0
+	if manifest is None:
+		# Call functions to create new vectors
+		layout = station_layout(reaches, spacing, adaptive=adaptive)
+		features = build_features(reaches, layout, width, nprocs)
+		station_count = create_stations_schematic(stations, features)
+		grass.message("Created %d stations" % station_count)
+		xsects = all_cross_sections(features, flags['t'])
+		create_cross_sections(xsections, xsects)
+		grass.message("Created %d cross sections" % len(xsects))
+		intersect_cnt=create_xsection_intersects(xsects, intersects)
+		next_id = 1 + sum([len(layout[c][1]) for c in layout])
+		next_point = intersect_cnt + 1
+	write_manifest(xsections, settings, reaches, layout, next_id, next_point)
 	if (intersect_cnt>0):
 		grass.message("  *** Found %d intersection points ***" % intersect_cnt, flag="w")
 		grass.message("  *** Correct these cross sections before continuing  ***", flag="w")
 
+	profiling.finish()
 	cleanup()
 	return 0
 